@@ -0,0 +1,106 @@
+import os, shutil
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from subprocess_build import temp_path
+
+
+_FICLONE = 0x40049409  # Linux ioctl: share the source's extents (reflink).
+
+
+class FileCopier:
+    """
+    Copies files with the fastest method that works: a reflink where the
+    filesystem supports it, else a copy in the kernel (`copy_file_range`,
+    then `sendfile`), else through userspace. Hardlinks are made only on
+    request (`link`). A method that fails between two devices is not tried
+    between them again. Safe to share between threads.
+    """
+
+    def __init__(self) -> None:
+        # (source device, target device) pairs where a method has failed
+        self._unsupported: dict[str, set[tuple[int, int]]] = {
+            'link': set(), 'reflink': set(), 'copy_file_range': set(),
+            'sendfile': set()
+        }
+
+    def link(self, s: Path, t: Path) -> bool:
+        """Hardlinks `t` to `s`, replacing `t`. Returns False if unsupported."""
+        devs = (os.stat(s).st_dev, os.stat(t.parent).st_dev)
+        if devs[0] != devs[1] or devs in self._unsupported['link']:
+            return False
+        tmp = temp_path(t)
+        try:
+            os.link(s, tmp)
+            os.replace(tmp, t)
+            return True
+        except OSError:
+            self._unsupported['link'].add(devs)
+            tmp.unlink(missing_ok=True)
+            return False
+
+    def reflink(self, s: Path, t: Path) -> bool:
+        """
+        Creates `t` as a reflink of `s`, with its metadata. Returns False (and
+        leaves no `t`) if unsupported.
+        """
+        devs = (os.stat(s).st_dev, os.stat(t.parent).st_dev)
+        if fcntl is None or devs in self._unsupported['reflink']:
+            return False
+        with s.open('rb') as sf, t.open('wb') as tf:
+            done = self._reflink(sf.fileno(), tf.fileno(), devs)
+        if not done:
+            t.unlink()
+            return False
+        shutil.copystat(s, t)
+        return True
+
+    def copy(self, s: Path, t: Path) -> None:
+        """Copies `s` to `t` (see `copy_data`), with metadata as `shutil.copy2`."""
+        with s.open('rb') as sf, t.open('wb') as tf:
+            devs = (os.fstat(sf.fileno()).st_dev, os.fstat(tf.fileno()).st_dev)
+            self.copy_data(sf.fileno(), tf.fileno(), devs)
+        shutil.copystat(s, t)
+
+    def copy_data(self, s_fd: int, t_fd: int, devs: tuple[int, int]) -> None:
+        """Copies the data of `s_fd` to the (empty) `t_fd`."""
+        if self._reflink(s_fd, t_fd, devs):
+            return
+        for method in ('copy_file_range', 'sendfile'):
+            if not hasattr(os, method) or devs in self._unsupported[method]:
+                continue
+            offset = 0
+            try:
+                while True:
+                    if method == 'copy_file_range':
+                        n = os.copy_file_range(s_fd, t_fd, 1 << 30)
+                    else:
+                        n = os.sendfile(t_fd, s_fd, offset, 1 << 30)
+                    if n == 0: break
+                    offset += n
+            except OSError:
+                if offset: raise
+                n = 0
+            if offset or os.fstat(s_fd).st_size == 0:
+                return
+            # Nothing copied from a non-empty file: this method doesn't work here
+            self._unsupported[method].add(devs)
+        os.lseek(s_fd, 0, os.SEEK_SET)
+        while chunk := os.read(s_fd, 1 << 20):
+            view = memoryview(chunk)
+            while view:
+                view = view[os.write(t_fd, view):]
+
+    def _reflink(self, s_fd: int, t_fd: int, devs: tuple[int, int]) -> bool:
+        if fcntl is None or devs in self._unsupported['reflink']:
+            return False
+        try:
+            fcntl.ioctl(t_fd, _FICLONE, s_fd)
+            return True
+        except OSError:
+            self._unsupported['reflink'].add(devs)
+            return False
@@ -1,15 +1,492 @@
+import hashlib, heapq, json, os, re, shutil, time
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
-from subprocess_build import cmd, CmdResult
+from typing import Iterable
+from subprocess import CalledProcessError, CompletedProcess
+from subprocess_build import cmd, cmd_cached, CmdResult
 
 
 def dotnet(repo: Path, *args: str) -> CmdResult:
     return cmd(['dotnet', *args], cwd=repo)
 
-def dotnet_build(repo: Path, *args: str) -> CmdResult:
-    return dotnet(repo, 'build', *args)
+def dotnet_build(repo: Path, *args: str, force: bool = False) -> CmdResult:
+    """
+    Runs `dotnet build`, unless nothing it depends on changed since the last
+    successful build with the same arguments (see `dotnet_fingerprint`).
+    """
+    return _dotnet_if_stale(repo, 'build', args, force)
 
-def dotnet_restore(repo: Path, *args: str) -> CmdResult:
-    return dotnet(repo, 'restore', *args)
+def dotnet_restore(repo: Path, *args: str, force: bool = False) -> CmdResult:
+    """ Runs `dotnet restore`, unless it is up to date (as `dotnet_build`). """
+    return _dotnet_if_stale(repo, 'restore', args, force)
 
 def dotnet_test(repo: Path, *args: str) -> CmdResult:
     return dotnet(repo, 'test', *args)
+
+
+# --- Up-to-date checks
+
+_project_suffixes = ('.csproj', '.fsproj', '.vbproj')
+_skip_dirs = ('bin', 'obj', 'node_modules', 'TestResults')
+_ancestor_inputs = (
+    'Directory.Build.props', 'Directory.Build.targets',
+    'Directory.Packages.props', 'global.json', 'NuGet.config', 'nuget.config',
+    '.editorconfig',
+)
+
+
+def _project_references(project: Path) -> list[Path]:
+    """ The projects referenced by `project` via `ProjectReference` items. """
+    try:
+        root = ET.parse(project).getroot()
+    except (OSError, ET.ParseError):
+        return []
+    refs: list[Path] = []
+    for node in root.iter():
+        include = node.get('Include')
+        if not node.tag.endswith('ProjectReference') or not include:
+            continue
+        if '$(' in include:
+            continue  # Needs MSBuild evaluation.
+        refs.append((project.parent / include.replace('\\', '/')).resolve())
+    return refs
+
+
+def _walk_inputs(root: Path) -> tuple[list[Path], list[Path]]:
+    """
+    Lists the build inputs under `root` - every file outside build output
+    and hidden directories, since any of them may be an item (content,
+    embedded resource, etc.) - and the projects among them.
+    """
+    files: list[Path] = []
+    projects: list[Path] = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [
+            d for d in dirnames
+            if d not in _skip_dirs and not d.startswith('.')
+        ]
+        for name in filenames:
+            files.append(Path(dirpath) / name)
+            if name.endswith(_project_suffixes):
+                projects.append(Path(dirpath) / name)
+    return files, projects
+
+
+def _sdk_version(repo: Path) -> str:
+    # `dotnet --version` depends on any global.json above `repo`, and on the
+    # SDKs installed next to the host (listed in its `sdk` directory).
+    inputs = [ d / 'global.json' for d in (repo, *repo.parents) ]
+    exe = shutil.which('dotnet')
+    if exe:
+        inputs.append(Path(exe).resolve().parent / 'sdk')
+    return cmd_cached(
+        ['dotnet', '--version'],
+        inputs = inputs,
+        cwd = repo
+    ).out.strip()
+
+
+def dotnet_fingerprint(repo: Path, *args: str) -> tuple[str, list[Path]]:
+    """
+    Fingerprints the inputs of a dotnet build in `repo`: the arguments, the
+    SDK version, and the stat data of the files under `repo` and any project
+    it references (see `_walk_inputs`), as well as Directory.Build.*,
+    global.json, NuGet.config and .editorconfig files in parent directories.
+    Returns the fingerprint and the projects found under `repo`.
+    """
+    repo = repo.resolve()
+    h = hashlib.sha256()
+    h.update(repr(args).encode())
+    h.update(_sdk_version(repo).encode())
+    roots = [ repo ]
+    seen: set[Path] = set()
+    files: set[Path] = set()
+    own_projects: list[Path] = []
+    while roots:
+        root = roots.pop()
+        if root in seen or any(root.is_relative_to(s) for s in seen):
+            continue
+        seen.add(root)
+        root_files, projects = _walk_inputs(root)
+        files.update(root_files)
+        if root == repo:
+            own_projects = projects
+        for project in projects:
+            for ref in _project_references(project):
+                files.add(ref)
+                if not ref.parent.is_relative_to(repo):
+                    roots.append(ref.parent)
+        files.update(
+            d / name
+            for d in (root, *root.parents)
+            for name in _ancestor_inputs
+        )
+    for file in sorted(files):
+        try:
+            st = file.stat()
+        except OSError:
+            continue
+        h.update(f'{file}\0{st.st_mtime_ns}\0{st.st_size}\n'.encode())
+    return h.hexdigest(), own_projects
+
+
+def _dotnet_if_stale(
+    repo: Path,
+    verb: str,
+    args: tuple[str, ...],
+    force: bool
+) -> CmdResult:
+    fingerprint, projects = dotnet_fingerprint(repo, verb, *args)
+    # One stamp per argument list, so differently configured builds of the
+    # same directory don't invalidate each other.
+    args_hash = hashlib.sha256(repr(args).encode()).hexdigest()[:16]
+    stamp = repo / 'obj' / f'buildtools-{verb}-{args_hash}.stamp'
+    outputs = [ p.parent / 'obj' / 'project.assets.json' for p in projects ]
+    if verb == 'build':
+        outputs += [ p.parent / 'bin' for p in projects ]
+    if (
+        not force
+        and stamp.is_file()
+        and stamp.read_text() == fingerprint
+        and all(o.exists() for o in outputs)
+    ):
+        return CmdResult(CompletedProcess(
+            ['dotnet', verb, *args], 0, f"Up to date: {repo}\n", ''
+        ))
+    result = dotnet(repo, verb, *args)
+    if result.rc == 0:
+        os.makedirs(stamp.parent, exist_ok=True)
+        stamp.write_text(fingerprint)
+    return result
+
+
+# --- Project graph builds
+
+def _project_graph(projects: Iterable[Path]) -> dict[Path, list[Path]]:
+    """ Maps each project, and every project it references, to its references. """
+    graph: dict[Path, list[Path]] = {}
+    pending = [ p.resolve() for p in projects ]
+    while pending:
+        project = pending.pop()
+        if project in graph:
+            continue
+        graph[project] = [ r for r in _project_references(project) if r.is_file() ]
+        pending += graph[project]
+    return graph
+
+
+def dotnet_build_graph(
+    projects: Iterable[Path],
+    *args: str,
+    max_workers: int|None = None,
+    force: bool = False
+) -> dict[Path, CmdResult]:
+    """
+    Builds `projects` and everything they reference, in dependency order.
+
+    Projects whose references are all built are restored and built
+    concurrently (up to `max_workers` at a time) with `--no-dependencies`,
+    each through the up-to-date checks of `dotnet_restore`/`dotnet_build`.
+    After the first failure no new builds are started; the running ones are
+    allowed to finish and the failure is raised. The critical path is
+    printed at the end.
+    """
+    graph = _project_graph(projects)
+    dependents: dict[Path, list[Path]] = { p: [] for p in graph }
+    for project, refs in graph.items():
+        for ref in refs:
+            dependents[ref].append(project)
+    waiting = { p: len(refs) for p, refs in graph.items() }
+    times: dict[Path, tuple[float, float]] = {}
+
+    def build_one(project: Path) -> CmdResult:
+        started = time.time()
+        result = dotnet_restore(
+            project.parent, str(project), '--no-dependencies', force=force
+        )
+        if result.rc == 0:
+            result = dotnet_build(
+                project.parent, str(project), '--no-dependencies', '--no-restore',
+                *args, force=force
+            )
+        times[project] = (started, time.time())
+        return result
+
+    results: dict[Path, CmdResult] = {}
+    failed: CmdResult|None = None
+    with ThreadPoolExecutor(max(1, max_workers or os.cpu_count() or 1)) as pool:
+        running: dict[Future[CmdResult], Path] = {}
+        for project in graph:
+            if waiting[project] == 0:
+                running[pool.submit(build_one, project)] = project
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                project = running.pop(future)
+                results[project] = result = future.result()
+                if result.rc != 0:
+                    failed = failed or result
+                    continue
+                if failed:
+                    continue
+                for dependent in dependents[project]:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0:
+                        running[pool.submit(build_one, dependent)] = dependent
+    if failed:
+        failed.check()
+    if len(results) < len(graph):
+        raise ValueError(
+            "Project reference cycle between: "
+            + ', '.join(sorted(p.name for p in graph if p not in results))
+        )
+    _print_critical_path(graph, times)
+    return results
+
+
+def _print_critical_path(
+    graph: dict[Path, list[Path]],
+    times: dict[Path, tuple[float, float]]
+) -> None:
+    # Walks back from the last project to finish, through whichever of its
+    # references finished last (i.e. the one it was waiting on).
+    if not times:
+        return
+    path: list[Path] = []
+    node: Path|None = max(times, key=lambda p: times[p][1])
+    while node is not None:
+        path.append(node)
+        node = max(graph[node], key=lambda p: times[p][1], default=None)
+    path.reverse()
+    total = times[path[-1]][1] - times[path[0]][0]
+    print(f"Critical path ({total:.1f}s):")
+    for p in path:
+        print(f"  {p.name} ({times[p][1] - times[p][0]:.1f}s)")
+
+
+# --- Sharded tests
+
+_re_test_sdk = re.compile(r'Microsoft\.NET\.Test\.Sdk|<IsTestProject>\s*true', re.IGNORECASE)
+_re_test_attr = re.compile(r'\[\s*(Fact|Theory|Test|TestCase|TestMethod|DataTestMethod)\b')
+_re_namespace = re.compile(r'^\s*namespace\s+([\w.]+)', re.MULTILINE)
+_re_class = re.compile(r'^\s*(?:\w+\s+)*class\s+(\w+)', re.MULTILINE)
+
+
+class TestSummary:
+    """ The merged results of `dotnet_test_sharded`. """
+    def __init__(self) -> None:
+        self.counters: dict[str, int] = {}  # TRX counters, summed over shards.
+        self.failed_tests: list[str] = []
+        self.results: list[CmdResult] = []
+        self.trx_files: list[Path] = []
+
+    @property
+    def ok(self) -> bool:
+        return (
+            all(r.rc == 0 for r in self.results)
+            and self.counters.get('failed', 0) == 0
+        )
+
+    def check(self) -> None:
+        """
+        Raises `CalledProcessError` if a shard failed or the TRX files report
+        failed tests (even if every `dotnet test` exited with 0).
+        """
+        if self.ok:
+            return
+        if self.failed_tests:
+            print(f"Failed tests ({len(self.failed_tests)}):")
+            for name in self.failed_tests:
+                print(f"  {name}")
+        for result in self.results:
+            result.check()
+        raise CalledProcessError(
+            1,
+            self.results[0].result.args if self.results else ['dotnet', 'test'],
+            f"{self.counters.get('failed', 0)} tests failed.\n"
+        )
+
+
+def _test_projects(repo: Path) -> list[Path]:
+    return [
+        p for p in _walk_inputs(repo)[1]
+        if _re_test_sdk.search(p.read_text(errors='replace'))
+    ]
+
+
+def _test_classes(project: Path) -> list[str]:
+    """
+    Finds test classes by scanning the project's C# sources for test
+    attributes. Projects in other languages yield none, and run unsplit.
+    This is a heuristic: tests it misses (nested classes, tests inherited
+    from another file) run in the project's catch-all unit (see
+    `dotnet_test_sharded`).
+    """
+    classes: list[str] = []
+    for file in _walk_inputs(project.parent)[0]:
+        if file.suffix != '.cs':
+            continue
+        text = file.read_text(errors='replace')
+        if not _re_test_attr.search(text):
+            continue
+        namespaces = [ (m.start(), m.group(1)) for m in _re_namespace.finditer(text) ]
+        for m in _re_class.finditer(text):
+            # The closest namespace declared before the class.
+            ns = [ name for pos, name in namespaces if pos < m.start() ]
+            classes.append(f'{ns[-1]}.{m.group(1)}' if ns else m.group(1))
+    return sorted(set(classes))
+
+
+# The unit of a project's tests outside all the classes `_test_classes`
+# found for it.
+_rest = '*'
+
+def _rest_filter(classes: list[str]) -> str:
+    return '(' + '&'.join(f'FullyQualifiedName!~{c}.' for c in classes) + ')'
+
+
+def _plan_shards(
+    units: list[tuple[Path, str|None]],
+    timings: dict[str, float],
+    workers: int
+) -> list[list[tuple[Path, str|None]]]:
+    """
+    Balances units over `workers` shards, longest expected duration first
+    onto the least loaded shard, using timings from previous runs.
+    """
+    known = [ t for t in timings.values() if t > 0 ]
+    default = sum(known) / len(known) if known else 1.0
+    expected = lambda u: timings.get(_unit_key(u), default)
+    shards: list[list[tuple[Path, str|None]]] = [ [] for _ in range(workers) ]
+    loads = [ (0.0, i) for i in range(workers) ]
+    for unit in sorted(units, key=expected, reverse=True):
+        load, i = heapq.heappop(loads)
+        shards[i].append(unit)
+        heapq.heappush(loads, (load + expected(unit), i))
+    return [ s for s in shards if s ]
+
+
+def _unit_key(unit: tuple[Path, str|None]) -> str:
+    project, test_class = unit
+    return f'{project}::{test_class}' if test_class else str(project)
+
+
+def _read_trx(
+    trx: Path,
+    summary: TestSummary,
+    class_times: dict[str, float]
+) -> None:
+    root = ET.parse(trx).getroot()
+    counters = root.find('{*}ResultSummary/{*}Counters')
+    if counters is not None:
+        for k, v in counters.attrib.items():
+            if v.isdigit():
+                summary.counters[k] = summary.counters.get(k, 0) + int(v)
+    classes = {
+        test.get('id'): method.get('className', '')
+        for test in root.iterfind('{*}TestDefinitions/{*}UnitTest')
+        for method in test.iterfind('{*}TestMethod')
+    }
+    for result in root.iterfind('{*}Results/{*}UnitTestResult'):
+        if result.get('outcome') == 'Failed':
+            summary.failed_tests.append(result.get('testName', '?'))
+        h, m, sec = (result.get('duration') or '0:0:0').split(':')
+        class_name = classes.get(result.get('testId'), '')
+        class_times[class_name] = (
+            class_times.get(class_name, 0.0)
+            + int(h) * 3600 + int(m) * 60 + float(sec)
+        )
+
+
+def dotnet_test_sharded(
+    repo: Path,
+    *args: str,
+    workers: int|None = None,
+    by_class: bool = False,
+    build_args: tuple[str, ...] = (),
+    results_dir: Path|None = None
+) -> TestSummary:
+    """
+    Runs the test projects under `repo` as parallel `dotnet test` shards.
+
+    The tests are built once (with `build_args`, via `dotnet_build`), then
+    split into units - whole projects, or test classes selected with
+    `--filter` if `by_class` is True, plus one unit per project for the
+    tests outside the classes found - and balanced over `workers` shards
+    using the durations of previous runs. Each shard runs its units one
+    project at a time, writing a TRX file to `results_dir`; the TRX files
+    are merged into the returned summary.
+    """
+    repo = repo.resolve()
+    workers = max(1, workers or os.cpu_count() or 1)
+    results_dir = (results_dir or repo / 'TestResults' / 'shards').resolve()
+    timings_file = repo / 'obj' / 'buildtools-test-timings.json'
+    try:
+        timings: dict[str, float] = json.loads(timings_file.read_text())
+    except (OSError, ValueError):
+        timings = {}
+
+    dotnet_build(repo, *build_args).check()
+    units: list[tuple[Path, str|None]] = []
+    project_classes: dict[Path, list[str]] = {}
+    for project in _test_projects(repo):
+        classes = project_classes[project] = _test_classes(project) if by_class else []
+        if classes:
+            units += [ (project, c) for c in classes ] + [ (project, _rest) ]
+        else:
+            units.append((project, None))
+    shards = _plan_shards(units, timings, workers)
+
+    def run_shard(n: int, shard: list[tuple[Path, str|None]]) -> list[tuple[CmdResult, Path, list[tuple[Path, str|None]]]]:
+        by_project: dict[Path, list[tuple[Path, str|None]]] = {}
+        for unit in shard:
+            by_project.setdefault(unit[0], []).append(unit)
+        runs: list[tuple[CmdResult, Path, list[tuple[Path, str|None]]]] = []
+        for i, (project, project_units) in enumerate(by_project.items()):
+            trx = results_dir / f'shard{n}-{i}.trx'
+            trx.unlink(missing_ok=True)
+            test_args = [ str(project), '--no-build', *build_args, *args ]
+            filters = [
+                _rest_filter(project_classes[project]) if c == _rest
+                else f'FullyQualifiedName~{c}.'
+                for _, c in project_units if c
+            ]
+            if filters:
+                test_args += [ '--filter', '|'.join(filters) ]
+            test_args += [
+                '--logger', f'trx;LogFileName={trx.name}',
+                '--results-directory', str(results_dir),
+            ]
+            runs.append((dotnet(repo, 'test', *test_args), trx, project_units))
+        return runs
+
+    summary = TestSummary()
+    with ThreadPoolExecutor(len(shards) or 1) as pool:
+        shard_runs = list(pool.map(run_shard, range(len(shards)), shards))
+    for result, trx, project_units in (r for runs in shard_runs for r in runs):
+        summary.results.append(result)
+        class_times: dict[str, float] = {}
+        if trx.is_file():
+            summary.trx_files.append(trx)
+            _read_trx(trx, summary, class_times)
+        for unit in project_units:
+            if unit[1] is None:
+                timings[_unit_key(unit)] = result.wall_s or 0.0
+            elif unit[1] == _rest:
+                listed = project_classes[unit[0]]
+                timings[_unit_key(unit)] = sum((
+                    t for name, t in class_times.items()
+                    if not any(name.startswith(f'{c}.') or name == c for c in listed)
+                ), 0.0)
+            else:
+                timings[_unit_key(unit)] = class_times.get(unit[1], 0.0)
+
+    os.makedirs(timings_file.parent, exist_ok=True)
+    timings_file.write_text(json.dumps(timings, indent=2))
+    c = summary.counters
+    print(
+        f"Tests: {c.get('passed', 0)} passed, {c.get('failed', 0)} failed, "
+        f"{c.get('total', 0)} total ({len(shards)} shards)."
+    )
+    return summary
@@ -3,7 +3,8 @@ from pathlib import Path
 from typing import Any, Iterable, Mapping
 import zipfile
 
-from subprocess_build import cmd
+from subprocess_build import cmd_cached
+from walk_build import PathMatcher, walk
 
 
 _fusion_python_globs = [
@@ -35,7 +36,7 @@ def _get_python_interpreter() -> Path:
 _re_py_version = re.compile(r'^\s*Python\s*([\d\.]+)\s*$')
 def get_python_version() -> str:
     fpy_path = _get_python_interpreter()
-    python_version = cmd([fpy_path, '--version']).out
+    python_version = cmd_cached([fpy_path, '--version']).out
     match = _re_py_version.match(python_version)
     if not match:
         raise ValueError(
@@ -138,14 +139,11 @@ def _build_packages(
 ) -> None:
     target = build_dir / name / 'Packages'
     os.makedirs(target, exist_ok=True)
+    ignore = PathMatcher(package_suffix_blacklist)
     for packages_dir in packages_dirs:
-        for package in packages_dir.glob('*'):
-            if package.name.endswith(package_suffix_blacklist):
-                continue
-            if package.is_dir():
-                shutil.copytree(package, target / package.name, dirs_exist_ok=True)
-            else:
-                shutil.copy(package, target / package.name)
+        for rel, entry in walk(packages_dir, ignore, follow_symlinks=True):
+            os.makedirs((target / rel).parent, exist_ok=True)
+            shutil.copy2(entry.path, target / rel)
 
 
 def build(
@@ -1,16 +1,24 @@
+import hashlib, json, mmap, os, re, stat, struct, time
 from pathlib import Path
-from subprocess_build import cmd, CmdResult
+from typing import Iterator, NamedTuple
+from subprocess_build import cmd, CmdResult, write_atomic
 
 
 def git(repo: Path, *args: str) -> CmdResult:
     return cmd(['git', *args], cwd=repo)
 
 def git_hash(repo: Path, short: bool = True) -> str:
+    result = _native_hash(repo, short)
+    if result is not None:
+        return result
     args: list[str] = []
     if short: args.append('--short')
     return git(repo, 'rev-parse', *args, 'HEAD').out.strip()
 
 def git_dirty(repo: Path) -> bool:
+    result = _fast_dirty(repo)
+    if result is not None:
+        return result
     return git(repo, 'status', '--porcelain').out.strip() != ''
 
 def git_hash_dirty(repo: Path) -> str:
@@ -18,3 +26,544 @@ def git_hash_dirty(repo: Path) -> str:
     if git_dirty(repo):
         result += '-dirty'
     return result
+
+def git_files(path: Path, untracked: bool = False) -> Iterator[Path]:
+    """
+    Yields the files git tracks under `path` (as recorded in the index, so
+    deleted files may still be listed), plus the untracked files that are not
+    ignored if `untracked` is True.
+    Reads the index directly where possible; otherwise makes a single
+    `git ls-files -z` call. Paths are yielded relative to `path`'s form.
+    """
+    dirs = _git_dirs(path)
+    index = _read_index(dirs[1]) if dirs else None
+    if dirs is None or index is None or untracked:
+        args = ['ls-files', '-z', '--cached']
+        if untracked: args += ['--others', '--exclude-standard']
+        for name in git(path, *args).out.split('\0'):
+            if name:
+                yield path / name
+        return
+    prefix = path.resolve().relative_to(dirs[0]).as_posix()
+    prefix = '' if prefix == '.' else prefix + '/'
+    last = None
+    for e in index[1]:
+        if e.path == last or not e.path.startswith(prefix):
+            continue  # (Conflicted paths have an entry per stage.)
+        last = e.path
+        yield path / e.path[len(prefix):]
+
+
+# --- Native repository reader
+#
+# Reads HEAD straight from the repository files to avoid forking `git`.
+# Each helper returns None for layouts it does not understand (bare or
+# `$GIT_DIR` repositories, reftable, SHA-256, alternates, multi-pack
+# indexes, a configured `core.abbrev`, ...), and callers then fall back to
+# the `git` CLI.
+
+_re_sha1 = re.compile(r'^[0-9a-f]{40}$')
+
+def _git_dirs(repo: Path) -> tuple[Path, Path, Path]|None:
+    """
+    Finds the repository containing `repo`.
+    Returns `(worktree, git_dir, common_dir)`; the last two differ for linked
+    worktrees.
+    """
+    if 'GIT_DIR' in os.environ or 'GIT_COMMON_DIR' in os.environ:
+        return None
+    repo = repo.resolve()
+    for d in (repo, *repo.parents):
+        dot = d / '.git'
+        if dot.is_dir():
+            git_dir = dot
+        elif dot.is_file():
+            content = dot.read_text().strip()
+            if not content.startswith('gitdir:'):
+                return None
+            git_dir = (d / content[len('gitdir:'):].strip()).resolve()
+        else:
+            continue
+        common_dir = git_dir
+        commondir_file = git_dir / 'commondir'
+        if commondir_file.is_file():
+            common_dir = (git_dir / commondir_file.read_text().strip()).resolve()
+        if not _supported_config(common_dir):
+            return None
+        return d, git_dir, common_dir
+    return None
+
+
+def _xdg_git_file(name: str) -> Path:
+    xdg = os.environ.get('XDG_CONFIG_HOME')
+    return (Path(xdg) if xdg else Path.home() / '.config') / 'git' / name
+
+
+def _git_config(common_dir: Path) -> str:
+    """ The raw text of the repository, global and XDG git config files. """
+    texts: list[str] = []
+    for config in (
+        common_dir / 'config',
+        Path.home() / '.gitconfig',
+        _xdg_git_file('config')
+    ):
+        try:
+            texts.append(config.read_text())
+        except OSError:
+            pass
+    return '\n'.join(texts)
+
+
+def _config_set(config: str, *keys: str) -> bool:
+    """ Whether any of `keys` (without section) is set in `config`. """
+    return bool(re.search(
+        rf'^\s*({"|".join(keys)})\s*=',
+        config,
+        re.IGNORECASE|re.MULTILINE
+    ))
+
+
+def _supported_config(common_dir: Path) -> bool:
+    return not _config_set(
+        _git_config(common_dir),
+        'abbrev', 'objectformat', 'refstorage', 'worktreeconfig'
+    )
+
+
+def _is_per_worktree_ref(name: str) -> bool:
+    return '/' not in name or name.startswith((
+        'refs/worktree/', 'refs/bisect/', 'refs/rewritten/'
+    ))
+
+
+def _packed_refs(common_dir: Path) -> dict[str, str]:
+    refs: dict[str, str] = {}
+    try:
+        with (common_dir / 'packed-refs').open('r') as f:
+            for line in f:
+                if line.startswith(('#', '^')):
+                    continue
+                parts = line.split()
+                if len(parts) == 2:
+                    refs[parts[1]] = parts[0]
+    except FileNotFoundError:
+        pass
+    return refs
+
+
+def _resolve_ref(git_dir: Path, common_dir: Path, name: str) -> str|None:
+    """ Resolves a (possibly symbolic) ref to its full object name. """
+    for _ in range(10):  # Bounds chains of symbolic refs.
+        base = git_dir if _is_per_worktree_ref(name) else common_dir
+        try:
+            value = (base / name).read_text().strip()
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            value = _packed_refs(common_dir).get(name)
+            if value is None:
+                return None
+        if value.startswith('ref:'):
+            name = value[len('ref:'):].strip()
+            continue
+        return value if _re_sha1.match(value) else None
+    return None
+
+
+def _common_prefix(a: str, b: str) -> int:
+    return len(os.path.commonprefix([a, b]))
+
+
+def _abbrev(common_dir: Path, sha: str) -> str|None:
+    """
+    Abbreviates `sha` the way `git rev-parse --short` does: the length is
+    picked from the approximate object count, then extended until the prefix
+    is unambiguous among loose and packed objects.
+    """
+    objects = common_dir / 'objects'
+    pack_dir = objects / 'pack'
+    if (
+        (objects / 'info' / 'alternates').exists()
+        or (pack_dir / 'multi-pack-index').exists()
+    ):
+        return None
+    target = bytes.fromhex(sha)
+    count = 0
+    common = 0
+    for idx in (pack_dir.glob('*.idx') if pack_dir.is_dir() else ()):
+        with idx.open('rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            # Pack index v2: magic, version, 256-entry fanout, sorted names.
+            if m[:8] != b'\377tOc\0\0\0\2':
+                return None
+            fanout = lambda i: int.from_bytes(m[8 + 4*i : 12 + 4*i], 'big')
+            name = lambda i: m[1032 + 20*i : 1052 + 20*i]
+            count += fanout(255)
+            lo = fanout(target[0] - 1) if target[0] else 0
+            hi = fanout(target[0])
+            first, last = lo, hi
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if name(mid) < target:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            for i in (lo - 1, lo, lo + 1):
+                if first <= i < last and name(i) != target:
+                    common = max(common, _common_prefix(sha, name(i).hex()))
+    try:
+        for entry in os.scandir(objects / sha[:2]):
+            if entry.name != sha[2:] and len(entry.name) == 38:
+                common = max(common, _common_prefix(sha, sha[:2] + entry.name))
+    except FileNotFoundError:
+        pass
+    # Git expects a collision around 2^(bits/2) objects, at 4 bits per digit.
+    length = max(7, (max(count, 1).bit_length() + 1) // 2, common + 1)
+    return sha[:length]
+
+
+def _native_hash(repo: Path, short: bool) -> str|None:
+    dirs = _git_dirs(repo)
+    if dirs is None:
+        return None
+    _, git_dir, common_dir = dirs
+    sha = _resolve_ref(git_dir, common_dir, 'HEAD')
+    if sha is None or not short:
+        return sha
+    return _abbrev(common_dir, sha)
+
+
+# --- Index reader
+
+class _IndexEntry(NamedTuple):
+    path: str
+    mtime_s: int
+    mtime_ns: int
+    ino: int
+    mode: int
+    size: int
+    sha: str
+    stage: int
+    skip: bool           # assume-valid or skip-worktree: not checked by git.
+    intent_to_add: bool
+
+
+def _varint(data: bytes, pos: int) -> tuple[int, int]:
+    # Git's offset varint, as used by index v4 path compression.
+    c = data[pos]; pos += 1
+    value = c & 0x7f
+    while c & 0x80:
+        c = data[pos]; pos += 1
+        value = ((value + 1) << 7) | (c & 0x7f)
+    return value, pos
+
+
+def _read_index(git_dir: Path) -> tuple[os.stat_result|None, list[_IndexEntry]]|None:
+    """
+    Parses `git_dir/index` (versions 2-4).
+    Returns the index file's stat and its entries, or None for indexes this
+    reader does not support (split or sparse indexes).
+    """
+    index = git_dir / 'index'
+    try:
+        st = index.stat()
+        data = index.read_bytes()
+    except FileNotFoundError:
+        return None, []
+    if data[:4] != b'DIRC':
+        return None
+    version, count = struct.unpack_from('>II', data, 4)
+    if version not in (2, 3, 4):
+        return None
+    entries: list[_IndexEntry] = []
+    pos = 12
+    name = b''
+    for _ in range(count):
+        (
+            _ctime_s, _ctime_ns, mtime_s, mtime_ns,
+            _dev, ino, mode, _uid, _gid, size
+        ) = struct.unpack_from('>10I', data, pos)
+        sha = data[pos+40 : pos+60].hex()
+        flags, = struct.unpack_from('>H', data, pos+60)
+        p = pos + 62
+        ext_flags = 0
+        if flags & 0x4000:
+            ext_flags, = struct.unpack_from('>H', data, p)
+            p += 2
+        if version == 4:
+            strip, p = _varint(data, p)
+            end = data.index(b'\0', p)
+            name = name[:len(name) - strip] + data[p:end]
+            pos = end + 1
+        else:
+            end = data.index(b'\0', p)
+            name = data[p:end]
+            pos += (end - pos + 8) & ~7  # NUL-padded to a multiple of 8.
+        entries.append(_IndexEntry(
+            path = os.fsdecode(name),
+            mtime_s = mtime_s,
+            mtime_ns = mtime_ns,
+            ino = ino,
+            mode = mode,
+            size = size,
+            sha = sha,
+            stage = (flags >> 12) & 3,
+            skip = bool(flags & 0x8000 or ext_flags & 0x4000),
+            intent_to_add = bool(ext_flags & 0x2000),
+        ))
+    end = len(data) - 20  # Trailing checksum.
+    while pos + 8 <= end:
+        signature = data[pos : pos+4]
+        ext_size, = struct.unpack_from('>I', data, pos+4)
+        if signature in (b'link', b'sdir'):
+            return None
+        pos += 8 + ext_size
+    return st, entries
+
+
+# --- Fast dirty check
+#
+# Answers `git status --porcelain` without walking the whole worktree:
+# tracked files are compared against the stat data cached in the index
+# (content is only hashed for racily clean entries or when the stat data
+# is stale), staged changes are checked once per index/HEAD state, and
+# untracked files are only looked for in directories whose mtime changed
+# since the last clean check, recorded in `git_dir/buildtools-status.json`.
+#
+# Directories that contain tracked files are watched, and so is every
+# directory below an untracked directory that is not itself ignored (it
+# can hold only ignored files, yet a new file deep inside it shows up).
+# Directories still being written to are rescanned on the next check.
+
+_status_snapshot = 'buildtools-status.json'
+
+
+def _stat_key(path: Path) -> list[int]|None:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+def _blob_sha(path: Path, st: os.stat_result) -> str:
+    if stat.S_ISLNK(st.st_mode):
+        content = os.fsencode(os.readlink(path))
+    else:
+        content = path.read_bytes()
+    return hashlib.sha1(b'blob %d\0' % len(content) + content).hexdigest()
+
+
+def _worktree_dirty(
+    worktree: Path,
+    index_st: os.stat_result|None,
+    entries: list[_IndexEntry],
+    config: str
+) -> bool|None:
+    """ Compares tracked files with the index. """
+    can_hash = not (
+        _config_set(config, 'autocrlf', 'eol', 'filter', 'safecrlf')
+        or any(e.path.endswith('.gitattributes') for e in entries)
+    )
+    check_mode = not re.search(
+        r'^\s*filemode\s*=\s*false', config, re.IGNORECASE|re.MULTILINE
+    )
+    index_mtime = (0, 0)
+    if index_st is not None:
+        index_mtime = divmod(index_st.st_mtime_ns, 10**9)
+    for e in entries:
+        if e.stage or e.intent_to_add:
+            return True
+        if e.skip:
+            continue
+        if e.mode == 0o160000:
+            return None  # Submodule state is left to git.
+        path = worktree / e.path
+        try:
+            st = os.lstat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return True
+        if e.mode == 0o120000:
+            if not stat.S_ISLNK(st.st_mode):
+                return True
+        elif not stat.S_ISREG(st.st_mode):
+            return True
+        elif check_mode and bool(st.st_mode & 0o100) != (e.mode == 0o100755):
+            return True
+        mtime = divmod(st.st_mtime_ns, 10**9)
+        if (
+            mtime[0] & 0xFFFFFFFF == e.mtime_s
+            and (e.mtime_ns == 0 or mtime[1] == e.mtime_ns)
+            and st.st_size & 0xFFFFFFFF == e.size
+            and st.st_ino & 0xFFFFFFFF == e.ino
+        ):
+            # Racily clean: modified in the same instant the index was written.
+            if (e.mtime_s, e.mtime_ns) < index_mtime:
+                continue
+        elif st.st_size & 0xFFFFFFFF != e.size and e.size != 0 and can_hash:
+            # (git zeroes the size of racy entries, forcing a content check.)
+            return True
+        if not can_hash:
+            return None
+        if _blob_sha(path, st) != e.sha:
+            return True
+    return False
+
+
+def _excludes_file(config: str) -> Path:
+    """ The global ignore file: `core.excludesFile`, else the XDG default. """
+    m = re.search(
+        r'^\s*excludesfile\s*=\s*"?([^"\n]*?)"?\s*$',
+        config,
+        re.IGNORECASE|re.MULTILINE
+    )
+    if m is None:
+        return _xdg_git_file('ignore')
+    return Path(os.path.expanduser(m.group(1)))
+
+
+def _untracked_candidates(
+    worktree: Path,
+    entries: list[_IndexEntry],
+    dir_mtimes: dict[str, int]
+) -> tuple[list[str], list[str]]:
+    """
+    Lists entries not in the index inside watched directories whose mtime
+    differs from `dir_mtimes`, which is updated in place, and the untracked
+    directories among them that are not watched yet.
+    """
+    children: dict[str, set[str]] = { '': { '.git' } }
+    for e in entries:
+        parts = e.path.split('/')
+        for i in range(len(parts)):
+            parent = '/'.join(parts[:i])
+            children.setdefault(parent, set()).add(parts[i])
+    watched = set(children) | { d for d in dir_mtimes if d not in children }
+    candidates: list[str] = []
+    new_dirs: list[str] = []
+    for rel in sorted(watched):
+        try:
+            mtime = os.stat(worktree / rel).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            dir_mtimes.pop(rel, None)
+            continue
+        if dir_mtimes.get(rel) == mtime:
+            continue
+        known = children.get(rel, set())
+        for entry in os.scandir(worktree / rel):
+            if entry.name in known:
+                continue
+            path = f'{rel}/{entry.name}' if rel else entry.name
+            candidates.append(path)
+            if entry.is_dir(follow_symlinks=False) and path not in watched:
+                new_dirs.append(path)
+        _watch_dir(dir_mtimes, rel, mtime)
+    return candidates, new_dirs
+
+
+def _watch_dir(dir_mtimes: dict[str, int], rel: str, mtime: int) -> None:
+    # Coarse mtimes may hide later changes, so a directory modified in the
+    # last two seconds is kept watched but scanned again next time.
+    settled = time.time_ns() - 2 * 10**9
+    dir_mtimes[rel] = mtime if mtime < settled else -1
+
+
+def _watch_untracked(
+    worktree: Path,
+    new_dirs: list[str],
+    dir_mtimes: dict[str, int]
+) -> bool:
+    """
+    Adds every directory below the untracked `new_dirs` that is not ignored
+    to `dir_mtimes`. Returns False if there are too many to be worth it.
+    """
+    watched = 0
+    while new_dirs:
+        check = cmd(
+            ['git', 'check-ignore', '-z', '--stdin'],
+            input = '\0'.join(new_dirs) + '\0',
+            cwd = worktree
+        )
+        if check.rc > 1:
+            check.check()
+        ignored = set(check.result.stdout.split('\0'))
+        next_dirs: list[str] = []
+        for rel in new_dirs:
+            if rel in ignored:
+                continue
+            watched += 1
+            if watched > 1000:
+                return False
+            try:
+                _watch_dir(dir_mtimes, rel, os.stat(worktree / rel).st_mtime_ns)
+                next_dirs += [
+                    f'{rel}/{entry.name}' for entry in os.scandir(worktree / rel)
+                    if entry.is_dir(follow_symlinks=False)
+                ]
+            except (FileNotFoundError, NotADirectoryError):
+                dir_mtimes.pop(rel, None)
+        new_dirs = next_dirs
+    return True
+
+
+def _fast_dirty(repo: Path) -> bool|None:
+    """
+    Whether the worktree containing `repo` has changes, or None if the
+    answer needs the `git` CLI.
+    """
+    dirs = _git_dirs(repo)
+    if dirs is None:
+        return None
+    worktree, git_dir, common_dir = dirs
+    index = _read_index(git_dir)
+    head = _resolve_ref(git_dir, common_dir, 'HEAD')
+    if index is None or head is None:
+        return None
+    index_st, entries = index
+    config = _git_config(common_dir)
+
+    worktree_dirty = _worktree_dirty(worktree, index_st, entries, config)
+    if worktree_dirty is not False:
+        return worktree_dirty
+
+    snapshot_file = git_dir / _status_snapshot
+    state = [
+        head,
+        _stat_key(git_dir / 'index'),
+        _stat_key(common_dir / 'info' / 'exclude'),
+        _stat_key(_excludes_file(config)),
+    ]
+    snapshot = {}
+    try:
+        with snapshot_file.open('r') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if snapshot.get('state') != state:
+        snapshot = {}
+    dir_mtimes: dict[str, int] = snapshot.get('dirs', {})
+
+    if not snapshot.get('staged_clean'):
+        staged = git(worktree, 'diff-index', '--cached', '--quiet', 'HEAD', '--')
+        if staged.rc == 1:
+            return True
+        staged.check()
+
+    candidates, new_dirs = _untracked_candidates(worktree, entries, dir_mtimes)
+    if candidates:
+        if len(candidates) > 1000:
+            candidates = []  # Cheaper to let git walk everything.
+        untracked = git(
+            worktree,
+            '--literal-pathspecs', 'ls-files', '--others', '--exclude-standard',
+            '--directory', '--no-empty-directory', '-z', '--', *candidates
+        ).out
+        if untracked:
+            return True
+    if not _watch_untracked(worktree, new_dirs, dir_mtimes):
+        return None
+
+    try:
+        write_atomic(snapshot_file, json.dumps(
+            dict(state=state, staged_clean=True, dirs=dir_mtimes)
+        ))
+    except OSError:
+        pass
+    return False
@@ -1,2 +1,4 @@
+from .base import build_targets, load_schema
 from .typescript import TypeScriptBuilder
 from .pgsql import PgsqlSchemaBuilder
+from .batch import build_batch
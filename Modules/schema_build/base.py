@@ -1,14 +1,23 @@
 # Converts a JSON Schema to a SQL DDL
 
-import json
-from functools import cache
+import filecmp, hashlib, inspect, json, os
+from functools import cache, cached_property
+from importlib.metadata import version
 from importlib.resources import files
 from pathlib import Path
 from textwrap import indent
-from typing import Any, TextIO
+from typing import Any, Iterable, TextIO
 
 import yaml
-from jsonschema import validate
+from jsonschema import Draft202012Validator
+from jsonschema.exceptions import best_match
+
+from subprocess_build import temp_path, write_atomic
+
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
 
 _schema_meta = files("schema_build").joinpath("schema.json")
 @cache
@@ -16,35 +25,96 @@ def get_schema_meta() -> dict[str, Any]:
     with _schema_meta.open('r') as f:
         return json.load(f)
 
+@cache
+def get_validator() -> Draft202012Validator:
+    """Gets the metaschema validator, checked and built once per process."""
+    meta = get_schema_meta()
+    Draft202012Validator.check_schema(meta)
+    return Draft202012Validator(meta)
+
+def validate_schema(data: dict[str, Any]) -> None:
+    """Validates a schema document, raising its most relevant `ValidationError`."""
+    error = best_match(get_validator().iter_errors(data))
+    if error is not None:
+        raise error
+
+def _cache_dir(*parts: str) -> Path:
+    # Same location as subprocess_build.cache_dir
+    root = os.environ.get('BUILDTOOLS_CACHE_DIR')
+    if not root:
+        xdg = os.environ.get('XDG_CACHE_HOME')
+        root = Path(xdg) if xdg else Path.home() / '.cache'
+        root = root / 'buildtools'
+    return Path(root).joinpath(*parts)
+
+@cache
+def _validation_salt() -> str:
+    meta = _schema_meta.read_bytes()
+    return f"{version('jsonschema')}:{hashlib.sha256(meta).hexdigest()}"
+
+def _validation_stamp(digest: str) -> Path:
+    """
+    Gets the file marking that a schema with content hash `digest` passed
+    validation under the current jsonschema version and metaschema.
+    """
+    key = hashlib.sha256(f"{digest}:{_validation_salt()}".encode()).hexdigest()
+    return _cache_dir('schema-validated', key[:2], key)
+
+# Parsed schema documents, shared by every builder in the process.
+# Keys are (resolved path, mtime_ns, size), so an edited file is re-read;
+# each is stored with the sha256 of the file content and the parsed data.
+_DocKey = tuple[Path, int, int]
+_Document = tuple[_DocKey, str, dict[str, Any]]
+_documents: dict[Path, _Document] = {}
+_validated: set[_DocKey] = set()
+
+def _load_document(schema_path: str|Path) -> _Document:
+    path = Path(schema_path).resolve()
+    st = path.stat()
+    key = (path, st.st_mtime_ns, st.st_size)
+    cached = _documents.get(path)
+    if cached is not None and cached[0] == key:
+        return cached
+    if path.suffix not in ('.json', '.yaml', '.yml'):
+        raise ValueError(f"Unsupported schema file type: {path.suffix}")
+    content = path.read_bytes()
+    if path.suffix == '.json':
+        data = json.loads(content)
+    else:
+        data = yaml.load(content, Loader=_YamlLoader)
+    document = (key, hashlib.sha256(content).hexdigest(), data)
+    _documents[path] = document
+    return document
+
+def load_schema(schema_path: str|Path) -> dict[str, Any]:
+    """
+    Loads a schema document (JSON or YAML), parsing each version of the file
+    once per process. The result is shared, so must not be modified.
+    """
+    return _load_document(schema_path)[2]
+
 class BaseSchemaBuilder:
     def __init__(self, schema_path: str|Path, output_path: str|Path) -> None:
         self.schema_path = Path(schema_path)
         self.output_path = Path(output_path)
 
+    @cached_property
+    def _document(self) -> _Document:
+        return _load_document(self.schema_path)
+
     @property
-    @cache
     def schema_data(self) -> dict[str, Any]:
-        if self.schema_path.suffix == '.json':
-            with self.schema_path.open('r') as f:
-                return json.load(f)
-        elif self.schema_path.suffix in ('.yaml', '.yml'):
-            with self.schema_path.open('r') as f:
-                return yaml.safe_load(f)
-        else:
-            raise ValueError(f"Unsupported schema file type: {self.schema_path.suffix}")
+        return self._document[2]
 
-    @property
-    @cache
+    @cached_property
     def types(self) -> dict[str, Any]:
         return self.schema_data.get('$defs', {}) or {}
 
-    @property
-    @cache
+    @cached_property
     def defs(self) -> dict[str, Any]:
         return self.schema_data.get('$defs', {}) or {}
 
-    @property
-    @cache
+    @cached_property
     def exports(self) -> dict[str, Any]:
         return { k: v for k, v in self.schema_data.items() if not k.startswith('$') }
 
@@ -54,10 +124,60 @@ class BaseSchemaBuilder:
         return ref.split('/')[-1]
 
     def validate(self) -> None:
-        validate(self.schema_data, get_schema_meta())
+        """
+        Validates the schema against the metaschema, unless this content has
+        passed before (in this process, or per a stamp in the build cache).
+        """
+        key, digest, data = self._document
+        if key in _validated:
+            return
+        stamp = _validation_stamp(digest)
+        if not stamp.exists():
+            validate_schema(data)
+            try:
+                stamp.parent.mkdir(parents=True, exist_ok=True)
+                stamp.touch()
+            except OSError:
+                pass
+        _validated.add(key)
 
-    def build(self) -> None:
+    def build(self, force: bool = False) -> bool:
+        """
+        Validates the schema and generates `output_path` from it, unless the
+        schema, the builder's code and the output are unchanged since the last
+        build (or `force`). The output is replaced atomically, and only if
+        its content changed. Returns whether the output changed.
+        """
+        stamp = _cache_dir('schema-build', _hash(str(self.output_path.resolve())) + '.json')
+        key = self._build_key()
+        if not force and _read_stamp(stamp) == [key, _output_stat(self.output_path)]:
+            print(f"Up to date: {self.output_path}")
+            return False
         self.validate()
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = temp_path(self.output_path)
+        try:
+            with tmp.open('w') as f:
+                self.visit_root(f)
+            changed = not (
+                self.output_path.is_file()
+                and filecmp.cmp(tmp, self.output_path, shallow=False)
+            )
+            if changed:
+                os.replace(tmp, self.output_path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        _write_stamp(stamp, [key, _output_stat(self.output_path)])
+        print(f"{'Generated' if changed else 'Unchanged'}: {self.output_path}")
+        return changed
+
+    def _build_key(self) -> str:
+        return _hash(json.dumps([
+            _hash(self.schema_path.read_bytes()),
+            str(self.schema_path),
+            f'{type(self).__module__}.{type(self).__qualname__}',
+            _code_digest(type(self)),
+        ]))
 
     def visit_root(self, f: TextIO) -> None:
         for export_name, export_schema in self.exports.items():
@@ -133,3 +253,51 @@ class BaseSchemaBuilder:
     def visit_unknown_alias(self, type_name: str, type_def: dict[str, Any], f: TextIO) -> None:
         raise NotImplementedError
 
+
+def _hash(data: str|bytes) -> str:
+    return hashlib.sha256(data.encode() if isinstance(data, str) else data).hexdigest()
+
+@cache
+def _code_digest(builder_type: type) -> str:
+    """Hashes the source files defining a builder class and its bases."""
+    sources = []
+    for cls in builder_type.__mro__:
+        try:
+            sources.append(Path(inspect.getfile(cls)).read_bytes())
+        except (TypeError, OSError):  # built-in
+            continue
+    return _hash(b'\0'.join(sources))
+
+def _output_stat(path: Path) -> list[int]|None:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+def _read_stamp(path: Path) -> Any:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+def _write_stamp(path: Path, value: Any) -> None:
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(path, json.dumps(value))
+    except OSError:
+        pass
+
+
+def build_targets(
+    schema_path: str|Path,
+    targets: Iterable[tuple[type[BaseSchemaBuilder], str|Path]]
+) -> None:
+    """
+    Builds several outputs from one schema, e.g.
+    `[(TypeScriptBuilder, 'types.d.ts'), (PgsqlSchemaBuilder, 'schema.sql')]`.
+    The schema is parsed and validated once, then shared by every builder;
+    up-to-date outputs are skipped without parsing it at all.
+    """
+    for builder_type, output_path in targets:
+        builder_type(schema_path, output_path).build()
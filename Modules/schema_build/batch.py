@@ -0,0 +1,183 @@
+# Builds many schema files with several backends on a process pool
+
+import argparse, glob, os, re, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Iterable
+
+from .base import BaseSchemaBuilder
+from .typescript import TypeScriptBuilder
+from .pgsql import PgsqlSchemaBuilder
+
+backends: dict[str, tuple[type[BaseSchemaBuilder], str]] = {
+    # name: (builder, output extension)
+    'typescript': (TypeScriptBuilder, '.d.ts'),
+    'pgsql': (PgsqlSchemaBuilder, '.sql'),
+}
+
+schema_suffixes = ('.yaml', '.yml', '.json')
+# Directory searches only pick up files with a `$schema` or `$defs` key, so
+# that package.json, CI config, etc. are left out.
+_re_schema_key = re.compile(r'["\']?\$(?:schema|defs)["\']?\s*:')
+
+
+class BatchResult:
+    """The outcome of building one schema with one backend."""
+
+    def __init__(
+        self,
+        schema_path: Path,
+        backend: str,
+        output_path: Path,
+        seconds: float,
+        changed: bool = False,
+        error: str|None = None
+    ) -> None:
+        self.schema_path = schema_path
+        self.backend = backend
+        self.output_path = output_path
+        self.seconds = seconds
+        self.changed = changed
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        status = 'ok' if self.ok else f'error={self.error!r}'
+        return f"BatchResult({self.schema_path}, {self.backend}, {status})"
+
+
+def find_schemas(source: str|Path) -> tuple[Path, list[Path]]:
+    """
+    Finds the schema files in a directory (recursively) or matching a glob,
+    returning them with the root that output paths are made relative to.
+    Every file matching a glob is taken, but in a directory only files that
+    declare `$schema` or `$defs` are.
+    """
+    source = str(source)
+    if glob.has_magic(source):
+        root = Path(*_leading_parts(Path(source).parts))
+        paths = [Path(p) for p in glob.glob(source, recursive=True)]
+    else:
+        root = Path(source)
+        if root.is_file():
+            return root.parent, [root]
+        paths = [
+            p for p in root.rglob('*')
+            if p.suffix in schema_suffixes and p.is_file() and _is_schema(p)
+        ]
+    return root, sorted(p for p in paths if p.is_file() and p.suffix in schema_suffixes)
+
+
+def _is_schema(path: Path) -> bool:
+    try:
+        return _re_schema_key.search(path.read_text(encoding='utf-8', errors='replace')) is not None
+    except OSError:
+        return False
+
+
+def _leading_parts(parts: Iterable[str]) -> Iterable[str]:
+    for part in parts:
+        if glob.has_magic(part): break
+        yield part
+
+
+def build_batch(
+    sources: Iterable[str|Path],
+    backend_names: Iterable[str] = tuple(backends),
+    output_dir: str|Path|None = None,
+    max_workers: int|None = None,
+    force: bool = False
+) -> list[BatchResult]:
+    """
+    Builds every schema found in `sources` (directories or globs, see
+    `find_schemas`) with each of `backend_names`, spreading schemas over a
+    process pool. Outputs go next to each schema, or under `output_dir` at
+    the same relative path. Failures are collected, not raised.
+    """
+    backend_names = list(backend_names)
+    for name in backend_names:
+        if name not in backends:
+            raise ValueError(f"Unknown backend: {name} (expected one of {', '.join(backends)})")
+    jobs = []
+    for source in sources:
+        root, schemas = find_schemas(source)
+        for schema in schemas:
+            base = schema if output_dir is None else Path(output_dir) / schema.relative_to(root)
+            jobs.append((schema, [
+                (name, base.with_suffix(backends[name][1])) for name in backend_names
+            ], force))
+    if len(jobs) <= 1 or max_workers == 1:
+        return [r for job in jobs for r in _build_one(*job)]
+    with ProcessPoolExecutor(max_workers) as pool:
+        futures = [pool.submit(_build_one, *job) for job in jobs]
+        return [r for f in futures for r in f.result()]
+
+
+def _build_one(
+    schema_path: Path,
+    outputs: list[tuple[str, Path]],
+    force: bool
+) -> list[BatchResult]:
+    results = []
+    for name, output_path in outputs:
+        builder_type = backends[name][0]
+        started = time.perf_counter()
+        try:
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                changed = builder_type(schema_path, output_path).build(force)
+            results.append(BatchResult(
+                schema_path, name, output_path, time.perf_counter() - started, changed
+            ))
+        except Exception as e:
+            results.append(BatchResult(
+                schema_path, name, output_path, time.perf_counter() - started,
+                error=f"{type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''}"
+            ))
+    return results
+
+
+def print_summary(results: list[BatchResult], elapsed: float|None = None) -> None:
+    for r in results:
+        status = 'FAILED' if not r.ok else 'generated' if r.changed else 'unchanged'
+        print(f"{r.seconds:8.3f}s  {status:<9}  {r.schema_path} -> {r.output_path}")
+        if not r.ok:
+            print(f"           {r.error}")
+    failed = sum(not r.ok for r in results)
+    changed = sum(r.changed for r in results)
+    total = f" in {elapsed:.2f}s" if elapsed is not None else ""
+    print(
+        f"Built {len(results)} outputs{total}: {changed} generated, "
+        f"{len(results) - changed - failed} unchanged, {failed} failed."
+    )
+
+
+def main(argv: list[str]|None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m schema_build',
+        description="Generate code and DDL from many schema files in parallel.",
+    )
+    parser.add_argument('sources', nargs='+',
+        help="schema files, directories (searched recursively) or globs")
+    parser.add_argument('-b', '--backend', action='append', choices=backends,
+        help="backend to run (repeatable; default: all)")
+    parser.add_argument('-o', '--output-dir', type=Path, default=None,
+        help="write outputs here, mirroring the sources' layout (default: next to each schema)")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help="worker processes (default: CPU count)")
+    parser.add_argument('-f', '--force', action='store_true',
+        help="regenerate even if outputs are up to date")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    results = build_batch(
+        args.sources, args.backend or tuple(backends), args.output_dir,
+        args.jobs, args.force
+    )
+    print_summary(results, time.perf_counter() - started)
+    if not results:
+        print("No schema files found.", file=sys.stderr)
+    return 1 if any(not r.ok for r in results) else 0
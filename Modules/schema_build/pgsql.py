@@ -7,13 +7,6 @@ from .base import BaseSchemaBuilder
 
 class PgsqlSchemaBuilder(BaseSchemaBuilder):
 
-    def build(self) -> None:
-        super().build()
-        self.output_path.parent.mkdir(parents=True, exist_ok=True)
-        with self.output_path.open('w') as f:
-            self.visit_root(f)
-        print(f"Generated: {self.output_path}")
-
     def visit_root(self, f: TextIO) -> None:
         f.writelines([
             f"-- Auto-generated from {self.schema_path}\n",
@@ -1,7 +1,11 @@
 from pathlib import Path
 import re
 
-from schema_build.base import BaseSchemaBuilder
+import pytest
+
+from schema_build import base
+from schema_build.base import BaseSchemaBuilder, build_targets, load_schema
+from schema_build.batch import build_batch
 from schema_build.typescript import TypeScriptBuilder
 from schema_build.pgsql import PgsqlSchemaBuilder
 
@@ -21,7 +25,7 @@ def _parse_markdown_schema_and_fence(md_path: Path, fence_lang: str) -> tuple[st
     return (schema_text, schema_lang, expected_lines)
 
 
-def run_fixtures(builder_type: type[BaseSchemaBuilder], fence_lang: str, extension: str, monkeypatch) -> None:
+def run_fixtures(builder_type: type[BaseSchemaBuilder], fence_lang: str, extension: str, monkeypatch, tmp_path: Path) -> None:
     fixtures_dir = Path(__file__).parent
     out_dir = fixtures_dir.joinpath('.tests')
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -30,6 +34,7 @@ def run_fixtures(builder_type: type[BaseSchemaBuilder], fence_lang: str, extensi
     assert fixtures, "No markdown fixture schemas found next to tests.py"
 
     monkeypatch.setattr(BaseSchemaBuilder, "validate", lambda self: None)
+    monkeypatch.setenv('BUILDTOOLS_CACHE_DIR', str(tmp_path.joinpath('cache')))
 
     tmp_dir = out_dir.joinpath('tmp')
     tmp_dir.mkdir(parents=True, exist_ok=True)
@@ -52,11 +57,109 @@ def run_fixtures(builder_type: type[BaseSchemaBuilder], fence_lang: str, extensi
             assert snippet in content, f"Missing expected {fence_lang.upper()} snippet in {out_path.name}: {snippet}"
 
 
-def test_typescript(monkeypatch) -> None:
-    run_fixtures(TypeScriptBuilder, 'typescript', '.d.ts', monkeypatch)
-
-
-def test_pgsql(monkeypatch) -> None:
-    run_fixtures(PgsqlSchemaBuilder, 'sql', '.sql', monkeypatch)
-
-
+def test_typescript(monkeypatch, tmp_path) -> None:
+    run_fixtures(TypeScriptBuilder, 'typescript', '.d.ts', monkeypatch, tmp_path)
+
+
+def test_pgsql(monkeypatch, tmp_path) -> None:
+    run_fixtures(PgsqlSchemaBuilder, 'sql', '.sql', monkeypatch, tmp_path)
+
+
+def test_build_targets_shares_document(monkeypatch, tmp_path) -> None:
+    schema_text, schema_lang, _ = _parse_markdown_schema_and_fence(
+        Path(__file__).parent.joinpath('test_00.md'), 'typescript')
+    schema_file = tmp_path.joinpath(f"schema.{schema_lang}")
+    schema_file.write_text(schema_text, encoding='utf-8')
+
+    monkeypatch.setenv('BUILDTOOLS_CACHE_DIR', str(tmp_path.joinpath('cache')))
+    validated = []
+    monkeypatch.setattr(base, "validate_schema", validated.append)
+    build_targets(schema_file, [
+        (TypeScriptBuilder, tmp_path.joinpath('schema.d.ts')),
+        (PgsqlSchemaBuilder, tmp_path.joinpath('schema.sql')),
+    ])
+
+    assert len(validated) == 1
+    assert validated[0] is load_schema(schema_file)
+    assert tmp_path.joinpath('schema.d.ts').read_text().strip()
+    assert tmp_path.joinpath('schema.sql').read_text().strip()
+
+
+def test_validation_stamp(monkeypatch, tmp_path) -> None:
+    monkeypatch.setenv('BUILDTOOLS_CACHE_DIR', str(tmp_path.joinpath('cache')))
+    schema_text, schema_lang, _ = _parse_markdown_schema_and_fence(
+        Path(__file__).parent.joinpath('test_01.md'), 'typescript')
+    schema_file = tmp_path.joinpath(f"schema.{schema_lang}")
+    schema_file.write_text(schema_text, encoding='utf-8')
+
+    TypeScriptBuilder(schema_file, tmp_path.joinpath('a.d.ts')).validate()
+
+    # A later process finds the stamp and skips validation
+    base._validated.clear()
+    base._documents.clear()
+    def fail(data) -> None:
+        raise AssertionError("validated again")
+    monkeypatch.setattr(base, "validate_schema", fail)
+    TypeScriptBuilder(schema_file, tmp_path.joinpath('a.d.ts')).validate()
+
+    # Changed content is validated
+    base._validated.clear()
+    schema_file.write_text(schema_text + "\n", encoding='utf-8')
+    with pytest.raises(AssertionError, match="validated again"):
+        TypeScriptBuilder(schema_file, tmp_path.joinpath('a.d.ts')).validate()
+
+
+def test_incremental_build(monkeypatch, tmp_path, capsys) -> None:
+    monkeypatch.setenv('BUILDTOOLS_CACHE_DIR', str(tmp_path.joinpath('cache')))
+    schema_text, schema_lang, _ = _parse_markdown_schema_and_fence(
+        Path(__file__).parent.joinpath('test_00.md'), 'typescript')
+    schema_file = tmp_path.joinpath(f"schema.{schema_lang}")
+    schema_file.write_text(schema_text, encoding='utf-8')
+    out_path = tmp_path.joinpath('schema.d.ts')
+
+    assert TypeScriptBuilder(schema_file, out_path).build()
+    mtime = out_path.stat().st_mtime_ns
+
+    # Nothing changed: skipped without generating
+    capsys.readouterr()
+    assert not TypeScriptBuilder(schema_file, out_path).build()
+    assert capsys.readouterr().out.startswith("Up to date:")
+
+    # Schema changed but output didn't: the output file is left alone
+    schema_file.write_text(schema_text + "# comment\n", encoding='utf-8')
+    assert not TypeScriptBuilder(schema_file, out_path).build()
+    assert capsys.readouterr().out.startswith("Unchanged:")
+    assert out_path.stat().st_mtime_ns == mtime
+
+    # Output removed: regenerated
+    out_path.unlink()
+    assert TypeScriptBuilder(schema_file, out_path).build()
+    assert out_path.read_text().strip()
+
+
+def test_build_batch(monkeypatch, tmp_path) -> None:
+    monkeypatch.setenv('BUILDTOOLS_CACHE_DIR', str(tmp_path.joinpath('cache')))
+    src_dir = tmp_path.joinpath('schemas')
+    for md_name, sub in (('test_00.md', 'a'), ('test_01.md', 'b')):
+        schema_text, schema_lang, _ = _parse_markdown_schema_and_fence(
+            Path(__file__).parent.joinpath(md_name), 'typescript')
+        schema_file = src_dir.joinpath(sub, f"schema.{schema_lang}")
+        schema_file.parent.mkdir(parents=True)
+        schema_file.write_text(schema_text, encoding='utf-8')
+    src_dir.joinpath('bad.yaml').write_text(
+        "$schema: https://json-schema.org/draft/2020-12/schema\ntype: 5\n", encoding='utf-8')
+    src_dir.joinpath('package.json').write_text('{"name": "not-a-schema"}\n', encoding='utf-8')
+    out_dir = tmp_path.joinpath('out')
+
+    results = build_batch([src_dir], output_dir=out_dir, max_workers=2)
+
+    assert len(results) == 6
+    failed = [r for r in results if not r.ok]
+    assert {r.schema_path.name for r in failed} == {'bad.yaml'}
+    assert all((r.error or "").startswith("ValidationError") for r in failed)
+    for sub in ('a', 'b'):
+        assert out_dir.joinpath(sub, 'schema.d.ts').read_text().strip()
+        assert out_dir.joinpath(sub, 'schema.sql').read_text().strip()
+
+    results = build_batch([str(src_dir.joinpath('*', 'schema.*'))], ['pgsql'], out_dir)
+    assert [r.changed for r in results] == [False, False]
@@ -6,14 +6,6 @@ from .base import BaseSchemaBuilder
 
 class TypeScriptBuilder(BaseSchemaBuilder):
 
-    def build(self) -> None:
-        super().build()
-        self.output_path.parent.mkdir(parents=True, exist_ok=True)
-        with self.output_path.open('w') as f:
-            self.visit_root(f)
-        print(f"Generated: {self.output_path}")
-
-
     def visit_root(self, f: TextIO) -> None:
         # Pre-scan to determine imports
         self._need_uuid_import: bool = False
@@ -1,24 +1,47 @@
-import subprocess
+import asyncio, atexit, hashlib, json, locale, os, queue, shutil, signal
+import subprocess, sys, threading, time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Iterable, Iterator, TextIO
 
 
 ArgLike = str|Path
 
 
 class CmdResult:
-    def __init__(self, result: subprocess.CompletedProcess[str]):
+    def __init__(
+        self,
+        result: subprocess.CompletedProcess[str],
+        tail: int|None = None,
+        started: float|None = None,
+        ended: float|None = None,
+        rusage: Any = None
+    ):
         self.result = result
+        self.tail = tail  # If set, the output only holds the last `tail` lines.
+        # Accounting: wall-clock timestamps (epoch seconds) and, where the
+        # child's `os.wait4` resource usage is available, its CPU time and
+        # peak resident set size. Unknown figures are None.
+        self.started = started
+        self.ended = ended
+        self.cpu_user_s: float|None = rusage.ru_utime if rusage else None
+        self.cpu_sys_s: float|None = rusage.ru_stime if rusage else None
+        self.max_rss: int|None = None  # bytes
+        if rusage:
+            self.max_rss = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
     
     def check(self) -> None:
         if self.result.returncode != 0:
             print(f"Error running command (rc={self.result.returncode}):")
             print(self.result.args)
+            tail = f" (last {self.tail} lines)" if self.tail else ""
             if self.result.stdout:
-                print(f"=== STDOUT ===")
+                print(f"=== STDOUT{tail} ===")
                 print(self.result.stdout)
             if self.result.stderr:
-                print(f"=== STDERR ===")
+                print(f"=== STDERR{tail} ===")
                 print(self.result.stderr)
             if self.result.stdout or self.result.stderr:
                 print(f"==============")
@@ -38,6 +61,96 @@ class CmdResult:
         self.check()
         return self.result.stdout or ''
 
+    @property
+    def wall_s(self) -> float|None:
+        if self.started is None or self.ended is None:
+            return None
+        return self.ended - self.started
+
+
+class TraceCollector:
+    """
+    Collects timed spans (every command run through this module, plus any
+    `trace_span` blocks) and writes them as Chrome trace-event JSON, which
+    can be opened in `chrome://tracing` or Perfetto.
+    """
+    def __init__(self) -> None:
+        self.events: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        name: str,
+        started: float,
+        ended: float,
+        cat: str = 'cmd',
+        **args: Any
+    ) -> None:
+        with self._lock:
+            self.events.append(dict(
+                name = name,
+                cat = cat,
+                ph = 'X',
+                ts = started * 1e6,
+                dur = max(0.0, ended - started) * 1e6,
+                pid = os.getpid(),
+                args = args,
+            ))
+
+    def write(self, path: Path) -> None:
+        # Overlapping spans are spread across lanes (trace "threads") so that
+        # concurrent commands are drawn side by side.
+        with self._lock:
+            events = sorted(self.events, key=lambda e: e['ts'])
+        lanes: list[float] = []
+        for e in events:
+            end = e['ts'] + e['dur']
+            for lane, lane_end in enumerate(lanes):
+                if lane_end <= e['ts']:
+                    break
+            else:
+                lane = len(lanes)
+                lanes.append(0)
+            lanes[lane] = end
+            e['tid'] = lane
+        os.makedirs(path.parent, exist_ok=True)
+        with path.open('w') as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
+
+
+_tracer: TraceCollector|None = None
+def start_trace(path: Path|None = None) -> TraceCollector:
+    """
+    Starts recording a process-wide trace. If `path` is given, the trace is
+    written there when the process exits.
+    Setting `$BUILDTOOLS_TRACE` to a path does this on import.
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = TraceCollector()
+    if path is not None:
+        atexit.register(_tracer.write, Path(path))
+    return _tracer
+
+def stop_trace() -> TraceCollector|None:
+    """ Stops recording; returns the collector so it can still be written. """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+@contextmanager
+def trace_span(name: str, cat: str = 'build', **args: Any) -> Iterator[None]:
+    """ Records the enclosed block as a span, if tracing is active. """
+    started = time.time()
+    try:
+        yield
+    finally:
+        if _tracer is not None:
+            _tracer.add(name, started, time.time(), cat, **args)
+
+if os.environ.get('BUILDTOOLS_TRACE'):
+    start_trace(Path(os.environ['BUILDTOOLS_TRACE']))
+
 
 def _fmt_arg(x: ArgLike) -> str:
     if isinstance(x, Path):
@@ -45,15 +158,581 @@ def _fmt_arg(x: ArgLike) -> str:
     return x
 
 
+if hasattr(os, 'wait4'):
+    class _Popen(subprocess.Popen[str]):
+        """ A `Popen` that records the child's resource usage when reaping it. """
+        rusage: Any = None
+
+        def _try_wait(self, wait_flags: int) -> tuple[int, int]:
+            # Mirrors `Popen._try_wait`, but reaps with `wait4` instead of
+            # `waitpid` so the child's own rusage is available.
+            try:
+                pid, sts, self.rusage = os.wait4(self.pid, wait_flags)
+            except ChildProcessError:
+                pid, sts = self.pid, 0
+            return pid, sts
+else:
+    _Popen = subprocess.Popen  # type: ignore
+
+
+def _completed(
+    proc: subprocess.Popen[str],
+    out: str|None,
+    err: str|None,
+    started: float,
+    cwd: Any = None,
+    tail: int|None = None
+) -> CmdResult:
+    result = CmdResult(
+        subprocess.CompletedProcess(proc.args, proc.returncode, out, err),
+        tail = tail,
+        started = started,
+        ended = time.time(),
+        rusage = getattr(proc, 'rusage', None)
+    )
+    _trace(result, cwd)
+    return result
+
+def _trace(result: CmdResult, cwd: Any) -> None:
+    if _tracer is None or result.started is None or result.ended is None:
+        return
+    args = [ str(a) for a in result.result.args ]
+    _tracer.add(
+        ' '.join([ Path(args[0]).name, *args[1:2] ]),
+        result.started,
+        result.ended,
+        argv = args,
+        cwd = str(cwd or os.getcwd()),
+        rc = result.rc,
+        cpu_user_s = result.cpu_user_s,
+        cpu_sys_s = result.cpu_sys_s,
+        max_rss = result.max_rss,
+    )
+
+
 def cmd(
     cmd: list[ArgLike],
+    input: str|None = None,
+    timeout: float|None = None,
+    check: bool = False,
     **sp_kwargs: Any
 ) -> CmdResult:
-    return CmdResult(
-        subprocess.run(
-            [ _fmt_arg(c) for c in cmd ],
-            capture_output = True,
+    # Equivalent to `subprocess.run(capture_output=True, text=True)`, but
+    # with resource accounting (see `CmdResult`).
+    if input is not None:
+        sp_kwargs['stdin'] = subprocess.PIPE
+    started = time.time()
+    with _Popen(
+        [ _fmt_arg(c) for c in cmd ],
+        stdout = subprocess.PIPE,
+        stderr = subprocess.PIPE,
+        text = True,
+        **sp_kwargs
+    ) as proc:
+        try:
+            out, err = proc.communicate(input, timeout)
+        except BaseException:
+            proc.kill()
+            raise
+    result = _completed(proc, out, err, started, sp_kwargs.get('cwd'))
+    if check:
+        result.check()
+    return result
+
+
+Sink = Callable[[str, str], None]|TextIO
+
+
+class CmdStream:
+    """
+    Runs a command, yielding `(stream, line)` pairs as output is produced,
+    where `stream` is 'stdout' or 'stderr'.
+
+    Memory use is bounded: only the last `tail` lines of each stream are
+    kept. Once iteration finishes, `result` holds a `CmdResult` whose output
+    is that tail, so `check()` can still show the end of the log.
+    Abandoning the iteration early kills the process, along with anything
+    it started (the command runs in its own session on POSIX).
+    """
+    def __init__(self, cmd: list[ArgLike], tail: int = 200, **sp_kwargs: Any):
+        self.args = [ _fmt_arg(c) for c in cmd ]
+        self.tail = tail
+        self.sp_kwargs = sp_kwargs
+        self.result: CmdResult|None = None
+
+    def __iter__(self) -> Iterator[tuple[str, str]]:
+        started = time.time()
+        sp_kwargs = dict(self.sp_kwargs)
+        if os.name == 'posix':
+            sp_kwargs.setdefault('start_new_session', True)
+        proc = _Popen(
+            self.args,
+            stdout = subprocess.PIPE,
+            stderr = subprocess.PIPE,
             text = True,
+            bufsize = 1,
             **sp_kwargs
         )
+        lines: queue.Queue[tuple[str, str|None]] = queue.Queue(maxsize=1024)
+        abandoned = threading.Event()
+        def pump(name: str, pipe: TextIO) -> None:
+            with pipe:
+                for line in pipe:
+                    if abandoned.is_set():
+                        break
+                    lines.put((name, line))
+            lines.put((name, None))
+        pumps = [
+            threading.Thread(target=pump, args=(name, pipe), daemon=True)
+            for name, pipe in (('stdout', proc.stdout), ('stderr', proc.stderr))
+        ]
+        for t in pumps:
+            t.start()
+
+        tails: dict[str, deque[str]] = {
+            'stdout': deque(maxlen=self.tail),
+            'stderr': deque(maxlen=self.tail),
+        }
+        n_open = len(pumps)
+        try:
+            while n_open:
+                name, line = lines.get()
+                if line is None:
+                    n_open -= 1
+                    continue
+                tails[name].append(line)
+                yield name, line
+        finally:
+            if n_open:
+                _kill_group(proc)
+                deadline = time.monotonic() + 5
+                while n_open:
+                    try:
+                        _, line = lines.get(timeout=max(0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if line is None:
+                        n_open -= 1
+            if n_open:
+                # Something outside the process group still holds the pipes:
+                # leave the readers to finish on their own.
+                abandoned.set()
+                while not lines.empty():
+                    lines.get_nowait()
+            else:
+                for t in pumps:
+                    t.join()
+            proc.wait()
+        self.result = _completed(
+            proc,
+            ''.join(tails['stdout']),
+            ''.join(tails['stderr']),
+            started,
+            self.sp_kwargs.get('cwd'),
+            tail = self.tail
+        )
+
+
+def cmd_stream(
+    cmd: list[ArgLike],
+    sink: Sink|None = None,
+    tail: int = 200,
+    **sp_kwargs: Any
+) -> CmdResult:
+    """
+    Runs a command without buffering its whole output (see `CmdStream`).
+    Each line is forwarded to `sink`, which is either a callback taking
+    `(stream, line)` or a text file.
+    """
+    stream = CmdStream(cmd, tail, **sp_kwargs)
+    for name, line in stream:
+        if sink is None:
+            continue
+        if callable(sink):
+            sink(name, line)
+        else:
+            sink.write(line)
+    assert stream.result is not None
+    return stream.result
+
+
+def cache_dir(*parts: str) -> Path:
+    """
+    Gets a directory under the build tools' on-disk cache root.
+    The root is `$BUILDTOOLS_CACHE_DIR`, or `buildtools` under the user's
+    cache directory (`$XDG_CACHE_HOME`, default `~/.cache`).
+    """
+    root = os.environ.get('BUILDTOOLS_CACHE_DIR')
+    if not root:
+        xdg = os.environ.get('XDG_CACHE_HOME')
+        root = Path(xdg) if xdg else Path.home() / '.cache'
+        root = root / 'buildtools'
+    return Path(root).joinpath(*parts)
+
+
+def temp_path(path: Path) -> Path:
+    """
+    A temporary name next to `path` to write before moving it into place,
+    unique to this process and thread.
+    """
+    return path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+
+def write_atomic(path: Path, text: str) -> None:
+    """ Writes `path` via a `temp_path`, so readers never see partial content. """
+    tmp = temp_path(path)
+    try:
+        tmp.write_text(text)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+class CmdCache:
+    """
+    Memoises command results by key (see `cmd_cached`).
+
+    The `max_entries` most recently used results are kept in memory. If
+    `path` is set, results are also persisted there, and the least recently
+    used files are evicted once the store grows beyond `max_bytes`.
+    """
+    def __init__(
+        self,
+        path: Path|None = None,
+        max_entries: int = 256,
+        max_bytes: int = 64 * 2**20
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._mem: OrderedDict[str, subprocess.CompletedProcess[str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> subprocess.CompletedProcess[str]|None:
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                return self._mem[key]
+        if self.path is None:
+            return None
+        file = self._file(key)
+        try:
+            with file.open('r') as f:
+                data = json.load(f)
+            os.utime(file)  # Marks the entry as recently used.
+        except (OSError, ValueError):
+            return None
+        result = subprocess.CompletedProcess(
+            data['args'], data['returncode'], data['stdout'], data['stderr']
+        )
+        self._remember(key, result)
+        return result
+
+    def put(self, key: str, result: subprocess.CompletedProcess[str]) -> None:
+        self._remember(key, result)
+        if self.path is None:
+            return
+        file = self._file(key)
+        os.makedirs(file.parent, exist_ok=True)
+        write_atomic(file, json.dumps(dict(
+            args = result.args,
+            returncode = result.returncode,
+            stdout = result.stdout,
+            stderr = result.stderr,
+        )))
+        self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def _file(self, key: str) -> Path:
+        assert self.path is not None
+        return self.path / key[:2] / f'{key}.json'
+
+    def _remember(self, key: str, result: subprocess.CompletedProcess[str]) -> None:
+        with self._lock:
+            self._mem[key] = result
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+
+    def _evict(self) -> None:
+        assert self.path is not None
+        entries: list[tuple[int, int, str]] = []
+        for d in os.scandir(self.path):
+            if not d.is_dir():
+                continue
+            for e in os.scandir(d.path):
+                try:
+                    st = e.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, e.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, file in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+_default_cmd_cache: CmdCache|None = None
+def default_cmd_cache() -> CmdCache:
+    """ The process-wide cache used by `cmd_cached`, stored under `cache_dir('cmd')`. """
+    global _default_cmd_cache
+    if _default_cmd_cache is None:
+        _default_cmd_cache = CmdCache(cache_dir('cmd'))
+    return _default_cmd_cache
+
+
+def _fingerprint(path: Path) -> list[Any]:
+    try:
+        st = path.stat()
+    except OSError:
+        return [str(path), None]
+    return [str(path), st.st_mtime_ns, st.st_size, st.st_ino]
+
+def cmd_key(
+    cmd: list[ArgLike],
+    inputs: Iterable[Path] = (),
+    env_keys: Iterable[str] = (),
+    **sp_kwargs: Any
+) -> str:
+    """
+    Computes the cache key of a command: a hash of its arguments, working
+    directory, the values of the environment variables named in `env_keys`,
+    the remaining subprocess arguments, and the stat fingerprints of the
+    executable and of the declared `inputs` files.
+    """
+    args = [ _fmt_arg(c) for c in cmd ]
+    env = sp_kwargs.pop('env', None) or os.environ
+    cwd = sp_kwargs.pop('cwd', None)
+    exe = shutil.which(args[0], path=env.get('PATH')) if args else None
+    key = dict(
+        args = args,
+        cwd = str(Path(cwd or '.').resolve()),
+        env = { k: env.get(k) for k in sorted(env_keys) },
+        kwargs = { k: repr(v) for k, v in sorted(sp_kwargs.items()) },
+        inputs = [
+            _fingerprint(Path(p).resolve())
+            for p in ([ Path(exe) ] if exe else []) + list(inputs)
+        ],
     )
+    return hashlib.sha256(
+        json.dumps(key, sort_keys=True).encode()
+    ).hexdigest()
+
+
+def cmd_cached(
+    args: list[ArgLike],
+    inputs: Iterable[Path] = (),
+    env_keys: Iterable[str] = (),
+    cache: CmdCache|None = None,
+    **sp_kwargs: Any
+) -> CmdResult:
+    """
+    Like `cmd`, but reuses a previous result if the command's key (see
+    `cmd_key`) is unchanged. Use this only for commands whose output is a
+    pure function of that key. Only successful results are cached.
+    """
+    cache = cache or default_cmd_cache()
+    inputs = list(inputs)
+    key = cmd_key(args, inputs, env_keys, **sp_kwargs)
+    hit = cache.get(key)
+    if hit is not None:
+        return CmdResult(hit)
+    result = cmd(args, **sp_kwargs)
+    if result.rc == 0:
+        cache.put(key, result.result)
+    return result
+
+
+class CmdPool:
+    """
+    Runs many commands concurrently, at most `max_workers` at a time.
+
+    Commands are queued with `submit` and executed by `run`, which returns
+    their results in submission order. If `fail_fast` is True, the first
+    failing command kills any children that are still running, skips the
+    rest, and raises `CalledProcessError` (via `CmdResult.check`).
+
+    The asyncio backend is used by default; the thread-pool backend is used
+    when `backend='thread'`, or when called from inside a running event loop.
+    """
+    def __init__(
+        self,
+        max_workers: int|None = None,
+        fail_fast: bool = False,
+        backend: str = 'asyncio'
+    ):
+        if backend not in ('asyncio', 'thread'):
+            raise ValueError(f"Unknown backend: {backend!r}")
+        self.max_workers = max(1, max_workers or os.cpu_count() or 1)
+        self.fail_fast = fail_fast
+        self.backend = backend
+        self._jobs: list[tuple[list[str], dict[str, Any]]] = []
+
+    def submit(self, cmd: list[ArgLike], **sp_kwargs: Any) -> int:
+        """ Queues a command; returns its index in the results of `run`. """
+        self._jobs.append(([ _fmt_arg(c) for c in cmd ], sp_kwargs))
+        return len(self._jobs) - 1
+
+    def run(self) -> list[CmdResult]:
+        jobs, self._jobs = self._jobs, []
+        if not jobs:
+            return []
+        if self.backend == 'thread' or _in_event_loop():
+            return self._run_threads(jobs)
+        return asyncio.run(self._run_async(jobs))
+
+    async def _run_async(
+        self,
+        jobs: list[tuple[list[str], dict[str, Any]]]
+    ) -> list[CmdResult]:
+        limit = asyncio.Semaphore(self.max_workers)
+        stopped = asyncio.Event()
+        running: set[asyncio.subprocess.Process] = set()
+
+        async def one(args: list[str], sp_kwargs: dict[str, Any]) -> CmdResult|None:
+            async with limit:
+                if stopped.is_set():
+                    return None
+                started = time.time()
+                proc = await asyncio.create_subprocess_exec(
+                    *args,
+                    stdout = asyncio.subprocess.PIPE,
+                    stderr = asyncio.subprocess.PIPE,
+                    **sp_kwargs
+                )
+                running.add(proc)
+                try:
+                    out, err = await proc.communicate()
+                finally:
+                    running.discard(proc)
+                if self.fail_fast and proc.returncode:
+                    stopped.set()
+            # The event loop reaps the child, so only wall time is known here.
+            result = CmdResult(
+                subprocess.CompletedProcess(
+                    args, proc.returncode or 0, _decode(out), _decode(err)
+                ),
+                started = started,
+                ended = time.time()
+            )
+            _trace(result, sp_kwargs.get('cwd'))
+            if self.fail_fast:
+                result.check()
+            return result
+
+        tasks = [ asyncio.create_task(one(*job)) for job in jobs ]
+        try:
+            return await asyncio.gather(*tasks)  # type: ignore
+        except BaseException:
+            # Cancelled tasks drop their children from `running`, so keep
+            # a copy to reap them before the loop closes.
+            killed = list(running)
+            for proc in killed:
+                _kill(proc)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for proc in killed:
+                await proc.wait()
+            raise
+
+    def _run_threads(
+        self,
+        jobs: list[tuple[list[str], dict[str, Any]]]
+    ) -> list[CmdResult]:
+        lock = threading.Lock()
+        stopped = threading.Event()
+        running: set[subprocess.Popen[str]] = set()
+
+        def one(args: list[str], sp_kwargs: dict[str, Any]) -> CmdResult|None:
+            with lock:
+                if stopped.is_set():
+                    return None
+                started = time.time()
+                proc = _Popen(
+                    args,
+                    stdout = subprocess.PIPE,
+                    stderr = subprocess.PIPE,
+                    text = True,
+                    **sp_kwargs
+                )
+                running.add(proc)
+            try:
+                out, err = proc.communicate()
+            finally:
+                with lock:
+                    running.discard(proc)
+            return _completed(proc, out, err, started, sp_kwargs.get('cwd'))
+
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            futures = [ pool.submit(one, *job) for job in jobs ]
+            if self.fail_fast:
+                for future in as_completed(futures):
+                    result = future.result()
+                    if result is None or result.rc == 0:
+                        continue
+                    with lock:
+                        stopped.set()
+                        for proc in running:
+                            _kill(proc)
+                    for f in futures:
+                        f.cancel()
+                    result.check()
+            return [ f.result() for f in futures ]  # type: ignore
+
+
+def cmd_many(
+    cmds: Iterable[list[ArgLike]],
+    max_workers: int|None = None,
+    fail_fast: bool = False,
+    backend: str = 'asyncio',
+    **sp_kwargs: Any
+) -> list[CmdResult]:
+    """
+    Runs `cmds` concurrently (see `CmdPool`) with shared `sp_kwargs`.
+    Returns the results in the same order as `cmds`.
+    """
+    pool = CmdPool(max_workers, fail_fast, backend)
+    for c in cmds:
+        pool.submit(c, **sp_kwargs)
+    return pool.run()
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+def _decode(data: bytes|None) -> str:
+    if not data:
+        return ''
+    text = data.decode(locale.getpreferredencoding(False), errors='replace')
+    return text.replace('\r\n', '\n')
+
+def _kill(proc: Any) -> None:
+    try:
+        proc.kill()
+    except ProcessLookupError:
+        pass
+
+def _kill_group(proc: subprocess.Popen[str]) -> None:
+    # Kills the process group led by `proc` (see `CmdStream`), so that
+    # grandchildren holding its pipes die too.
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+            return
+        except (ProcessLookupError, PermissionError):
+            pass
+    _kill(proc)
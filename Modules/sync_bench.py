@@ -0,0 +1,236 @@
+"""
+Benchmarks `sync_build.sync` on synthetic trees.
+
+    python sync_bench.py --files 1000 10000 --sizes mixed --out bench.json
+
+For each tree size, generates a source tree in a temporary directory, then
+times a cold full sync, a no-op rescan, a single-file change and a burst of
+changes. Reports wall and CPU time, files per second, and the read/write
+syscalls and bytes from `/proc/self/io` (Linux only), plus file opens seen by
+an audit hook.
+"""
+import argparse, json, os, platform, random, shutil, sys, tempfile, time
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Any, Callable
+
+from sync_build import sync
+
+
+size_mixes: dict[str, list[tuple[float, int]]] = {
+    # name: [(share of files, size in bytes)]
+    'small': [(1.0, 1 << 10)],
+    'mixed': [(0.90, 4 << 10), (0.09, 256 << 10), (0.01, 8 << 20)],
+    'large': [(0.5, 1 << 20), (0.5, 32 << 20)],
+}
+blacklist = ['node_modules', '__pycache__']
+_files_per_dir = 32
+
+
+def make_tree(
+    root: Path,
+    files: int,
+    depth: int = 4,
+    sizes: str = 'mixed',
+    blacklisted_share: float = 0.1,
+    seed: int = 0
+) -> dict[str, Any]:
+    """
+    Writes `files` files spread over directories up to `depth` deep, with
+    `blacklisted_share` of them under blacklisted directories. Mtimes are
+    backdated an hour, so the tree looks settled to the sync manifest.
+    Returns counts of the synced and blacklisted files and bytes.
+    """
+    rng = random.Random(seed)
+    block = rng.randbytes(1 << 20)
+    n_dirs = max(1, files // _files_per_dir)
+    base = max(2, round(n_dirs ** (1 / depth) + 0.5))
+    mix = size_mixes[sizes]
+    stats: dict[str, Any] = dict(files=0, bytes=0, blacklisted_files=0)
+    for i in range(files):
+        d = i % n_dirs
+        parts = []
+        for _ in range(depth):
+            parts.append(f'd{d % base}')
+            d //= base
+            if not d: break
+        blacklisted = rng.random() < blacklisted_share
+        if blacklisted:
+            parts.append(rng.choice(blacklist))
+        path = root.joinpath(*parts, f'f{i}.dat')
+        size = rng.choices([s for _, s in mix], [w for w, _ in mix])[0]
+        os.makedirs(path.parent, exist_ok=True)
+        with path.open('wb') as f:
+            offset = i % len(block)
+            while size > 0:
+                chunk = block[offset : offset + size]
+                f.write(chunk)
+                size -= len(chunk)
+                offset = 0
+        if blacklisted:
+            stats['blacklisted_files'] += 1
+        else:
+            stats['files'] += 1
+            stats['bytes'] += path.stat().st_size
+    past = time.time() - 3600
+    for dirpath, _, filenames in os.walk(root, topdown=False):
+        for name in filenames:
+            os.utime(os.path.join(dirpath, name), (past, past))
+        os.utime(dirpath, (past, past))
+    return stats
+
+
+def _touch_files(root: Path, count: int, seed: int) -> None:
+    """Appends to `count` synced files without changing any directory."""
+    rng = random.Random(seed)
+    candidates = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in blacklist]
+        candidates.extend(os.path.join(dirpath, name) for name in filenames)
+    for path in rng.sample(candidates, min(count, len(candidates))):
+        with open(path, 'ab') as f:
+            f.write(b'changed\n')
+
+
+_opens = 0
+_counting = False
+
+def _audit(event: str, _args: tuple) -> None:
+    global _opens
+    if _counting and event == 'open':
+        _opens += 1
+
+
+def _proc_io() -> dict[str, int]:
+    try:
+        with open('/proc/self/io') as f:
+            return {k: int(v) for k, v in (line.split(': ') for line in f)}
+    except OSError:
+        return {}
+
+
+def _measure(run: Callable[[], None], files: int) -> dict[str, Any]:
+    global _opens, _counting
+    _opens = 0
+    io_before = _proc_io()
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    _counting = True
+    try:
+        run()
+    finally:
+        _counting = False
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    io_after = _proc_io()
+    result = dict(
+        wall_s = round(wall, 4),
+        cpu_s = round(cpu, 4),
+        files_per_s = round(files / wall) if wall else None,
+        opens = _opens,
+    )
+    for key, name in (
+        ('syscr', 'read_syscalls'), ('syscw', 'write_syscalls'),
+        ('rchar', 'bytes_read'), ('wchar', 'bytes_written'),
+    ):
+        if key in io_before:
+            result[name] = io_after[key] - io_before[key]
+    return result
+
+
+def bench(
+    files: int,
+    depth: int = 4,
+    sizes: str = 'mixed',
+    blacklisted_share: float = 0.1,
+    burst: int = 100,
+    tmp_dir: Path|None = None,
+    target_dir: Path|None = None,
+    **sync_kwargs: Any
+) -> dict[str, Any]:
+    """Runs every scenario on one synthetic tree and returns the results."""
+    work = Path(tempfile.mkdtemp(prefix='sync-bench-', dir=tmp_dir))
+    target_root = Path(tempfile.mkdtemp(prefix='sync-bench-', dir=target_dir)) if target_dir else work
+    cache = os.environ.get('BUILDTOOLS_CACHE_DIR')
+    os.environ['BUILDTOOLS_CACHE_DIR'] = str(work / 'cache')
+    try:
+        source, target = work / 'source', target_root / 'target'
+        started = time.perf_counter()
+        tree = make_tree(source, files, depth, sizes, blacklisted_share)
+        tree['generate_s'] = round(time.perf_counter() - started, 2)
+        print(f"  generated {tree['files']} files in {tree['generate_s']}s", file=sys.stderr)
+
+        def run() -> None:
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                sync([(source, target)], suffix_blacklist=blacklist, **sync_kwargs)
+
+        scenarios = {}
+        scenarios['cold'] = _measure(run, tree['files'])
+        scenarios['noop'] = _measure(run, tree['files'])
+        _touch_files(source, 1, seed=1)
+        scenarios['single_change'] = _measure(run, tree['files'])
+        _touch_files(source, burst, seed=2)
+        scenarios[f'burst_{burst}'] = _measure(run, tree['files'])
+        for name, result in scenarios.items():
+            print(
+                f"  {name:>14}: {result['wall_s']:8.3f}s"
+                f" {result['files_per_s'] or 0:>10} files/s", file=sys.stderr
+            )
+        return dict(
+            files=files, depth=depth, sizes=sizes,
+            blacklisted_share=blacklisted_share, tree=tree, scenarios=scenarios,
+        )
+    finally:
+        if cache is None:
+            os.environ.pop('BUILDTOOLS_CACHE_DIR', None)
+        else:
+            os.environ['BUILDTOOLS_CACHE_DIR'] = cache
+        shutil.rmtree(work, ignore_errors=True)
+        if target_root != work:
+            shutil.rmtree(target_root, ignore_errors=True)
+
+
+def main(argv: list[str]|None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks `sync_build.sync` on synthetic trees.")
+    parser.add_argument('--files', type=int, nargs='+', default=[1000, 10000],
+        help="file counts to benchmark (default: 1000 10000)")
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--sizes', choices=size_mixes, default='mixed')
+    parser.add_argument('--blacklisted', type=float, default=0.1,
+        help="share of files under blacklisted directories")
+    parser.add_argument('--burst', type=int, default=100,
+        help="files changed in the burst scenario")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--link', action='store_true')
+    parser.add_argument('--tmp-dir', type=Path, default=None,
+        help="where to generate source trees")
+    parser.add_argument('--target-dir', type=Path, default=None,
+        help="where to sync to, e.g. a mounted share (default: next to the source)")
+    parser.add_argument('--out', type=Path, default=None,
+        help="write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    sys.addaudithook(_audit)
+    runs = []
+    for files in args.files:
+        print(f"Benchmarking {files} files...", file=sys.stderr)
+        runs.append(bench(
+            files, args.depth, args.sizes, args.blacklisted, args.burst,
+            args.tmp_dir, args.target_dir,
+            max_workers=args.workers, link=args.link,
+        ))
+    results = dict(
+        python = platform.python_version(),
+        platform = platform.platform(),
+        cpu_count = os.cpu_count(),
+        runs = runs,
+    )
+    text = json.dumps(results, indent=2)
+    if args.out:
+        args.out.write_text(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,72 +1,641 @@
-import os, shutil, time
+import ctypes, errno, hashlib, json, mmap, os, select, shutil, stat, struct, sys, time
+from concurrent.futures import Future, ThreadPoolExecutor
 from math import floor
 from pathlib import Path
-from typing import Iterable
+from typing import Callable, Iterable, Iterator, Literal
+
+from copy_build import FileCopier
+from subprocess_build import cache_dir, write_atomic
+from walk_build import PathMatcher, scan_dir
+
+
+FileSource = Callable[[Path], Iterable[Path]]
+Backend = Literal['auto', 'inotify', 'poll']
 
 
 def sync(
     dirs: Iterable[tuple[Path, Path]],
     watch: bool = False,
     poll_interval_s: float = 3,
-    suffix_blacklist: Iterable[str]|None = None
+    suffix_blacklist: Iterable[str]|None = None,
+    ignore: Iterable[str]|None = None,
+    file_source: FileSource|None = None,
+    backend: Backend = 'auto',
+    max_workers: int|None = None,
+    link: bool = False,
+    delta_min_size: int|None = 64 << 20,
+    quiet_s: float = 0.3,
+    max_wait_s: float = 3
 ) -> None:
     """
     Synchronises the contents of source-target directory pairs (recursively).
-    If `watch` is True, will poll for changes every `poll_interval_s` seconds
-    until SIGINT.
+    If `watch` is True, will keep syncing changes until SIGINT: with inotify
+    events on Linux (`backend='inotify'`), or by polling every
+    `poll_interval_s` seconds (`backend='poll'`). `'auto'` uses inotify when
+    available and falls back to polling.
     Does not delete files in the target directory that are not in the source
-    directory.
+    directory. Files and directories whose names end with a `suffix_blacklist`
+    entry, or that match a gitignore-style `ignore` pattern, are skipped.
+    `file_source` lists the files of a source directory, e.g.
+    `git_build.git_files` to only sync what git tracks; by default the whole
+    directory is walked. A `file_source` can only be honoured by polling.
+    What was synced is remembered in a manifest under `cache_dir('sync')`, so
+    unchanged files and directories cost a stat (or nothing) on later passes.
+    Files are copied on `max_workers` threads, reflinked or copied in the
+    kernel where possible; with `link`, targets on the same device as their
+    source are hardlinked instead.
+    Changed files of at least `delta_min_size` bytes (None: never) only have
+    their changed 1 MiB blocks rewritten, in place, when the target still
+    holds the last synced version.
+    While watching, changes are gathered until none arrive for `quiet_s`
+    seconds (or `max_wait_s` after the first), and files still changing are
+    held back, so bursts are copied once, as one batch.
     """
-    suffix_blacklist = list(suffix_blacklist or ())
+    matcher = PathMatcher(suffix_blacklist or (), ignore or ())
+    transfer = _Transfer(max_workers, link, delta_min_size)
+    pairs = [_SyncPair(Path(s), Path(t), matcher) for s, t in dirs]
+    notify = None
+    if watch and backend != 'poll':
+        if file_source is not None and backend == 'inotify':
+            raise ValueError("file_source is not supported by the inotify backend")
+        if file_source is None:
+            try:
+                notify = _Inotify()
+                for pair in pairs:
+                    notify.add_tree(pair.s_dir, matcher, pair.s_dir)
+            except OSError as e:
+                if notify is not None: notify.close()
+                notify = None
+                if backend == 'inotify': raise
+                print(f"inotify unavailable ({e}); polling instead.")
     if watch:
-        print(
-            f"Watching for changes in {sum(1 for _ in dirs)} directories "
-            f"(poll {poll_interval_s:.0f}s)..."
-        )
+        how = "inotify" if notify else f"poll {poll_interval_s:.0f}s"
+        print(f"Watching for changes in {len(pairs)} directories ({how})...")
         print("  Press Ctrl+C to stop.")
         print()
     try:
-        while True:
-            n = 0
-            for s, t in _ops(dirs, suffix_blacklist):
-                if t.exists() and t.is_file():
-                    t_stat = t.stat()
-                    s_stat = s.stat()
-                    if (
-                        floor(t_stat.st_mtime) == floor(s_stat.st_mtime)
-                        and t_stat.st_size == s_stat.st_size
-                    ):
-                        continue
-                print(f"Copy: {s.name} ---> {t.name}")
-                os.makedirs(t.parent, exist_ok=True)
-                shutil.copy2(s, t)
-                n += 1
-            if not watch: 
-                print(f"Synced {n} files.")
-                return
-            if n > 0:
-                print(f"Synced {n} files.")
-            time.sleep(poll_interval_s)
+        n = _run_jobs(transfer, (
+            (pair, rel, key)
+            for pair in pairs
+            for rel, key in pair.scan(file_source)
+        ))
+        _finish(pairs)
+        if not watch:
+            print(f"Synced {n} files.")
+            return
+        if n > 0:
+            print(f"Synced {n} files.")
+        batch = _Coalescer(quiet_s, max_wait_s)
+        if notify is not None:
+            _watch_events(notify, pairs, matcher, transfer, batch)
+        else:
+            _watch_poll(pairs, file_source, poll_interval_s, transfer, batch)
     except KeyboardInterrupt:
         if not watch: raise
         print("Stopped watching.")
         print()
+    finally:
+        transfer.close()
+        if notify is not None: notify.close()
+        for pair in pairs:
+            pair.save()
 
 
-def _ops(
-    dirs: Iterable[tuple[Path, Path]],
-    suffix_blacklist: Iterable[str]
-) -> Iterable[tuple[Path, Path]]:
-    for s_dir, t_dir in dirs:
-        for s_file in s_dir.rglob('*'):
-            relative_path = s_file.relative_to(s_dir)
-            if (
-                s_file.is_dir()
-                or any(
-                    p.endswith(suffix)
-                    for p in relative_path.parts
-                    for suffix in suffix_blacklist
+def _finish(pairs: list['_SyncPair']) -> None:
+    for pair in pairs:
+        pair.finish()
+        pair.save()
+
+
+_settle_ns = 2_000_000_000
+"""Directory mtimes younger than this may still change within the same tick."""
+
+
+def _dir_mtime(path: Path|str) -> int|None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _settled(mtime_ns: int|None) -> int|None:
+    if mtime_ns is None or time.time_ns() - mtime_ns < _settle_ns:
+        return None
+    return mtime_ns
+
+
+class _SyncPair:
+    """
+    A source-target directory pair and its manifest of what was last synced.
+    The manifest holds the source (mtime_ns, size, inode) of every synced file,
+    the listing of each source directory by directory mtime, and the mtime of
+    each target directory. A file whose source stat matches and whose target
+    directory is unchanged is skipped without touching the target. Large
+    files also have the target's own (mtime_ns, size) after the copy and
+    their block hashes recorded, for delta copies.
+    """
+
+    def __init__(self, s_dir: Path, t_dir: Path, ignore: PathMatcher):
+        self.s_dir = s_dir
+        self.t_dir = t_dir
+        self.ignore = ignore
+        key = hashlib.sha256(json.dumps([
+            os.path.abspath(s_dir), os.path.abspath(t_dir),
+            sorted(ignore.suffixes), ignore.patterns
+        ]).encode()).hexdigest()[:32]
+        self.path = cache_dir('sync', f'{key}.json')
+        self.files: dict[str, list[int]] = {}
+        self.dirs: dict[str, list] = {}  # rel -> [mtime_ns|None, files, subdirs]
+        self.targets: dict[str, int|None] = {}
+        self.blocks: dict[str, list] = {}  # rel -> [target key, block hashes]
+        self._fresh_targets: set[str] = set()
+        self._dirty = False
+        try:
+            data = json.loads(self.path.read_text())
+            if data.get('version') == 2:
+                self.files = data['files']
+                self.dirs = data['dirs']
+                self.targets = data['targets']
+                self.blocks = data['blocks']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    def save(self) -> None:
+        if not self._dirty: return
+        try:
+            os.makedirs(self.path.parent, exist_ok=True)
+            write_atomic(self.path, json.dumps(dict(
+                version=2, files=self.files, dirs=self.dirs,
+                targets=self.targets, blocks=self.blocks
+            )))
+            self._dirty = False
+        except OSError:
+            pass
+
+    def scan(
+        self, file_source: FileSource|None = None
+    ) -> Iterator[tuple[str, list[int]]]:
+        """Yields `(relative path, source key)` for every file to copy."""
+        self._fresh_targets = {
+            d for d, m in self.targets.items()
+            if m is not None and _dir_mtime(os.path.join(self.t_dir, d)) == m
+        }
+        seen = set()
+        for rel, st in self.listed(file_source) if file_source else self.walk():
+            seen.add(rel)
+            key = self.pending(rel, st)
+            if key is not None:
+                yield rel, key
+        if seen != self.files.keys():
+            self.files = {r: v for r, v in self.files.items() if r in seen}
+            self.blocks = {r: v for r, v in self.blocks.items() if r in seen}
+            self._dirty = True
+
+    def finish(self) -> None:
+        """Records target directory mtimes once a scan's copies have landed."""
+        targets = {
+            d: _settled(_dir_mtime(os.path.join(self.t_dir, d)))
+            for d in {os.path.dirname(r) for r in self.files}
+        }
+        if targets != self.targets:
+            self.targets = targets
+            self._dirty = True
+
+    def pending_path(self, rel: str) -> list[int]|None:
+        try:
+            st = os.stat(os.path.join(self.s_dir, rel))
+        except OSError:
+            return None
+        return self.pending(rel, st) if stat.S_ISREG(st.st_mode) else None
+
+    def pending(self, rel: str, s_stat: os.stat_result) -> list[int]|None:
+        """
+        Gets the source key to record if the file needs copying, or None if the
+        manifest or the target shows it's current.
+        """
+        key = [s_stat.st_mtime_ns, s_stat.st_size, s_stat.st_ino]
+        known = self.files.get(rel)
+        if known == key and os.path.dirname(rel) in self._fresh_targets:
+            return None
+        if known is None or known == key:
+            # No record of the target, so compare it as a cold sync would
+            try:
+                t_stat = os.stat(os.path.join(self.t_dir, rel))
+                if (
+                    stat.S_ISREG(t_stat.st_mode)
+                    and floor(t_stat.st_mtime) == floor(s_stat.st_mtime)
+                    and t_stat.st_size == s_stat.st_size
+                ):
+                    if known is None:
+                        self.copied(rel, key)
+                    return None
+            except OSError:
+                pass
+        return key
+
+    def copied(
+        self, rel: str, key: list[int],
+        blocks: tuple[list[int], list[str]]|None = None
+    ) -> None:
+        self.files[rel] = key
+        if blocks is not None:
+            self.blocks[rel] = list(blocks)
+        else:
+            self.blocks.pop(rel, None)
+        self._dirty = True
+
+    def walk(self, top: str = '') -> Iterator[tuple[str, os.stat_result]]:
+        """
+        Yields `(relative path, stat)` for source files under `top`, reusing
+        the listings of directories whose mtime hasn't changed.
+        """
+        dirs = {}
+        stack = [top]
+        while stack:
+            rel = stack.pop()
+            d = os.path.join(self.s_dir, rel)
+            mtime = _dir_mtime(d)
+            if mtime is None: continue
+            known = self.dirs.get(rel)
+            if known and known[0] == mtime:
+                files, subdirs = known[1], known[2]
+            else:
+                try:
+                    listing = scan_dir(self.s_dir, rel, self.ignore)
+                except OSError:
+                    continue
+                files, subdirs = ([e.name for e in l] for l in listing)
+            dirs[rel] = [_settled(mtime), files, subdirs]
+            stack.extend(_join(rel, x) for x in subdirs)
+            for name in files:
+                try:
+                    st = os.stat(os.path.join(d, name))
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    yield _join(rel, name), st
+        if top:
+            self.dirs.update(dirs)
+        elif dirs != self.dirs:
+            self.dirs = dirs
+            self._dirty = True
+
+    def listed(self, file_source: FileSource) -> Iterator[tuple[str, os.stat_result]]:
+        for s_file in file_source(self.s_dir):
+            rel = s_file.relative_to(self.s_dir).as_posix()
+            if self.ignore.match_path(rel): continue
+            try:
+                st = os.stat(s_file)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                yield rel, st
+
+
+def _join(rel: str, name: str) -> str:
+    return f'{rel}/{name}' if rel else name
+
+
+# --- Transfer
+
+class _Transfer:
+    """
+    Copies files on a thread pool, through a `FileCopier`; metadata is then
+    copied as `shutil.copy2` does. With `link`, targets on the source's
+    device are hardlinked instead. Large files are updated block by block
+    (see `copy`).
+    """
+
+    def __init__(
+        self,
+        max_workers: int|None = None,
+        link: bool = False,
+        delta_min_size: int|None = None
+    ):
+        self.link = link
+        self.delta_min_size = delta_min_size
+        self._pool = ThreadPoolExecutor(max_workers, 'sync')
+        self._copier = FileCopier()
+
+    def submit(
+        self, s: Path, t: Path,
+        previous: tuple[list[int], list[str]]|None = None
+    ) -> Future:
+        return self._pool.submit(self.copy, s, t, previous)
+
+    def close(self) -> None:
+        self._pool.shutdown(cancel_futures=True)
+
+    def copy(
+        self, s: Path, t: Path,
+        previous: tuple[list[int], list[str]]|None = None
+    ) -> tuple[list[int], list[str]]|None:
+        """
+        Copies `s` to `t`. For files of at least `delta_min_size`, returns the
+        target's (mtime_ns, size) after the copy and the block hashes of what
+        was written; given those from the last copy and a target that still
+        matches them, only changed blocks are rewritten.
+        """
+        os.makedirs(t.parent, exist_ok=True)
+        blocks = None
+        s_fd = os.open(s, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            s_stat = os.fstat(s_fd)
+            if self.link and self._copier.link(s, t):
+                return None
+            t_fd = os.open(t, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o666)
+            try:
+                t_stat = os.fstat(t_fd)
+                if os.path.samestat(s_stat, t_stat):
+                    return None  # already hardlinked: truncating would lose the source
+                # (Empty files can't be memory-mapped, so never take deltas of them.)
+                delta = (
+                    self.delta_min_size is not None
+                    and s_stat.st_size >= max(1, self.delta_min_size)
                 )
-            ): continue
-            t_file = t_dir / relative_path
-            yield s_file, t_file
+                if (
+                    delta and previous is not None
+                    and list(previous[0]) == [t_stat.st_mtime_ns, t_stat.st_size]
+                ):
+                    blocks = _delta_copy(s_fd, t_fd, s_stat.st_size, previous[1])
+                else:
+                    os.ftruncate(t_fd, 0)
+                    self._copier.copy_data(s_fd, t_fd, (s_stat.st_dev, t_stat.st_dev))
+                    if delta:
+                        blocks = _delta_copy(s_fd, None, s_stat.st_size, [])
+                if blocks is not None:
+                    after = os.fstat(s_fd)
+                    if [after.st_mtime_ns, after.st_size] != [s_stat.st_mtime_ns, s_stat.st_size]:
+                        blocks = None  # changed while copying: hashes may not match the target
+            finally:
+                os.close(t_fd)
+        finally:
+            os.close(s_fd)
+        shutil.copystat(s, t)
+        if blocks is None:
+            return None
+        # (Compared as written back: coarse timestamps may not keep the source's.)
+        t_stat = os.stat(t)
+        return [t_stat.st_mtime_ns, t_stat.st_size], blocks
+
+
+_delta_block = 1 << 20
+
+
+def _delta_copy(
+    s_fd: int,
+    t_fd: int|None,
+    size: int,
+    previous: list[str]
+) -> list[str]:
+    """
+    Hashes the source by block through a memory map, writing each block whose
+    hash differs from `previous` into the target in place (when `t_fd` is
+    given), and truncates the target to size. Returns the new block hashes.
+    """
+    blocks = []
+    with mmap.mmap(s_fd, size, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+        for i, offset in enumerate(range(0, size, _delta_block)):
+            with view[offset : offset + _delta_block] as block:
+                digest = hashlib.blake2b(block, digest_size=16).hexdigest()
+                blocks.append(digest)
+                if t_fd is None or (i < len(previous) and previous[i] == digest):
+                    continue
+                written = 0
+                while written < len(block):
+                    with block[written:] as rest:
+                        written += os.pwrite(t_fd, rest, offset + written)
+    if t_fd is not None:
+        os.ftruncate(t_fd, size)
+    return blocks
+
+
+def _run_jobs(
+    transfer: _Transfer,
+    jobs: Iterable[tuple[_SyncPair, str, list[int]]]
+) -> int:
+    """Transfers `(pair, relative path, source key)` jobs; returns the count."""
+    submitted = []
+    for pair, rel, key in jobs:
+        s, t = pair.s_dir / rel, pair.t_dir / rel
+        print(f"Copy: {s.name} ---> {t.name}")
+        previous = pair.blocks.get(rel)
+        future = transfer.submit(s, t, tuple(previous) if previous else None)
+        submitted.append((pair, rel, key, future))
+    n = 0
+    for pair, rel, key, future in submitted:
+        try:
+            blocks = future.result()
+        except FileNotFoundError:
+            continue  # removed while syncing
+        pair.copied(rel, key, blocks)
+        n += 1
+    return n
+
+
+# --- inotify backend
+
+_IN_ATTRIB      = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM  = 0x00000040
+_IN_MOVED_TO    = 0x00000080
+_IN_CREATE      = 0x00000100
+_IN_Q_OVERFLOW  = 0x00004000
+_IN_IGNORED     = 0x00008000
+_IN_ONLYDIR     = 0x01000000
+_IN_ISDIR       = 0x40000000
+_IN_WATCH_MASK = (
+    _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE
+    | _IN_ONLYDIR
+)
+_in_event = struct.Struct('iIII')  # wd, mask, cookie, len; then name[len]
+
+
+class _Inotify:
+    """Recursive directory watches over Linux inotify (via ctypes)."""
+
+    def __init__(self) -> None:
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, "inotify requires Linux")
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.dirs: dict[int, Path] = {}
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def add_tree(self, root: Path, ignore: PathMatcher, top: Path) -> None:
+        """
+        Watches `root` and its subdirectories, skipping those `ignore` matches
+        (relative to `top`).
+        """
+        for d, subdirs, _ in os.walk(root):
+            wd = self._add_watch(self.fd, os.fsencode(d), _IN_WATCH_MASK)
+            if wd < 0:
+                e = ctypes.get_errno()
+                if e in (errno.ENOENT, errno.ENOTDIR): continue  # already gone
+                raise OSError(e, os.strerror(e), d)
+            self.dirs[wd] = Path(d)
+            rel = Path(d).relative_to(top).as_posix()
+            subdirs[:] = [
+                s for s in subdirs
+                if not ignore(s if rel == '.' else f'{rel}/{s}', is_dir=True)
+            ]
+
+    def remove_tree(self, root: Path) -> None:
+        for wd, d in list(self.dirs.items()):
+            if d == root or d.is_relative_to(root):
+                self._rm_watch(self.fd, wd)
+                del self.dirs[wd]
+
+    def read(self, timeout: float|None = None) -> Iterator[tuple[Path|None, int]]:
+        """
+        Waits up to `timeout` seconds (None: forever) for the next batch of
+        events and yields `(path, mask)` for each.
+        A `None` path means the kernel queue overflowed and events were lost.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return
+        buf = os.read(self.fd, 64 * 1024)
+        i = 0
+        while i < len(buf):
+            wd, mask, _, length = _in_event.unpack_from(buf, i)
+            name = buf[i + _in_event.size : i + _in_event.size + length]
+            i += _in_event.size + length
+            if mask & _IN_Q_OVERFLOW:
+                yield None, mask
+                continue
+            if mask & _IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            d = self.dirs.get(wd)
+            if d is None: continue
+            name = name.rstrip(b'\0')
+            yield (d / os.fsdecode(name) if name else d), mask
+
+
+class _Coalescer:
+    """
+    Gathers changed files until no change has arrived for `quiet_s` seconds,
+    or `max_wait_s` after the first, then hands them over as one batch.
+    Files whose stat moved on since they were added are still being written,
+    so they are held for another quiet period (up to `max_wait_s`).
+    """
+
+    def __init__(self, quiet_s: float, max_wait_s: float):
+        self.quiet_s = quiet_s
+        self.max_wait_s = max_wait_s
+        self.files: dict[tuple[_SyncPair, str], list[int]] = {}
+        self._first = self._last = 0.0
+
+    def add(self, pair: _SyncPair, rel: str, key: list[int]) -> None:
+        if self.files.get((pair, rel)) == key: return
+        now = time.monotonic()
+        if not self.files:
+            self._first = now
+        self.files[pair, rel] = key
+        self._last = now
+
+    def timeout(self) -> float|None:
+        """Gets the seconds until the batch is due, or None if it's empty."""
+        if not self.files: return None
+        due = min(self._last + self.quiet_s, self._first + self.max_wait_s)
+        return max(0, due - time.monotonic())
+
+    def ready(self) -> bool:
+        return self.timeout() == 0
+
+    def take(self) -> list[tuple[_SyncPair, str, list[int]]]:
+        expired = time.monotonic() - self._first >= self.max_wait_s
+        jobs = []
+        for (pair, rel), key in list(self.files.items()):
+            current = pair.pending_path(rel)
+            if current is not None and current != key and not expired:
+                self.files[pair, rel] = current  # still changing
+                self._last = time.monotonic()
+                continue
+            del self.files[pair, rel]
+            if current is not None:
+                jobs.append((pair, rel, current))
+        if not self.files:
+            self._first = self._last = 0.0
+        return jobs
+
+
+def _watch_events(
+    notify: _Inotify,
+    pairs: list[_SyncPair],
+    ignore: PathMatcher,
+    transfer: _Transfer,
+    batch: _Coalescer
+) -> None:
+    """Copies the paths named by inotify events, in coalesced batches."""
+    while True:
+        for path, mask in notify.read(batch.timeout()):
+            if path is None:
+                print("inotify queue overflowed; rescanning.")
+                for pair in pairs:
+                    notify.remove_tree(pair.s_dir)
+                    notify.add_tree(pair.s_dir, ignore, pair.s_dir)
+                    for rel, key in pair.scan():
+                        batch.add(pair, rel, key)
+                continue
+            for pair in pairs:
+                if not path.is_relative_to(pair.s_dir): continue
+                rel = path.relative_to(pair.s_dir).as_posix()
+                if rel == '.' or ignore.match_path(rel, bool(mask & _IN_ISDIR)):
+                    continue
+                if not mask & _IN_ISDIR:
+                    if mask & _IN_CREATE: continue  # wait for IN_CLOSE_WRITE
+                    key = pair.pending_path(rel)
+                    if key is not None:
+                        batch.add(pair, rel, key)
+                elif mask & _IN_MOVED_FROM:
+                    notify.remove_tree(path)
+                elif mask & (_IN_CREATE | _IN_MOVED_TO):
+                    # Files may land before the new watch does, so scan it too
+                    notify.add_tree(path, ignore, pair.s_dir)
+                    for file, st in pair.walk(rel):
+                        key = pair.pending(file, st)
+                        if key is not None:
+                            batch.add(pair, file, key)
+        if batch.ready():
+            n = _run_jobs(transfer, batch.take())
+            if n > 0:
+                print(f"Synced {n} files.")
+
+
+def _watch_poll(
+    pairs: list[_SyncPair],
+    file_source: FileSource|None,
+    poll_interval_s: float,
+    transfer: _Transfer,
+    batch: _Coalescer
+) -> None:
+    """Rescans every `poll_interval_s` seconds, copying in coalesced batches."""
+    next_scan = time.monotonic() + poll_interval_s
+    while True:
+        timeout = batch.timeout()
+        time.sleep(max(0, min(
+            next_scan - time.monotonic(),
+            poll_interval_s if timeout is None else timeout
+        )))
+        if time.monotonic() >= next_scan:
+            for pair in pairs:
+                for rel, key in pair.scan(file_source):
+                    batch.add(pair, rel, key)
+            next_scan = time.monotonic() + poll_interval_s
+        if batch.ready():
+            n = _run_jobs(transfer, batch.take())
+            if n > 0:
+                print(f"Synced {n} files.")
+            _finish(pairs)
@@ -0,0 +1,85 @@
+import errno, os, shutil
+from pathlib import Path
+
+import pytest
+
+import copy_build
+from copy_build import FileCopier
+
+
+@pytest.fixture
+def source(tmp_path) -> Path:
+    source = tmp_path.joinpath('source')
+    source.write_bytes(b'data' * 1000)
+    return source
+
+
+@pytest.fixture
+def calls(monkeypatch) -> list[str]:
+    """Makes every kernel copy method fail, recording each attempt."""
+    calls: list[str] = []
+    def failing(name: str):
+        def method(*args):
+            calls.append(name)
+            raise OSError(errno.EXDEV, name)
+        return method
+    class Fcntl:
+        ioctl = staticmethod(failing('reflink'))
+    monkeypatch.setattr(copy_build, 'fcntl', Fcntl)
+    monkeypatch.setattr(os, 'copy_file_range', failing('copy_file_range'), raising=False)
+    monkeypatch.setattr(os, 'sendfile', failing('sendfile'), raising=False)
+    return calls
+
+
+def test_copy_when_kernel_methods_fail_then_falls_back_in_order(source, tmp_path, calls) -> None:
+    target = tmp_path.joinpath('target')
+    FileCopier().copy(source, target)
+    assert target.read_bytes() == source.read_bytes()
+    assert calls == ['reflink', 'copy_file_range', 'sendfile']
+
+
+def test_copy_when_methods_failed_for_device_pair_then_not_tried_again(source, tmp_path, calls) -> None:
+    copier = FileCopier()
+    copier.copy(source, tmp_path.joinpath('first'))
+    calls.clear()
+    copier.copy(source, tmp_path.joinpath('second'))
+    assert tmp_path.joinpath('second').read_bytes() == source.read_bytes()
+    assert calls == []
+
+
+def test_copy_when_copy_file_range_works_then_sendfile_not_tried(source, tmp_path, monkeypatch) -> None:
+    if not hasattr(os, 'copy_file_range'):
+        pytest.skip("no copy_file_range")
+    monkeypatch.setattr(copy_build, 'fcntl', None)
+    def sendfile(*args):
+        raise AssertionError("tried sendfile")
+    monkeypatch.setattr(os, 'sendfile', sendfile, raising=False)
+    target = tmp_path.joinpath('target')
+    FileCopier().copy(source, target)
+    assert target.read_bytes() == source.read_bytes()
+
+
+def test_copy_when_source_empty_then_target_empty(tmp_path, calls) -> None:
+    source, target = tmp_path.joinpath('source'), tmp_path.joinpath('target')
+    source.write_bytes(b'')
+    FileCopier().copy(source, target)
+    assert target.read_bytes() == b''
+
+
+def test_link_when_target_exists_then_replaced_by_hardlink(source, tmp_path) -> None:
+    target = tmp_path.joinpath('target')
+    target.write_bytes(b'old')
+    assert FileCopier().link(source, target)
+    assert os.path.samestat(source.stat(), target.stat())
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['source', 'target']
+
+
+def test_copy_when_metadata_set_then_matches_copy2(source, tmp_path) -> None:
+    source.chmod(0o640)
+    os.utime(source, ns=(1_000_000_123, 2_000_000_456))
+    ours, theirs = tmp_path.joinpath('ours'), tmp_path.joinpath('theirs')
+    FileCopier().copy(source, ours)
+    shutil.copy2(source, theirs)
+    assert ours.read_bytes() == theirs.read_bytes()
+    assert ours.stat().st_mode == theirs.stat().st_mode
+    assert ours.stat().st_mtime_ns == theirs.stat().st_mtime_ns
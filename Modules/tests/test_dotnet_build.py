@@ -0,0 +1,279 @@
+import json, os, re, sys
+from pathlib import Path
+from subprocess import CalledProcessError, CompletedProcess
+from typing import Any
+
+import pytest
+
+import dotnet_build
+from dotnet_build import dotnet_test_sharded
+from subprocess_build import ArgLike, CmdResult
+
+
+def _result(args: list[Any], rc: int = 0, out: str = '') -> CmdResult:
+    return CmdResult(CompletedProcess(args, rc, out, ''))
+
+
+# --- Sharded tests
+
+# (fully qualified name, class, outcome, seconds) of the tests in the fake project
+_tests = [
+    ('N.A.Slow', 'N.A', 'Passed', 10.0),
+    ('N.B.Fast', 'N.B', 'Passed', 0.5),
+    ('N.B.Broken', 'N.B', 'Failed', 0.5),
+]
+
+
+def _selected(test: str, filter: str|None) -> bool:
+    if filter is None:
+        return True
+    for part in filter.split('|'):
+        excluded = re.findall(r'FullyQualifiedName!~([\w.]+)', part)
+        if excluded and not any(e in test for e in excluded):
+            return True
+        included = re.fullmatch(r'FullyQualifiedName~([\w.]+)', part)
+        if included and included.group(1) in test:
+            return True
+    return False
+
+
+def _write_trx(path: Path, tests: list[tuple[str, str, str, float]]) -> None:
+    results = ''.join(
+        f'<UnitTestResult testId="{i}" testName="{name}" outcome="{outcome}" '
+        f'duration="00:00:{seconds:010.7f}" />'
+        for i, (name, _, outcome, seconds) in enumerate(tests)
+    )
+    definitions = ''.join(
+        f'<UnitTest id="{i}"><TestMethod className="{cls}" name="{name}" /></UnitTest>'
+        for i, (name, cls, _, _) in enumerate(tests)
+    )
+    failed = sum(outcome == 'Failed' for _, _, outcome, _ in tests)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        '<TestRun xmlns="http://microsoft.com/schemas/VisualStudio/TeamTest/2010">'
+        f'<Results>{results}</Results><TestDefinitions>{definitions}</TestDefinitions>'
+        f'<ResultSummary><Counters total="{len(tests)}" passed="{len(tests) - failed}" '
+        f'failed="{failed}" /></ResultSummary></TestRun>'
+    )
+
+
+@pytest.fixture
+def fake_dotnet(monkeypatch) -> list[list[str]]:
+    """Replaces `dotnet` (via `cmd`) with a fake whose test runs write TRX files."""
+    calls: list[list[str]] = []
+    def cmd(args: list[ArgLike], **kwargs: Any) -> CmdResult:
+        argv = [ str(a) for a in args ]
+        calls.append(argv)
+        if argv[1:] == ['--version']:
+            return _result(argv, out='8.0.100\n')
+        if argv[1] == 'test':
+            option = lambda name: argv[argv.index(name) + 1] if name in argv else None
+            trx = Path(option('--results-directory') or '') / (option('--logger') or '').split('=')[1]
+            _write_trx(trx, [ t for t in _tests if _selected(t[0], option('--filter')) ])
+        return _result(argv)
+    monkeypatch.setattr(dotnet_build, 'cmd', cmd)
+    monkeypatch.setattr(dotnet_build, 'cmd_cached', lambda args, inputs, **kwargs: cmd(args, **kwargs))
+    return calls
+
+
+@pytest.fixture
+def repo(tmp_path) -> Path:
+    repo = tmp_path.joinpath('repo')
+    tests = repo.joinpath('Tests')
+    tests.mkdir(parents=True)
+    tests.joinpath('Tests.csproj').write_text(
+        '<Project Sdk="Microsoft.NET.Sdk"><ItemGroup>'
+        '<PackageReference Include="Microsoft.NET.Test.Sdk" Version="17.0.0" />'
+        '</ItemGroup></Project>'
+    )
+    for cls in ('A', 'B'):
+        tests.joinpath(f'{cls}.cs').write_text(
+            f"namespace N;\n\npublic class {cls}\n{{\n    [Fact]\n    public void Test() {{ }}\n}}\n"
+        )
+    return repo
+
+
+def _test_runs(calls: list[list[str]]) -> list[list[str]]:
+    return [ c for c in calls if c[1] == 'test' ]
+
+
+def test_check_when_trx_reports_failures_but_runs_succeeded_then_raises(capsys) -> None:
+    summary = dotnet_build.TestSummary()
+    summary.results.append(_result(['dotnet', 'test']))
+    summary.counters['failed'] = 1
+    summary.failed_tests.append('N.B.Broken')
+    assert not summary.ok
+    with pytest.raises(CalledProcessError):
+        summary.check()
+    assert "N.B.Broken" in capsys.readouterr().out
+
+
+def test_check_when_all_passed_then_returns() -> None:
+    summary = dotnet_build.TestSummary()
+    summary.results.append(_result(['dotnet', 'test']))
+    summary.counters['failed'] = 0
+    summary.check()
+
+
+def test_dotnet_test_sharded_when_by_class_then_slow_class_gets_own_shard(repo, fake_dotnet) -> None:
+    project = repo.joinpath('Tests', 'Tests.csproj').resolve()
+    repo.joinpath('obj').mkdir()
+    repo.joinpath('obj', 'buildtools-test-timings.json').write_text(json.dumps({
+        f'{project}::N.A': 10.0, f'{project}::N.B': 1.0, f'{project}::*': 0.1,
+    }))
+    dotnet_test_sharded(repo, workers=2, by_class=True)
+    filters = sorted(run[run.index('--filter') + 1] for run in _test_runs(fake_dotnet))
+    assert filters == [
+        'FullyQualifiedName~N.A.',
+        'FullyQualifiedName~N.B.|(FullyQualifiedName!~N.A.&FullyQualifiedName!~N.B.)',
+    ]
+
+
+def test_dotnet_test_sharded_when_run_then_merges_trx_and_records_class_timings(repo, fake_dotnet) -> None:
+    summary = dotnet_test_sharded(repo, workers=2, by_class=True)
+    assert summary.counters == {'total': 3, 'passed': 2, 'failed': 1}
+    assert summary.failed_tests == ['N.B.Broken']
+    assert len(summary.trx_files) == 2
+    with pytest.raises(CalledProcessError):
+        summary.check()
+    project = repo.joinpath('Tests', 'Tests.csproj').resolve()
+    timings = json.loads(repo.joinpath('obj', 'buildtools-test-timings.json').read_text())
+    assert timings == {
+        f'{project}::N.A': 10.0, f'{project}::N.B': 1.0, f'{project}::*': 0.0,
+    }
+
+
+def test_dotnet_test_sharded_when_not_by_class_then_one_run_per_project(repo, fake_dotnet) -> None:
+    summary = dotnet_test_sharded(repo, workers=2)
+    runs = _test_runs(fake_dotnet)
+    assert len(runs) == 1 and '--filter' not in runs[0]
+    assert summary.counters['total'] == 3
+
+
+# --- Up-to-date checks
+
+_stub = '''
+import os, sys
+with open(os.environ['DOTNET_STUB_LOG'], 'a') as log:
+    log.write(' '.join([os.path.basename(os.getcwd()), *sys.argv[1:]]) + '\\n')
+if sys.argv[1:] == ['--version']:
+    print('8.0.100')
+    sys.exit(0)
+if os.path.exists('FAIL'):
+    print('error: build failed')
+    sys.exit(1)
+os.makedirs('obj', exist_ok=True)
+open(os.path.join('obj', 'project.assets.json'), 'w').write('{}')
+os.makedirs('bin', exist_ok=True)
+'''
+
+
+@pytest.fixture
+def stub_dotnet(tmp_path, monkeypatch) -> Path:
+    """
+    Puts a stub `dotnet` on PATH that logs its calls, then "builds" its
+    working directory, unless it holds a FAIL file. Returns the log.
+    """
+    bin_dir = tmp_path.joinpath('dotnet-bin')
+    bin_dir.mkdir()
+    exe = bin_dir.joinpath('dotnet')
+    exe.write_text(f'#!{sys.executable}\n{_stub}')
+    exe.chmod(0o755)
+    log = tmp_path.joinpath('dotnet.log')
+    log.write_text('')
+    monkeypatch.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
+    monkeypatch.setenv('DOTNET_STUB_LOG', str(log))
+    monkeypatch.setenv('BUILDTOOLS_CACHE_DIR', str(tmp_path.joinpath('cache')))
+    return log
+
+
+def _calls(log: Path, verb: str) -> list[str]:
+    return [ line for line in log.read_text().splitlines() if line.split()[1] == verb ]
+
+
+def _project(d: Path, *refs: str) -> Path:
+    d.mkdir(parents=True, exist_ok=True)
+    items = ''.join(f'<ProjectReference Include="{r}" />' for r in refs)
+    project = d.joinpath(f'{d.name}.csproj')
+    project.write_text(f'<Project Sdk="Microsoft.NET.Sdk"><ItemGroup>{items}</ItemGroup></Project>')
+    d.joinpath('Class.cs').write_text(f"class {d.name} {{ }}\n")
+    return project
+
+
+def test_dotnet_build_when_nothing_changed_then_skipped(tmp_path, stub_dotnet) -> None:
+    app = _project(tmp_path.joinpath('App')).parent
+    assert dotnet_build.dotnet_build(app).rc == 0
+    result = dotnet_build.dotnet_build(app)
+    assert result.out.startswith("Up to date")
+    assert len(_calls(stub_dotnet, 'build')) == 1
+
+
+def test_dotnet_build_when_forced_then_rebuilt(tmp_path, stub_dotnet) -> None:
+    app = _project(tmp_path.joinpath('App')).parent
+    dotnet_build.dotnet_build(app).check()
+    dotnet_build.dotnet_build(app, force=True).check()
+    assert len(_calls(stub_dotnet, 'build')) == 2
+
+
+def test_dotnet_build_when_arguments_differ_then_stamped_separately(tmp_path, stub_dotnet) -> None:
+    app = _project(tmp_path.joinpath('App')).parent
+    dotnet_build.dotnet_build(app).check()
+    dotnet_build.dotnet_build(app, '-c', 'Release').check()
+    dotnet_build.dotnet_build(app).check()
+    dotnet_build.dotnet_build(app, '-c', 'Release').check()
+    assert len(_calls(stub_dotnet, 'build')) == 2
+
+
+def test_dotnet_build_when_referenced_project_changed_then_rebuilt(tmp_path, stub_dotnet) -> None:
+    _project(tmp_path.joinpath('Lib'))
+    app = _project(tmp_path.joinpath('App'), '..\\Lib\\Lib.csproj').parent
+    dotnet_build.dotnet_build(app).check()
+    tmp_path.joinpath('Lib', 'Class.cs').write_text("class Lib { int x; }\n")
+    dotnet_build.dotnet_build(app).check()
+    assert len(_calls(stub_dotnet, 'build')) == 2
+
+
+def test_dotnet_build_when_failed_then_not_stamped(tmp_path, stub_dotnet) -> None:
+    app = _project(tmp_path.joinpath('App')).parent
+    app.joinpath('FAIL').write_text('')
+    assert dotnet_build.dotnet_build(app).rc == 1
+    assert dotnet_build.dotnet_build(app).rc == 1
+    assert len(_calls(stub_dotnet, 'build')) == 2
+
+
+# --- Project graph builds
+
+def _built(log: Path) -> list[str]:
+    return [ line.split()[0] for line in _calls(log, 'build') ]
+
+
+def test_dotnet_build_graph_when_projects_reference_each_other_then_built_in_dependency_order(tmp_path, stub_dotnet) -> None:
+    _project(tmp_path.joinpath('Core'))
+    _project(tmp_path.joinpath('Lib'), '../Core/Core.csproj')
+    _project(tmp_path.joinpath('Tool'), '../Core/Core.csproj')
+    app = _project(tmp_path.joinpath('App'), '../Lib/Lib.csproj', '../Tool/Tool.csproj')
+    results = dotnet_build.dotnet_build_graph([app], max_workers=2)
+    assert sorted(p.name for p in results) == ['App.csproj', 'Core.csproj', 'Lib.csproj', 'Tool.csproj']
+    built = _built(stub_dotnet)
+    assert built[0] == 'Core' and built[-1] == 'App'
+    assert sorted(built[1:3]) == ['Lib', 'Tool']
+    assert len(_calls(stub_dotnet, 'restore')) == 4
+
+
+def test_dotnet_build_graph_when_reference_cycle_then_value_error(tmp_path, stub_dotnet) -> None:
+    a = _project(tmp_path.joinpath('A'), '../B/B.csproj')
+    _project(tmp_path.joinpath('B'), '../A/A.csproj')
+    with pytest.raises(ValueError, match="cycle"):
+        dotnet_build.dotnet_build_graph([a])
+    assert _built(stub_dotnet) == []
+
+
+def test_dotnet_build_graph_when_dependency_fails_then_raises_and_dependents_not_built(tmp_path, stub_dotnet) -> None:
+    _project(tmp_path.joinpath('Core'))
+    _project(tmp_path.joinpath('Lib'), '../Core/Core.csproj')
+    app = _project(tmp_path.joinpath('App'), '../Lib/Lib.csproj')
+    tmp_path.joinpath('Lib', 'FAIL').write_text('')
+    with pytest.raises(CalledProcessError):
+        dotnet_build.dotnet_build_graph([app])
+    assert [ line.split()[0] for line in _calls(stub_dotnet, 'restore') ] == ['Core', 'Lib']
+    assert _built(stub_dotnet) == ['Core']
@@ -0,0 +1,214 @@
+import os, shutil, subprocess, time
+from pathlib import Path
+
+import pytest
+
+import git_build
+from git_build import _fast_dirty, _native_hash, _read_index, git_files
+
+
+pytestmark = pytest.mark.skipif(shutil.which('git') is None, reason="git is not installed")
+
+
+def _git(repo: Path, *args: str) -> str:
+    return subprocess.run(
+        ['git', *args], cwd=repo, check=True, capture_output=True, text=True
+    ).stdout
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch) -> Path:
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path.joinpath('.config')))
+    monkeypatch.setenv('GIT_CONFIG_NOSYSTEM', '1')
+    for key in ('AUTHOR', 'COMMITTER'):
+        monkeypatch.setenv(f'GIT_{key}_NAME', 'Test')
+        monkeypatch.setenv(f'GIT_{key}_EMAIL', 'test@example.com')
+    repo = tmp_path.joinpath('repo')
+    repo.mkdir()
+    _git(repo, 'init', '-q', '-b', 'main')
+    repo.joinpath('a.txt').write_text("a\n")
+    repo.joinpath('sub').mkdir()
+    repo.joinpath('sub', 'b.txt').write_text("b\n")
+    repo.joinpath('.gitignore').write_text("*.log\n")
+    _git(repo, 'add', '-A')
+    _git(repo, 'commit', '-q', '-m', 'initial')
+    return repo
+
+
+# --- HEAD resolution
+
+def test_native_hash_when_loose_ref_then_matches_rev_parse(repo) -> None:
+    assert _native_hash(repo, short=False) == _git(repo, 'rev-parse', 'HEAD').strip()
+
+
+def test_native_hash_when_short_then_matches_rev_parse_short(repo) -> None:
+    assert _native_hash(repo, short=True) == _git(repo, 'rev-parse', '--short', 'HEAD').strip()
+
+
+def test_native_hash_when_refs_packed_then_matches_rev_parse(repo) -> None:
+    _git(repo, 'pack-refs', '--all')
+    assert not repo.joinpath('.git', 'refs', 'heads', 'main').exists()
+    assert _native_hash(repo, short=False) == _git(repo, 'rev-parse', 'HEAD').strip()
+
+
+def test_native_hash_when_detached_then_matches_rev_parse(repo) -> None:
+    _git(repo, 'checkout', '-q', '--detach')
+    assert _native_hash(repo, short=False) == _git(repo, 'rev-parse', 'HEAD').strip()
+
+
+def test_native_hash_when_called_from_subdirectory_then_finds_repo(repo) -> None:
+    assert _native_hash(repo.joinpath('sub'), short=False) == _git(repo, 'rev-parse', 'HEAD').strip()
+
+
+# --- Index reader
+
+def _ls_files_stage(repo: Path) -> list[tuple[str, str, int]]:
+    # "<mode> <sha> <stage>\t<path>"
+    entries = []
+    for line in _git(repo, 'ls-files', '--stage').splitlines():
+        info, path = line.split('\t')
+        mode, sha, stage = info.split()
+        entries.append((path, sha, int(mode, 8)))
+    return entries
+
+
+def test_read_index_when_version_2_then_matches_ls_files(repo) -> None:
+    index = _read_index(repo.joinpath('.git'))
+    assert index is not None
+    assert [ (e.path, e.sha, e.mode) for e in index[1] ] == _ls_files_stage(repo)
+
+
+def test_read_index_when_version_4_then_matches_ls_files(repo) -> None:
+    _git(repo, 'update-index', '--index-version', '4')
+    index = _read_index(repo.joinpath('.git'))
+    assert index is not None
+    assert [ (e.path, e.sha, e.mode) for e in index[1] ] == _ls_files_stage(repo)
+
+
+def test_read_index_when_split_index_then_unsupported(repo) -> None:
+    _git(repo, 'update-index', '--split-index')
+    assert _read_index(repo.joinpath('.git')) is None
+
+
+# --- Fast dirty check
+
+def test_fast_dirty_when_clean_then_false(repo) -> None:
+    assert _fast_dirty(repo) is False
+
+
+def test_fast_dirty_when_tracked_file_modified_then_true(repo) -> None:
+    repo.joinpath('sub', 'b.txt').write_text("changed\n")
+    assert _fast_dirty(repo) is True
+
+
+def test_fast_dirty_when_same_size_edit_then_true(repo) -> None:
+    repo.joinpath('a.txt').write_text("z\n")
+    assert _fast_dirty(repo) is True
+
+
+def test_fast_dirty_when_tracked_file_deleted_then_true(repo) -> None:
+    repo.joinpath('a.txt').unlink()
+    assert _fast_dirty(repo) is True
+
+
+def test_fast_dirty_when_change_staged_then_true(repo) -> None:
+    repo.joinpath('a.txt').write_text("staged\n")
+    _git(repo, 'add', 'a.txt')
+    assert _fast_dirty(repo) is True
+
+
+def test_fast_dirty_when_untracked_file_added_after_clean_check_then_true(repo) -> None:
+    assert _fast_dirty(repo) is False
+    repo.joinpath('sub', 'new.txt').write_text("new\n")
+    assert _fast_dirty(repo) is True
+
+
+def test_fast_dirty_when_only_ignored_file_added_then_false(repo) -> None:
+    repo.joinpath('sub', 'build.log').write_text("log\n")
+    assert _fast_dirty(repo) is False
+
+
+def test_fast_dirty_when_clean_check_repeated_then_skips_git(repo, monkeypatch) -> None:
+    assert _fast_dirty(repo) is False
+    def fail(*args):
+        raise AssertionError("ran git")
+    monkeypatch.setattr(git_build, 'git', fail)
+    assert _fast_dirty(repo) is False
+
+
+def _settle(repo: Path, *dirs: str) -> None:
+    # Backdates directory mtimes past the window in which they are rescanned.
+    old = time.time() - 10
+    for d in dirs:
+        os.utime(repo.joinpath(d), (old, old))
+
+
+def test_fast_dirty_when_file_added_deep_in_ignored_only_directory_then_true(repo) -> None:
+    repo.joinpath('deep', 'a', 'b').mkdir(parents=True)
+    repo.joinpath('deep', 'a', 'b', 'x.log').write_text("log\n")
+    _settle(repo, 'deep/a/b', 'deep/a', 'deep', '.')
+    assert _fast_dirty(repo) is False
+    assert _fast_dirty(repo) is False
+    repo.joinpath('deep', 'a', 'b', 'y.txt').write_text("y\n")
+    assert _fast_dirty(repo) is True
+    assert _git(repo, 'status', '--porcelain') == "?? deep/\n"
+
+
+def test_fast_dirty_when_excludes_file_changed_then_rechecks(repo) -> None:
+    excludes = repo.parent.joinpath('excludes')
+    excludes.write_text("*.tmp\n")
+    _git(repo, 'config', 'core.excludesFile', str(excludes))
+    repo.joinpath('sub', 'x.tmp').write_text("x\n")
+    _settle(repo, 'sub')
+    assert _fast_dirty(repo) is False
+    excludes.write_text("")
+    assert _fast_dirty(repo) is True
+
+
+# --- Tracked files
+
+def _no_git(monkeypatch) -> None:
+    def fail(*args):
+        raise AssertionError("ran git")
+    monkeypatch.setattr(git_build, 'git', fail)
+
+
+def _ls_files(path: Path, *args: str) -> list[Path]:
+    return [ path / name for name in _git(path, 'ls-files', '-z', *args).split('\0') if name ]
+
+
+def test_git_files_when_index_readable_then_matches_ls_files_without_git(repo, monkeypatch) -> None:
+    expected = _ls_files(repo)
+    _no_git(monkeypatch)
+    assert list(git_files(repo)) == expected
+
+
+def test_git_files_when_subdirectory_then_only_its_files_relative_to_it(repo, monkeypatch) -> None:
+    sub = repo.joinpath('sub')
+    expected = _ls_files(sub)
+    _no_git(monkeypatch)
+    assert list(git_files(sub)) == expected == [sub / 'b.txt']
+
+
+def test_git_files_when_merge_conflict_then_each_path_once(repo) -> None:
+    _git(repo, 'checkout', '-q', '-b', 'other')
+    repo.joinpath('a.txt').write_text("other\n")
+    _git(repo, 'commit', '-q', '-am', 'other')
+    _git(repo, 'checkout', '-q', 'main')
+    repo.joinpath('a.txt').write_text("main\n")
+    _git(repo, 'commit', '-q', '-am', 'main')
+    subprocess.run(['git', 'merge', '-q', 'other'], cwd=repo, capture_output=True)
+    assert len(_git(repo, 'ls-files', '--stage', 'a.txt').splitlines()) == 3
+    files = list(git_files(repo))
+    assert files.count(repo / 'a.txt') == 1
+    assert files == list(dict.fromkeys(_ls_files(repo)))  # (ls-files repeats it per stage)
+
+
+def test_git_files_when_untracked_then_includes_untracked_but_not_ignored(repo) -> None:
+    repo.joinpath('sub', 'new.txt').write_text("new\n")
+    repo.joinpath('sub', 'build.log').write_text("log\n")
+    files = list(git_files(repo, untracked=True))
+    assert repo / 'sub' / 'new.txt' in files
+    assert repo / 'sub' / 'build.log' not in files
+    assert repo / 'sub' / 'new.txt' not in list(git_files(repo))
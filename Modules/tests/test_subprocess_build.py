@@ -0,0 +1,164 @@
+import asyncio, io, os, subprocess, sys, time
+from pathlib import Path
+
+import pytest
+
+from subprocess_build import ArgLike, CmdPool, CmdResult, CmdStream, cmd, cmd_many, cmd_stream
+
+
+def _py(code: str) -> list[ArgLike]:
+    return [sys.executable, '-c', code]
+
+
+def _sleep_print(seconds: float, text: str) -> list[ArgLike]:
+    return _py(f"import time; time.sleep({seconds}); print({text!r})")
+
+
+def _max_overlap(results: list[CmdResult]) -> int:
+    edges = sorted(
+        [(r.started, 1) for r in results] + [(r.ended, -1) for r in results],
+        key=lambda e: (e[0], e[1])
+    )
+    n = peak = 0
+    for _, step in edges:
+        n += step
+        peak = max(peak, n)
+    return peak
+
+
+def _reaped(pid: int) -> bool:
+    try:
+        os.waitpid(pid, os.WNOHANG)
+    except ChildProcessError:
+        return True
+    return False
+
+
+# --- CmdPool / cmd_many
+
+@pytest.mark.parametrize('backend', ['asyncio', 'thread'])
+def test_cmd_many_when_later_commands_finish_first_then_results_in_submission_order(backend) -> None:
+    results = cmd_many(
+        [_sleep_print(0.4, 'a'), _sleep_print(0.2, 'b'), _sleep_print(0, 'c')],
+        max_workers=3, backend=backend
+    )
+    assert [r.out for r in results] == ["a\n", "b\n", "c\n"]
+
+
+@pytest.mark.parametrize('backend', ['asyncio', 'thread'])
+def test_cmd_many_when_max_workers_two_then_at_most_two_run_at_once(backend) -> None:
+    results = cmd_many(
+        [_sleep_print(0.3, str(i)) for i in range(5)],
+        max_workers=2, backend=backend
+    )
+    assert _max_overlap(results) == 2
+
+
+@pytest.mark.skipif(os.name != 'posix', reason="reaping is checked with waitpid")
+@pytest.mark.parametrize('backend', ['asyncio', 'thread'])
+def test_cmd_many_when_fail_fast_and_one_fails_then_others_killed_and_reaped(backend, tmp_path) -> None:
+    pid_file, marker = tmp_path.joinpath('pid'), tmp_path.joinpath('marker')
+    started = time.monotonic()
+    with pytest.raises(subprocess.CalledProcessError):
+        cmd_many(
+            [
+                _py(f"import os, time; open({str(pid_file)!r}, 'w').write(str(os.getpid())); time.sleep(30)"),
+                _py("import sys, time; time.sleep(0.5); sys.exit(1)"),
+                _py(f"open({str(marker)!r}, 'w')"),
+            ],
+            max_workers=2, fail_fast=True, backend=backend
+        )
+    assert time.monotonic() - started < 10
+    assert _reaped(int(pid_file.read_text()))
+    assert not marker.exists()
+
+
+def test_cmd_pool_when_called_inside_event_loop_then_uses_threads(monkeypatch) -> None:
+    def fail(*args):
+        raise AssertionError("used the asyncio backend")
+    monkeypatch.setattr(CmdPool, '_run_async', fail)
+    async def main() -> list[CmdResult]:
+        return cmd_many([_py("print('a')"), _py("print('b')")])
+    results = asyncio.run(main())
+    assert [r.out for r in results] == ["a\n", "b\n"]
+
+
+def test_cmd_pool_when_unknown_backend_then_value_error() -> None:
+    with pytest.raises(ValueError):
+        CmdPool(backend='process')
+
+
+# --- CmdStream
+
+def _exits(pid: int, timeout: float = 5) -> bool:
+    # A killed grandchild may stay a zombie until init reaps it.
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            stat = Path(f'/proc/{pid}/stat').read_text()
+        except FileNotFoundError:
+            return True
+        if stat.rpartition(')')[2].split()[0] in ('Z', 'X'):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_cmd_stream_when_command_fails_then_result_holds_output_tail() -> None:
+    result = cmd_stream(
+        _py("import sys\nfor i in range(10): print(i)\nprint('bad', file=sys.stderr)\nsys.exit(3)"),
+        tail=3
+    )
+    assert result.rc == 3
+    assert result.result.stdout == "7\n8\n9\n"
+    assert result.result.stderr == "bad\n"
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        result.check()
+    assert e.value.output == "7\n8\n9\n"
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="checks processes in /proc")
+def test_cmd_stream_when_iteration_abandoned_then_grandchild_holding_pipes_killed(tmp_path) -> None:
+    pid_file = tmp_path.joinpath('pid')
+    stream = CmdStream(_py(
+        "import subprocess, sys, time\n"
+        "p = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])\n"
+        f"open({str(pid_file)!r}, 'w').write(str(p.pid))\n"
+        "print('ready', flush=True)\n"
+        "time.sleep(30)\n"
+    ))
+    started = time.monotonic()
+    lines = iter(stream)
+    assert next(lines) == ('stdout', "ready\n")
+    lines.close()  # type: ignore
+    assert time.monotonic() - started < 10
+    assert _exits(int(pid_file.read_text()))
+
+
+def test_cmd_stream_when_callback_sink_then_lines_tagged_by_stream() -> None:
+    seen: list[tuple[str, str]] = []
+    cmd_stream(
+        _py("import sys; print('out', flush=True); print('err', file=sys.stderr)"),
+        lambda name, line: seen.append((name, line))
+    ).check()
+    assert sorted(seen) == [('stderr', "err\n"), ('stdout', "out\n")]
+
+
+def test_cmd_stream_when_file_sink_then_lines_written_from_both_streams() -> None:
+    sink = io.StringIO()
+    cmd_stream(
+        _py("import sys; print('out', flush=True); print('err', file=sys.stderr)"),
+        sink
+    ).check()
+    assert sorted(sink.getvalue().splitlines()) == ["err", "out"]
+
+
+# --- Resource accounting
+
+@pytest.mark.skipif(not hasattr(os, 'wait4'), reason="needs os.wait4")
+def test_cmd_when_child_reaped_then_cpu_time_and_peak_rss_recorded() -> None:
+    result = cmd(_py("sum(range(10**6))"))
+    assert result.rc == 0
+    assert result.cpu_user_s is not None and result.cpu_sys_s is not None
+    assert result.max_rss is not None and result.max_rss > 1 << 20
+    assert result.wall_s is not None and result.wall_s > 0
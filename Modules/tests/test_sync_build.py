@@ -0,0 +1,299 @@
+import os, sys, time
+from pathlib import Path
+from typing import Callable, Iterator
+
+import pytest
+
+import sync_build
+from copy_build import FileCopier
+from sync_build import _Coalescer, _delta_block, _delta_copy, _Inotify, _SyncPair, sync
+from walk_build import PathMatcher
+
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith('linux'), reason="inotify requires Linux")
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv('BUILDTOOLS_CACHE_DIR', str(tmp_path.joinpath('cache')))
+
+
+@pytest.fixture
+def source(tmp_path) -> Path:
+    source = tmp_path.joinpath('source')
+    source.joinpath('sub').mkdir(parents=True)
+    source.joinpath('a.txt').write_text("a\n")
+    source.joinpath('sub', 'b.txt').write_text("b\n")
+    return source
+
+
+def _synced_count(capsys) -> int:
+    out = capsys.readouterr().out
+    return int(out.rsplit("Synced ", 1)[1].split()[0])
+
+
+def _backdate(root: Path) -> None:
+    # Makes a tree look settled to the manifest (see `sync_build._settled`).
+    past = time.time() - 3600
+    for dirpath, _, _ in os.walk(root):
+        os.utime(dirpath, (past, past))
+
+
+# --- Manifest
+
+def test_sync_when_cold_then_copies_every_file(source, tmp_path, capsys) -> None:
+    target = tmp_path.joinpath('target')
+    sync([(source, target)])
+    assert _synced_count(capsys) == 2
+    assert target.joinpath('a.txt').read_text() == "a\n"
+    assert target.joinpath('sub', 'b.txt').read_text() == "b\n"
+
+
+def test_sync_when_nothing_changed_then_copies_nothing(source, tmp_path, capsys) -> None:
+    target = tmp_path.joinpath('target')
+    sync([(source, target)])
+    capsys.readouterr()
+    sync([(source, target)])
+    assert _synced_count(capsys) == 0
+
+
+def test_sync_when_file_rewritten_in_same_second_with_same_size_then_copies_it(source, tmp_path, capsys) -> None:
+    target = tmp_path.joinpath('target')
+    second = 1_700_000_000 * 10**9
+    os.utime(source.joinpath('a.txt'), ns=(second + 100, second + 100))
+    sync([(source, target)])
+    capsys.readouterr()
+    source.joinpath('a.txt').write_text("z\n")
+    os.utime(source.joinpath('a.txt'), ns=(second + 200, second + 200))
+    sync([(source, target)])
+    assert _synced_count(capsys) == 1
+    assert target.joinpath('a.txt').read_text() == "z\n"
+
+
+def test_sync_when_target_file_deleted_then_copies_it_again(source, tmp_path, capsys) -> None:
+    target = tmp_path.joinpath('target')
+    sync([(source, target)])
+    capsys.readouterr()
+    target.joinpath('sub', 'b.txt').unlink()
+    sync([(source, target)])
+    assert _synced_count(capsys) == 1
+    assert target.joinpath('sub', 'b.txt').read_text() == "b\n"
+
+
+def test_sync_when_file_added_to_settled_directory_then_copies_it(source, tmp_path, capsys) -> None:
+    target = tmp_path.joinpath('target')
+    _backdate(source)
+    sync([(source, target)])
+    capsys.readouterr()
+    source.joinpath('sub', 'c.txt').write_text("c\n")
+    sync([(source, target)])
+    assert _synced_count(capsys) == 1
+    assert target.joinpath('sub', 'c.txt').read_text() == "c\n"
+
+
+def test_sync_when_target_directories_unchanged_then_trusts_manifest(source, tmp_path, capsys) -> None:
+    target = tmp_path.joinpath('target')
+    sync([(source, target)])
+    _backdate(target)
+    sync([(source, target)])  # Records the now settled target directories.
+    capsys.readouterr()
+    # Replace the target's content behind the manifest's back, keeping the
+    # directory mtime: the file is not looked at again.
+    target.joinpath('a.txt').write_text("stale\n")
+    sync([(source, target)])
+    assert _synced_count(capsys) == 0
+    assert target.joinpath('a.txt').read_text() == "stale\n"
+
+
+def test_sync_when_ignored_then_not_copied(source, tmp_path) -> None:
+    target = tmp_path.joinpath('target')
+    source.joinpath('sub', 'build.log').write_text("log\n")
+    sync([(source, target)], ignore=['*.log'])
+    assert not target.joinpath('sub', 'build.log').exists()
+
+
+# --- Block delta
+
+def _blocks(*fills: bytes) -> bytes:
+    return b''.join(fill * _delta_block for fill in fills)
+
+
+def test_delta_copy_when_one_block_changed_then_only_that_block_written(tmp_path) -> None:
+    s, t = tmp_path.joinpath('s'), tmp_path.joinpath('t')
+    s.write_bytes(_blocks(b'a', b'b', b'c'))
+    with s.open('rb') as f:
+        previous = _delta_copy(f.fileno(), None, 3 * _delta_block, [])
+    s.write_bytes(_blocks(b'a', b'X', b'c'))
+    # Unchanged blocks of the target are left as they are, even if wrong.
+    t.write_bytes(_blocks(b'1', b'2', b'3'))
+    with s.open('rb') as sf, t.open('r+b') as tf:
+        _delta_copy(sf.fileno(), tf.fileno(), 3 * _delta_block, previous)
+    assert t.read_bytes() == _blocks(b'1', b'X', b'3')
+
+
+def test_delta_copy_when_source_shrinks_then_target_truncated(tmp_path) -> None:
+    s, t = tmp_path.joinpath('s'), tmp_path.joinpath('t')
+    s.write_bytes(_blocks(b'a', b'b', b'c'))
+    t.write_bytes(_blocks(b'a', b'b', b'c'))
+    with s.open('rb') as f:
+        previous = _delta_copy(f.fileno(), None, 3 * _delta_block, [])
+    s.write_bytes(_blocks(b'a') + b'tail')
+    with s.open('rb') as sf, t.open('r+b') as tf:
+        _delta_copy(sf.fileno(), tf.fileno(), _delta_block + 4, previous)
+    assert t.read_bytes() == _blocks(b'a') + b'tail'
+
+
+def test_delta_copy_when_no_target_then_returns_one_hash_per_block(tmp_path) -> None:
+    s = tmp_path.joinpath('s')
+    s.write_bytes(_blocks(b'a', b'a') + b'x')
+    with s.open('rb') as f:
+        hashes = _delta_copy(f.fileno(), None, 2 * _delta_block + 1, [])
+    assert len(hashes) == 3
+    assert hashes[0] == hashes[1] != hashes[2]
+
+
+def test_sync_when_large_file_changed_then_target_matches(tmp_path) -> None:
+    source, target = tmp_path.joinpath('source'), tmp_path.joinpath('target')
+    source.mkdir()
+    source.joinpath('big').write_bytes(_blocks(b'a', b'b', b'c'))
+    sync([(source, target)], delta_min_size=1)
+    with source.joinpath('big').open('r+b') as f:
+        f.seek(_delta_block + 10)
+        f.write(b'changed')
+    sync([(source, target)], delta_min_size=1)
+    assert target.joinpath('big').read_bytes() == source.joinpath('big').read_bytes()
+
+
+def test_sync_when_empty_file_and_no_delta_minimum_then_copied(tmp_path) -> None:
+    source, target = tmp_path.joinpath('source'), tmp_path.joinpath('target')
+    source.mkdir()
+    source.joinpath('empty').write_bytes(b'')
+    sync([(source, target)], delta_min_size=0)
+    assert target.joinpath('empty').read_bytes() == b''
+
+
+def test_sync_when_target_timestamps_coarse_then_delta_copy_used(tmp_path, monkeypatch) -> None:
+    real_copystat = sync_build.shutil.copystat
+    def coarse_copystat(s, t):
+        # Like a mount that keeps whole seconds only.
+        real_copystat(s, t)
+        mtime = os.stat(t).st_mtime_ns // 10**9 * 10**9
+        os.utime(t, ns=(mtime, mtime))
+    monkeypatch.setattr(sync_build.shutil, 'copystat', coarse_copystat)
+    source, target = tmp_path.joinpath('source'), tmp_path.joinpath('target')
+    source.mkdir()
+    source.joinpath('big').write_bytes(_blocks(b'a', b'b', b'c'))
+    os.utime(source.joinpath('big'), ns=(10**9 + 1, 10**9 + 1))
+    sync([(source, target)], delta_min_size=1)
+    with source.joinpath('big').open('r+b') as f:
+        f.seek(_delta_block + 10)
+        f.write(b'changed')
+    def fail(*args):
+        raise AssertionError("copied the whole file")
+    monkeypatch.setattr(FileCopier, 'copy_data', fail)
+    sync([(source, target)], delta_min_size=1)
+    assert target.joinpath('big').read_bytes() == source.joinpath('big').read_bytes()
+
+
+# --- Change batching
+
+@pytest.fixture
+def clock(monkeypatch) -> list[float]:
+    now = [1000.0]
+    monkeypatch.setattr(sync_build.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def pair(source, tmp_path) -> _SyncPair:
+    return _SyncPair(source, tmp_path.joinpath('target'), PathMatcher())
+
+
+def test_coalescer_when_changes_keep_arriving_then_waits_for_quiet_period(pair, clock) -> None:
+    batch = _Coalescer(quiet_s=1, max_wait_s=10)
+    assert batch.timeout() is None
+    batch.add(pair, 'a.txt', pair.pending_path('a.txt') or [])
+    clock[0] += 0.8
+    batch.add(pair, 'sub/b.txt', pair.pending_path('sub/b.txt') or [])
+    clock[0] += 0.8
+    assert not batch.ready()
+    clock[0] += 0.2
+    assert batch.ready()
+    assert sorted(rel for _, rel, _ in batch.take()) == ['a.txt', 'sub/b.txt']
+    assert batch.timeout() is None
+
+
+def test_coalescer_when_never_quiet_then_due_after_max_wait(pair, clock) -> None:
+    batch = _Coalescer(quiet_s=1, max_wait_s=3)
+    for i in range(6):
+        batch.add(pair, 'a.txt', [i])
+        clock[0] += 0.5
+    assert batch.ready()
+
+
+def test_coalescer_when_file_still_growing_then_held_until_max_wait(pair, source, clock) -> None:
+    batch = _Coalescer(quiet_s=1, max_wait_s=5)
+    batch.add(pair, 'a.txt', pair.pending_path('a.txt') or [])
+    source.joinpath('a.txt').write_text("a, longer\n")
+    clock[0] += 1
+    assert batch.ready()
+    assert batch.take() == []
+    assert not batch.ready()
+    source.joinpath('a.txt').write_text("a, longer still\n")
+    clock[0] += 4
+    assert [rel for _, rel, _ in batch.take()] == ['a.txt']
+
+
+# --- inotify backend
+
+def _watch(
+    monkeypatch,
+    pairs: list[tuple[Path, Path]],
+    actions: list[Callable[[_Inotify], Iterator[tuple[Path|None, int]]]],
+    done: Callable[[], bool]
+) -> None:
+    # Runs the watch loop, performing one action per read of events, until
+    # `done` (or a timeout) stops it as Ctrl+C would.
+    real_read = _Inotify.read
+    deadline = time.monotonic() + 10
+    def read(self, timeout=None):
+        if done() or time.monotonic() > deadline:
+            raise KeyboardInterrupt
+        if actions:
+            yield from actions.pop(0)(self)
+        yield from real_read(self, 0.05 if timeout is None else min(timeout, 0.05))
+    monkeypatch.setattr(_Inotify, 'read', read)
+    sync(pairs, watch=True, backend='inotify', quiet_s=0.05)
+
+
+@linux_only
+def test_watch_when_subdirectory_created_then_its_files_synced(source, tmp_path, monkeypatch) -> None:
+    target = tmp_path.joinpath('target')
+    new = source.joinpath('new', 'deep')
+    def create_tree(notify):
+        new.mkdir(parents=True)
+        new.joinpath('first.txt').write_text("1\n")
+        return iter(())
+    def add_to_tree(notify):
+        if len(notify.dirs) < 4:  # not watched yet: try again on the next read
+            actions.insert(0, add_to_tree)
+        else:
+            new.joinpath('second.txt').write_text("2\n")
+        return iter(())
+    actions = [create_tree, add_to_tree]
+    _watch(monkeypatch, [(source, target)], actions, lambda: target.joinpath('new', 'deep', 'second.txt').exists())
+    assert target.joinpath('new', 'deep', 'first.txt').read_text() == "1\n"
+    assert target.joinpath('new', 'deep', 'second.txt').read_text() == "2\n"
+
+
+@linux_only
+def test_watch_when_queue_overflows_then_rescans(source, tmp_path, monkeypatch) -> None:
+    target = tmp_path.joinpath('target')
+    real_read = _Inotify.read
+    def lose_events(notify):
+        source.joinpath('lost.txt').write_text("lost\n")
+        for _ in real_read(notify, 0.2):
+            pass
+        yield None, sync_build._IN_Q_OVERFLOW
+    _watch(monkeypatch, [(source, target)], [lose_events], lambda: target.joinpath('lost.txt').exists())
+    assert target.joinpath('lost.txt').read_text() == "lost\n"
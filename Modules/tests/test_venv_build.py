@@ -0,0 +1,149 @@
+import json, subprocess, venv
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+import venv_build
+from venv_build import freeze, sync_venv
+
+
+def _site_packages(prefix: Path) -> Path:
+    return next(prefix.joinpath('lib').glob('python*/site-packages'))
+
+
+def _add_dist(prefix: Path, name: str, version: str, direct_url: dict[str, Any]|None = None) -> None:
+    info = _site_packages(prefix).joinpath(f'{name}-{version}.dist-info')
+    info.mkdir()
+    info.joinpath('METADATA').write_text(f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n\n")
+    info.joinpath('RECORD').write_text("")
+    info.joinpath('INSTALLER').write_text("pip\n")
+    if direct_url is not None:
+        info.joinpath('direct_url.json').write_text(json.dumps(direct_url))
+
+
+@pytest.fixture
+def prefix(tmp_path) -> Path:
+    prefix = tmp_path.joinpath('venv')
+    venv.create(prefix, with_pip=False)
+    return prefix
+
+
+def test_freeze_when_pinned_distribution_then_name_equals_version(prefix) -> None:
+    _add_dist(prefix, 'Alpha_Pkg', '1.2')
+    assert freeze(prefix) == "Alpha_Pkg==1.2\n"
+
+
+def test_freeze_when_archive_url_then_direct_reference_with_hash(prefix) -> None:
+    _add_dist(prefix, 'beta', '2.0', {
+        'url': 'https://example.com/beta-2.0.tar.gz',
+        'archive_info': {'hash': 'sha256=abc'},
+    })
+    assert freeze(prefix) == "beta @ https://example.com/beta-2.0.tar.gz#sha256=abc\n"
+
+
+def test_freeze_when_vcs_url_then_direct_reference_with_commit(prefix) -> None:
+    _add_dist(prefix, 'gamma', '0.1', {
+        'url': 'https://example.com/gamma.git',
+        'vcs_info': {'vcs': 'git', 'commit_id': 'deadbeef'},
+    })
+    assert freeze(prefix) == "gamma @ git+https://example.com/gamma.git@deadbeef\n"
+
+
+def test_freeze_when_editable_outside_vcs_then_editable_line(prefix, tmp_path) -> None:
+    project = tmp_path.joinpath('project')
+    project.mkdir()
+    _add_dist(prefix, 'delta', '3.0', {'url': f'file://{project}', 'dir_info': {'editable': True}})
+    assert freeze(prefix) == (
+        "# Editable install with no version control (delta==3.0)\n"
+        f"-e {project}\n"
+    )
+
+
+def test_freeze_when_pip_installed_then_hidden(prefix) -> None:
+    _add_dist(prefix, 'pip', '24.0')
+    assert freeze(prefix) == ""
+
+
+def test_freeze_when_site_packages_changes_then_recomputed(prefix) -> None:
+    _add_dist(prefix, 'alpha', '1.0')
+    assert freeze(prefix) == "alpha==1.0\n"
+    _add_dist(prefix, 'beta', '2.0')
+    assert freeze(prefix) == "alpha==1.0\nbeta==2.0\n"
+
+
+def test_freeze_when_compared_with_pip_then_identical(tmp_path) -> None:
+    prefix = tmp_path.joinpath('venv')
+    try:
+        venv.create(prefix, with_pip=True)
+    except subprocess.CalledProcessError:
+        pytest.skip("ensurepip is not available")
+    project = tmp_path.joinpath('project')
+    project.mkdir()
+    _add_dist(prefix, 'Alpha_Pkg', '1.2')
+    _add_dist(prefix, 'beta', '2.0', {
+        'url': 'https://example.com/beta-2.0.tar.gz',
+        'archive_info': {'hash': 'sha256=abc'},
+    })
+    _add_dist(prefix, 'gamma', '0.1', {
+        'url': 'https://example.com/gamma.git',
+        'vcs_info': {'vcs': 'git', 'commit_id': 'deadbeef'},
+    })
+    _add_dist(prefix, 'delta', '3.0', {'url': f'file://{project}', 'dir_info': {'editable': True}})
+    pip_freeze = subprocess.run(
+        [prefix / 'bin' / 'python', '-m', 'pip', 'freeze'],
+        capture_output=True, text=True, check=True
+    ).stdout
+    assert freeze(prefix) == pip_freeze
+
+
+def test_sync_venv_when_lock_includes_requirements_file_then_its_pins_are_kept(prefix, tmp_path, monkeypatch) -> None:
+    _add_dist(prefix, 'alpha', '1.0')
+    _add_dist(prefix, 'beta', '2.0')
+    tmp_path.joinpath('locks').mkdir()
+    tmp_path.joinpath('locks', 'base.txt').write_text("beta==2.0\n")
+    lockfile = tmp_path.joinpath('requirements.txt')
+    lockfile.write_text("alpha==1.0\n-r locks/base.txt\n")
+    def fail(*args, **kwargs):
+        raise AssertionError("ran pip")
+    monkeypatch.setattr(venv_build, '_pip', fail)
+    monkeypatch.setattr(venv_build, 'cmd_stream', fail)
+    sync_venv(prefix, lockfile)
+
+
+def test_sync_venv_when_lock_has_constraints_then_value_error(prefix, tmp_path) -> None:
+    tmp_path.joinpath('constraints.txt').write_text("alpha==1.0\n")
+    lockfile = tmp_path.joinpath('requirements.txt')
+    lockfile.write_text("-c constraints.txt\n")
+    with pytest.raises(ValueError):
+        sync_venv(prefix, lockfile)
+
+
+def test_clone_venv_when_clone_written_in_place_then_template_unchanged(prefix, tmp_path) -> None:
+    module = _site_packages(prefix).joinpath('mod.py')
+    module.write_text("a = 1\n")
+    clone = tmp_path.joinpath('clone')
+    venv_build._clone_venv(prefix, clone)
+    with _site_packages(clone).joinpath('mod.py').open('r+') as f:
+        f.write("b")
+    assert module.read_text() == "a = 1\n"
+    assert module.stat().st_nlink == 1
+
+
+def test_build_wheelhouse_when_project_has_build_system_then_backend_built(prefix, tmp_path, monkeypatch) -> None:
+    monkeypatch.setenv('BUILDTOOLS_CACHE_DIR', str(tmp_path / 'cache'))
+    project = tmp_path.joinpath('project')
+    project.mkdir()
+    project.joinpath('pyproject.toml').write_text(
+        '[build-system]\nrequires = ["hatchling>=1.18"]\nbuild-backend = "hatchling.build"\n'
+    )
+    argvs: list[list[Any]] = []
+    class Done:
+        def check(self) -> None: pass
+    def cmd_stream(argv, *args, **kwargs):
+        argvs.append(argv)
+        return Done()
+    monkeypatch.setattr(venv_build, 'cmd_stream', cmd_stream)
+    venv_build.build_wheelhouse(prefix, project)
+    assert 'hatchling>=1.18' in argvs[0]
+    assert argvs[0][-2:] == ['-e', str(project)]
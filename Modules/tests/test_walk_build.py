@@ -0,0 +1,186 @@
+from pathlib import Path
+
+import walk_build
+from walk_build import PathMatcher, read_ignore_file, walk
+
+
+# --- Suffixes
+
+def test_matcher_when_name_ends_with_suffix_then_matches_at_any_depth() -> None:
+    matcher = PathMatcher(suffixes=['__pycache__', '.egg-info'])
+    assert matcher('__pycache__', is_dir=True)
+    assert matcher('pkg/sub/__pycache__', is_dir=True)
+    assert matcher('pkg/demo.egg-info', is_dir=True)
+    assert not matcher('pkg/__pycache__x', is_dir=True)
+
+
+# --- Anchoring
+
+def test_pattern_when_no_slash_then_matches_name_at_any_depth() -> None:
+    matcher = PathMatcher(patterns=['build'])
+    assert matcher('build')
+    assert matcher('src/build')
+    assert not matcher('src/build.py')
+
+
+def test_pattern_when_leading_slash_then_matches_only_at_root() -> None:
+    matcher = PathMatcher(patterns=['/build'])
+    assert matcher('build')
+    assert not matcher('src/build')
+
+
+def test_pattern_when_inner_slash_then_anchored_to_root() -> None:
+    matcher = PathMatcher(patterns=['docs/*.md'])
+    assert matcher('docs/a.md')
+    assert not matcher('src/docs/a.md')
+
+
+# --- Wildcards
+
+def test_star_when_matching_then_does_not_cross_slashes() -> None:
+    matcher = PathMatcher(patterns=['src/*.py'])
+    assert matcher('src/a.py')
+    assert not matcher('src/sub/a.py')
+
+
+def test_question_mark_when_matching_then_matches_one_character() -> None:
+    matcher = PathMatcher(patterns=['v?.txt'])
+    assert matcher('v1.txt')
+    assert not matcher('v10.txt')
+
+
+def test_leading_double_star_when_matching_then_matches_in_any_directory() -> None:
+    matcher = PathMatcher(patterns=['**/logs/*.log'])
+    assert matcher('logs/a.log')
+    assert matcher('x/y/logs/a.log')
+    assert not matcher('x/logs/sub/a.log')
+
+
+def test_trailing_double_star_when_matching_then_matches_everything_inside() -> None:
+    matcher = PathMatcher(patterns=['out/**'])
+    assert matcher('out/a')
+    assert matcher('out/a/b.txt')
+    assert not matcher('src/out/a')
+
+
+def test_inner_double_star_when_matching_then_matches_zero_or_more_directories() -> None:
+    matcher = PathMatcher(patterns=['a/**/b'])
+    assert matcher('a/b')
+    assert matcher('a/x/y/b')
+    assert not matcher('a/xb')
+
+
+# --- Bracket classes
+
+def test_bracket_class_when_matching_then_matches_listed_characters() -> None:
+    matcher = PathMatcher(patterns=['file[0-2].txt'])
+    assert matcher('file1.txt')
+    assert not matcher('file3.txt')
+
+
+def test_bracket_class_when_negated_then_matches_other_characters() -> None:
+    matcher = PathMatcher(patterns=['file[!0-2].txt', 'data[^a].csv'])
+    assert matcher('file3.txt')
+    assert not matcher('file1.txt')
+    assert matcher('datab.csv')
+    assert not matcher('dataa.csv')
+
+
+def test_bracket_when_unclosed_then_matched_literally() -> None:
+    matcher = PathMatcher(patterns=['a[b'])
+    assert matcher('a[b')
+    assert not matcher('ab')
+
+
+# --- Directory-only patterns
+
+def test_trailing_slash_when_entry_is_file_then_not_matched() -> None:
+    matcher = PathMatcher(patterns=['cache/'])
+    assert matcher('cache', is_dir=True)
+    assert matcher('src/cache', is_dir=True)
+    assert not matcher('cache')
+
+
+def test_match_path_when_parent_directory_matches_then_path_matches() -> None:
+    matcher = PathMatcher(patterns=['cache/'])
+    assert matcher.match_path('src/cache/data.bin')
+    assert not matcher.match_path('src/cache')
+
+
+# --- Negation
+
+def test_negation_when_later_pattern_reincludes_then_not_matched() -> None:
+    matcher = PathMatcher(patterns=['*.log', '!keep.log'])
+    assert matcher('debug.log')
+    assert not matcher('keep.log')
+    assert not matcher('sub/keep.log')
+
+
+def test_negation_when_followed_by_matching_pattern_then_matched_again() -> None:
+    matcher = PathMatcher(patterns=['*.log', '!keep.log', 'sub/*.log'])
+    assert not matcher('keep.log')
+    assert matcher('sub/keep.log')
+
+
+def test_negation_when_suffix_rule_then_suffixes_can_be_reincluded() -> None:
+    matcher = PathMatcher(suffixes=['.tmp'], patterns=['!important.tmp'])
+    assert matcher('a.tmp')
+    assert not matcher('important.tmp')
+
+
+def test_escaped_bang_when_matching_then_matches_literal_name() -> None:
+    matcher = PathMatcher(patterns=['\\!important'])
+    assert matcher('!important')
+    assert not matcher('important')
+
+
+# --- Ignore files
+
+def test_read_ignore_file_when_comments_and_blanks_then_skipped_by_matcher(tmp_path) -> None:
+    ignore_file = tmp_path.joinpath('.gitignore')
+    ignore_file.write_text("# comment\n\n*.o\n")
+    matcher = PathMatcher(patterns=read_ignore_file(ignore_file))
+    assert matcher.patterns == ('*.o',)
+    assert matcher('a.o')
+
+
+def test_read_ignore_file_when_missing_then_no_patterns(tmp_path) -> None:
+    assert read_ignore_file(tmp_path.joinpath('.gitignore')) == []
+
+
+def test_matcher_when_empty_then_false_and_matches_nothing() -> None:
+    matcher = PathMatcher()
+    assert not matcher
+    assert not matcher('anything')
+
+
+# --- Walking
+
+def _tree(root: Path, *paths: str) -> None:
+    for path in paths:
+        root.joinpath(path).parent.mkdir(parents=True, exist_ok=True)
+        root.joinpath(path).write_text(path)
+
+
+def test_walk_when_no_matcher_then_yields_every_file(tmp_path) -> None:
+    _tree(tmp_path, 'a.txt', 'src/b.py', 'src/sub/c.py')
+    assert sorted(rel for rel, _ in walk(tmp_path)) == ['a.txt', 'src/b.py', 'src/sub/c.py']
+
+
+def test_walk_when_directory_ignored_then_not_entered(tmp_path, monkeypatch) -> None:
+    _tree(tmp_path, 'a.txt', 'node_modules/x/y.js', 'src/b.py')
+    scanned: list[str] = []
+    real_scan_dir = walk_build.scan_dir
+    def scan_dir(root, rel='', ignore=None, follow_symlinks=False):
+        scanned.append(rel)
+        return real_scan_dir(root, rel, ignore, follow_symlinks)
+    monkeypatch.setattr(walk_build, 'scan_dir', scan_dir)
+    files = sorted(rel for rel, _ in walk(tmp_path, PathMatcher(patterns=['node_modules/'])))
+    assert files == ['a.txt', 'src/b.py']
+    assert sorted(scanned) == ['', 'src']
+
+
+def test_walk_when_file_reincluded_then_yielded(tmp_path) -> None:
+    _tree(tmp_path, 'a.log', 'keep.log', 'b.txt')
+    files = sorted(rel for rel, _ in walk(tmp_path, PathMatcher(patterns=['*.log', '!keep.log'])))
+    assert files == ['b.txt', 'keep.log']
@@ -1,8 +1,22 @@
-import venv
+import hashlib, json, os, re, shutil, sys, tempfile, time, venv
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterator
 
-from subprocess_build import ArgLike, cmd, CmdResult
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+
+from copy_build import FileCopier
+from subprocess_build import (
+    ArgLike, cache_dir, cmd, cmd_stream, CmdResult, trace_span
+)
 
 
 def _py(prefix: Path, *args: ArgLike, **sp_kwargs: Any) -> CmdResult:
@@ -22,11 +36,120 @@ def pip_install(
     prefix: Path,
     *args: str|Path,
     upgrade: bool = False,
+    wheelhouse: bool = False,
     **sp_kwargs: Any
 ):
+    """
+    Installs packages (str), requirements files (Path to a file) or editable
+    projects (Path to a directory) into the venv at `prefix`.
+    If `wheelhouse` is True, installs offline from a wheelhouse built once
+    for these requirements (see `build_wheelhouse`).
+    Inside a `pip_batch` block for `prefix`, the install is deferred.
+    """
+    pending = _batches.get(os.path.abspath(prefix))
+    if pending is not None:
+        pending.append((args, upgrade, wheelhouse))
+        return
     arg_list = sum((_package_type(arg) for arg in args), ())
     if upgrade: arg_list = ('--upgrade',) + arg_list
-    _pip(prefix, 'install', *arg_list, **sp_kwargs).check()
+    if wheelhouse:
+        house = build_wheelhouse(prefix, *args)
+        arg_list = ('--no-index', '--find-links', str(house)) + arg_list
+    cmd_stream(
+        [ prefix / 'bin' / 'python', '-m', 'pip', 'install', *arg_list ],
+        **sp_kwargs
+    ).check()
+
+_batches: dict[str, list[tuple[tuple[str|Path, ...], bool, bool]]] = {}
+
+@contextmanager
+def pip_batch(prefix: Path, **sp_kwargs: Any) -> Iterator[None]:
+    """
+    Defers the `pip_install` calls for `prefix` made inside the block, then
+    installs them together when it exits without error: one pip invocation
+    for the packages to upgrade and one for the rest.
+    """
+    key = os.path.abspath(prefix)
+    if key in _batches:  # Nested: the outer block installs.
+        yield
+        return
+    _batches[key] = pending = []
+    try:
+        yield
+    finally:
+        del _batches[key]
+    for upgrade in (True, False):
+        calls = [ call for call in pending if call[1] == upgrade ]
+        args = list(dict.fromkeys(a for call_args, _, _ in calls for a in call_args))
+        if args:
+            pip_install(
+                prefix,
+                *args,
+                upgrade = upgrade,
+                wheelhouse = any(wheelhouse for _, _, wheelhouse in calls),
+                **sp_kwargs
+            )
+
+
+def _venv_version(prefix: Path) -> str:
+    try:
+        for line in (prefix / 'pyvenv.cfg').read_text().splitlines():
+            key, _, value = line.partition('=')
+            if key.strip() in ('version', 'version_info'):
+                return value.strip()
+    except OSError:
+        pass
+    return sys.version
+
+
+def build_wheelhouse(prefix: Path, *args: str|Path) -> Path:
+    """
+    Builds wheels for `args` (as taken by `pip_install`), their dependencies
+    and the build backends needed to install offline, using the venv at
+    `prefix`: those in `[build-system] requires` of each project directory's
+    `pyproject.toml` (read with Python 3.11's `tomllib`), plus setuptools
+    and wheel. This happens once per set of requirements: the wheelhouse is
+    stored under `cache_dir('wheelhouse')`, keyed by a hash of the Python
+    version, the arguments and the contents of the requirements files and
+    project metadata they refer to.
+    """
+    h = hashlib.sha256(_venv_version(prefix).encode())
+    for arg in args:
+        h.update(f'\0{arg}\0'.encode())
+        if isinstance(arg, Path) and arg.is_file():
+            h.update(arg.read_bytes())
+        elif isinstance(arg, Path) and arg.is_dir():
+            for name in ('pyproject.toml', 'setup.cfg', 'setup.py', 'requirements.txt'):
+                if (arg / name).is_file():
+                    h.update((arg / name).read_bytes())
+    key = h.hexdigest()[:16]
+    root = cache_dir('wheelhouse')
+    house = root / key
+    complete = root / f'{key}.complete'
+    if complete.exists():
+        return house
+    with _file_lock(root / f'{key}.lock'):
+        if not complete.exists():
+            print(f"Building wheelhouse {house}.")
+            arg_list = sum((_package_type(arg) for arg in args), ())
+            backends = sorted({
+                req for arg in args if isinstance(arg, Path) and arg.is_dir()
+                for req in _build_requires(arg)
+            })
+            cmd_stream([
+                prefix / 'bin' / 'python', '-m', 'pip', 'wheel',
+                '--wheel-dir', house, *_template_packages, *backends, *arg_list
+            ]).check()
+            complete.touch()
+    return house
+
+def _build_requires(project: Path) -> list[str]:
+    """ The static build requirements of the project at `project`. """
+    pyproject = project / 'pyproject.toml'
+    if tomllib is None or not pyproject.is_file():
+        return []
+    with pyproject.open('rb') as f:
+        return list(tomllib.load(f).get('build-system', {}).get('requires', []))
 
 # def _pip_install(prefix: Path, *args: ArgLike, upgrade: bool = False, **sp_kwargs: Any) -> CmdResult:
 #     arg_list = list(args)
@@ -43,13 +166,428 @@ def pip_install(
 #     _pip_install(prefix, *packages, upgrade=upgrade).check()
 
 def freeze(prefix: Path) -> str:
-    return _pip(prefix, 'freeze').out
+    """
+    Equivalent to `pip freeze` for the venv at `prefix`, read from the
+    installed distributions' metadata instead of running pip. The result is
+    cached until the site-packages directory changes. Editable installs
+    under version control fall back to running `pip freeze`.
+    """
+    sites = _site_packages(prefix)
+    key = [ (str(d), d.stat().st_mtime_ns) for d in sites ]
+    cached = _freeze_cache.get(os.path.abspath(prefix))
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    lines: list[str] = []
+    skip = { 'pip' }
+    version = tuple(int(v) for v in re.findall(r'\d+', _venv_version(prefix))[:2])
+    if version < (3, 12):  # As pip, hide build backends.
+        skip |= { 'setuptools', 'distribute', 'wheel' }
+    for dist in sorted(_distributions(sites).values(), key=lambda d: d.name.lower()):
+        if _canonical_name(dist.name) in skip:
+            continue
+        if dist.editable is not None:
+            if _under_vcs(dist.editable):
+                result = _pip(prefix, 'freeze').out
+                break
+            lines += [
+                f"# Editable install with no version control ({dist.name}=={dist.version})",
+                f"-e {dist.editable}",
+            ]
+        elif dist.direct_url is not None:
+            lines.append(_direct_reference(dist.name, dist.direct_url))
+        else:
+            lines.append(f"{dist.name}=={dist.version}")
+    else:
+        result = ''.join(f'{line}\n' for line in lines)
+    _freeze_cache[os.path.abspath(prefix)] = (key, result)
+    return result
+
+
+# --- Installed distributions
+
+_freeze_cache: dict[str, tuple[list[tuple[str, int]], str]] = {}
+
+
+class _Dist:
+    def __init__(
+        self,
+        name: str,
+        version: str,
+        direct_url: dict[str, Any]|None = None,
+        editable: str|None = None
+    ):
+        self.name = name
+        self.version = version
+        self.direct_url = direct_url  # PEP 610 `direct_url.json`, if any.
+        self.editable = editable      # The project location of editable installs.
 
-def create_venv(prefix: Path, clear: bool = False):
-    venv.create(
-        str(prefix),
-        with_pip = True,
-        clear = clear
+
+def _canonical_name(name: str) -> str:
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def _site_packages(prefix: Path) -> list[Path]:
+    return sorted((prefix / 'lib').glob('python*/site-packages'))
+
+
+def _read_metadata(path: Path) -> tuple[str, str]|None:
+    """ Reads `Name` and `Version` from a METADATA/PKG-INFO file. """
+    fields: dict[str, str] = {}
+    try:
+        with path.open('r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                if not line.strip():
+                    break  # End of headers.
+                key, _, value = line.partition(':')
+                if key in ('Name', 'Version') and key not in fields:
+                    fields[key] = value.strip()
+    except OSError:
+        return None
+    if 'Name' not in fields or 'Version' not in fields:
+        return None
+    return fields['Name'], fields['Version']
+
+
+def _distributions(sites: list[Path]) -> dict[str, _Dist]:
+    """ The distributions installed in `sites`, by canonical name. """
+    dists: dict[str, _Dist] = {}
+    for site in sites:
+        for entry in sorted(os.scandir(site), key=lambda e: e.name):
+            path = Path(entry.path)
+            dist: _Dist|None = None
+            if entry.name.endswith('.dist-info'):
+                meta = _read_metadata(path / 'METADATA')
+                if meta is None:
+                    continue
+                direct_url = None
+                try:
+                    direct_url = json.loads((path / 'direct_url.json').read_text())
+                except (OSError, ValueError):
+                    pass
+                editable = None
+                if direct_url and direct_url.get('dir_info', {}).get('editable'):
+                    url = direct_url.get('url', '')
+                    editable = url[len('file://'):] if url.startswith('file://') else url
+                dist = _Dist(*meta, direct_url, editable)
+            elif entry.name.endswith('.egg-info'):
+                meta = _read_metadata(path / 'PKG-INFO' if entry.is_dir() else path)
+                if meta is not None:
+                    dist = _Dist(*meta)
+            elif entry.name.endswith('.egg-link'):
+                # Legacy `setup.py develop` installs point at the project.
+                location = Path(path.read_text().splitlines()[0].strip())
+                for info in location.glob('*.egg-info'):
+                    meta = _read_metadata(info / 'PKG-INFO')
+                    if meta is not None:
+                        dist = _Dist(*meta, editable=str(location))
+                        break
+            if dist is not None:
+                dists.setdefault(_canonical_name(dist.name), dist)
+    return dists
+
+
+def _under_vcs(location: str) -> bool:
+    path = Path(location).resolve()
+    return any(
+        (d / marker).exists()
+        for d in (path, *path.parents)
+        for marker in ('.git', '.hg', '.svn', '.bzr')
     )
+
+
+def _direct_reference(name: str, direct_url: dict[str, Any]) -> str:
+    """ Formats a PEP 610 direct URL as `pip freeze` does. """
+    url = direct_url.get('url', '')
+    fragments: list[str] = []
+    if 'vcs_info' in direct_url:
+        vcs = direct_url['vcs_info']
+        url = f"{vcs.get('vcs')}+{url}@{vcs.get('commit_id')}"
+    elif direct_url.get('archive_info', {}).get('hash'):
+        fragments.append(direct_url['archive_info']['hash'])
+    if direct_url.get('subdirectory'):
+        fragments.append(f"subdirectory={direct_url['subdirectory']}")
+    if fragments:
+        url += '#' + '&'.join(fragments)
+    return f"{name} @ {url}"
+
+# --- Lockfile sync
+
+_re_pinned = re.compile(r'^([A-Za-z0-9][A-Za-z0-9._-]*)(\[[^\]]*\])?\s*==\s*([^\s;]+)$')
+_re_direct = re.compile(r'^([A-Za-z0-9][A-Za-z0-9._-]*)(\[[^\]]*\])?\s*@\s*(\S+)$')
+_re_vcs_url = re.compile(r'^(git|hg|svn|bzr)\+')
+_re_egg = re.compile(r'#(?:.*&)?egg=([A-Za-z0-9][A-Za-z0-9._-]*)')
+_re_include = re.compile(r'^(-[rc]|--requirement|--constraint)(?:\s*=\s*|\s*)(\S.*)$')
+_sync_cache: dict[str, list[Any]] = {}
+_marker_envs: dict[str, tuple[int, dict[str, str]]] = {}
+
+# Prints the PEP 508 marker environment (as `packaging.markers.default_environment`).
+_marker_env_script = '''
+import json, os, platform, sys
+v = sys.implementation.version
+iv = f"{v.major}.{v.minor}.{v.micro}"
+if v.releaselevel != "final":
+    iv += v.releaselevel[0] + str(v.serial)
+print(json.dumps(dict(
+    implementation_name=sys.implementation.name,
+    implementation_version=iv,
+    os_name=os.name,
+    platform_machine=platform.machine(),
+    platform_release=platform.release(),
+    platform_system=platform.system(),
+    platform_version=platform.version(),
+    python_full_version=platform.python_version(),
+    platform_python_implementation=platform.python_implementation(),
+    python_version=".".join(platform.python_version_tuple()[:2]),
+    sys_platform=sys.platform,
+)))
+'''
+
+
+def _marker_environment(prefix: Path) -> dict[str, str]:
+    # Queried from the venv's interpreter once, until the venv is recreated.
+    key = (prefix / 'pyvenv.cfg').stat().st_mtime_ns
+    cached = _marker_envs.get(os.path.abspath(prefix))
+    if cached is None or cached[0] != key:
+        env = json.loads(_py(prefix, '-c', _marker_env_script).out)
+        cached = _marker_envs[os.path.abspath(prefix)] = (key, env)
+    return cached[1]
+
+
+def _marker_applies(prefix: Path, marker: str) -> bool:
+    try:
+        from packaging.markers import Marker
+    except ImportError:
+        from pip._vendor.packaging.markers import Marker
+    return Marker(marker).evaluate(_marker_environment(prefix))
+
+
+def _lock_lines(lockfile: Path, files: list[Path]) -> list[tuple[str, Path]]:
+    """
+    The logical lines of a requirements file, without comments, each with
+    the directory its relative paths are against. Files named by `-r` are
+    read in place and, like `lockfile`, appended to `files`. Constraint
+    files (`-c`) are rejected: a lock pins everything itself.
+    """
+    if lockfile.resolve() in (f.resolve() for f in files):
+        raise ValueError(f"Requirements file included twice: {lockfile}")
+    files.append(lockfile)
+    lines: list[tuple[str, Path]] = []
+    for line in re.sub(r'\\\n', ' ', lockfile.read_text()).splitlines():
+        line = re.sub(r'(^|\s)#.*$', '', line).strip()
+        if not line:
+            continue
+        include = _re_include.match(line)
+        if include is None:
+            lines.append((line, lockfile.parent))
+        elif include.group(1) in ('-c', '--constraint'):
+            raise ValueError(f"Unsupported constraints in lockfile {lockfile}: {line!r}")
+        else:
+            lines += _lock_lines(lockfile.parent / include.group(2), files)
+    return lines
+
+
+def sync_venv(prefix: Path, lockfile: Path, **sp_kwargs: Any) -> None:
+    """
+    Makes the venv at `prefix` match `lockfile`, a fully pinned requirements
+    file (`name==version`, `name @ url` and `-e path` lines, with optional
+    hashes, markers and index options). `-r` files are read as part of it.
+
+    Installed distributions are read from metadata and compared with the
+    lock; packages not in the lock are uninstalled (except pip, setuptools
+    and wheel), and missing or changed ones are installed in one
+    `pip install --no-deps` run. Nothing is run when the venv already
+    matches, and a repeated call with an unchanged lockfile and
+    site-packages returns straight away.
+    """
+    files: list[Path] = []
+    lines = _lock_lines(lockfile, files)
+    sites = _site_packages(prefix)
+    key = [
+        [ (str(f.resolve()), f.stat().st_mtime_ns) for f in files ],
+        [ (str(d), d.stat().st_mtime_ns) for d in sites ]
+    ]
+    if _sync_cache.get(os.path.abspath(prefix)) == key:
+        return
+    installed = _distributions(sites)
+    editables = {
+        Path(d.editable).resolve(): name
+        for name, d in installed.items() if d.editable is not None
+    }
+    options: list[str] = []
+    wanted: set[str] = set()
+    install: list[str] = []
+    for line, base in lines:
+        if line.startswith(('-e ', '--editable ', '--editable=')):
+            location = re.split(r'[\s=]', line, maxsplit=1)[1].strip()
+            if _re_vcs_url.match(location):
+                # A VCS checkout, named by its `#egg=` fragment.
+                egg = _re_egg.search(location)
+                name = egg and _canonical_name(egg.group(1))
+                if name not in editables.values():
+                    name = None
+            else:
+                name = editables.get((base / location).resolve())
+                line = f'-e {(base / location).resolve()}'
+            if name is not None:
+                wanted.add(name)
+            else:
+                install.append(line)
+            continue
+        if line.startswith('-'):
+            options.append(line)
+            continue
+        req, _, marker = line.partition(';')
+        req = re.sub(r'\s--hash[=\s]\S+', '', req).strip()
+        if marker and not _marker_applies(prefix, marker.split('--hash')[0].strip()):
+            continue
+        pinned = _re_pinned.match(req)
+        direct = _re_direct.match(req)
+        if not (pinned or direct):
+            raise ValueError(f"Unsupported (unpinned?) lockfile line: {line!r}")
+        name = _canonical_name((pinned or direct).group(1))  # type: ignore
+        wanted.add(name)
+        dist = installed.get(name)
+        if dist is not None and dist.editable is None and (
+            (pinned and dist.version == pinned.group(3))
+            or (direct and dist.direct_url is not None and _direct_reference(
+                direct.group(1), dist.direct_url
+            ) == f"{direct.group(1)} @ {direct.group(3)}")
+        ):
+            continue
+        install.append(line)
+
+    extras = sorted(
+        set(installed) - wanted - set(_template_packages)
+    )
+    if extras:
+        print(f"Uninstalling {len(extras)} packages not in {lockfile.name}.")
+        _pip(prefix, 'uninstall', '--yes', *extras, **sp_kwargs).check()
+    if install:
+        print(f"Installing {len(install)} packages from {lockfile.name}.")
+        with tempfile.TemporaryDirectory() as tmp:
+            requirements = Path(tmp) / 'requirements.txt'
+            requirements.write_text('\n'.join(options + install) + '\n')
+            cmd_stream(
+                [
+                    prefix / 'bin' / 'python', '-m', 'pip', 'install',
+                    '--no-deps', '-r', requirements
+                ],
+                cwd = lockfile.parent,
+                **sp_kwargs
+            ).check()
+    if extras or install:
+        sites = _site_packages(prefix)
+        key[1] = [ (str(d), d.stat().st_mtime_ns) for d in sites ]
+    _sync_cache[os.path.abspath(prefix)] = key
+
+
+def create_venv(prefix: Path, clear: bool = False, template: bool = True):
+    """
+    Creates a venv at `prefix` with an up-to-date pip, setuptools and wheel.
+    If `template` is True and a new venv is being made (`prefix` does not
+    exist, or `clear`), it is cloned from a cached template venv instead of
+    being built from scratch; its packages are then up to a week old.
+    """
+    if template and fcntl is not None and (clear or not prefix.exists()):
+        source = _venv_template()
+        with trace_span('venv.clone', prefix=str(prefix)):
+            if clear:
+                shutil.rmtree(prefix, ignore_errors=True)
+            _clone_venv(source, prefix)
+        return
+    _build_venv(prefix, clear)
+
+def _build_venv(prefix: Path, clear: bool) -> None:
+    with trace_span('venv.create', prefix=str(prefix)):
+        venv.create(
+            str(prefix),
+            with_pip = True,
+            clear = clear
+        )
     pip_install(prefix, 'pip', upgrade=True)
-    pip_install(prefix, 'setuptools', 'wheel')
+    pip_install(prefix, *_template_packages[1:])
+
+
+# --- Venv templates
+#
+# A template venv is built once per interpreter, base package set and week
+# (so that new venvs pick up new pip releases) under
+# `cache_dir('venv-templates')`, and never modified afterwards. New venvs
+# are cloned from it file by file (reflink, else copy; never hardlinked, as
+# a write in place in one venv would change the template), with the files
+# that embed the venv's own path (`bin/` scripts, `pyvenv.cfg`) rewritten
+# for the new prefix.
+
+_template_packages = ('pip', 'setuptools', 'wheel')
+_template_max_age_s = 7 * 24 * 3600
+
+
+@contextmanager
+def _file_lock(path: Path) -> Iterator[None]:
+    """ Holds an exclusive lock on `path`, across processes (POSIX only). """
+    os.makedirs(path.parent, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with path.open('a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _venv_template() -> Path:
+    period = int(time.time() // _template_max_age_s)
+    key = hashlib.sha256(json.dumps([
+        str(Path(sys.executable).resolve()), sys.version, _template_packages,
+        period
+    ]).encode()).hexdigest()[:16]
+    root = cache_dir('venv-templates')
+    template = root / key
+    complete = root / f'{key}.complete'
+    if complete.exists():
+        return template
+    with _file_lock(root / f'{key}.lock'):
+        if not complete.exists():  # Another job may have built it meanwhile.
+            print(f"Building venv template {template}.")
+            shutil.rmtree(template, ignore_errors=True)
+            _build_venv(template, clear=False)
+            complete.touch()
+            _prune_templates(root)
+    return template
+
+
+def _prune_templates(root: Path) -> None:
+    # Templates from two periods ago can no longer be picked for a clone.
+    expired = time.time() - 2 * _template_max_age_s
+    for complete in root.glob('*.complete'):
+        if complete.stat().st_mtime < expired:
+            complete.unlink()
+            shutil.rmtree(root / complete.stem, ignore_errors=True)
+            root.joinpath(f'{complete.stem}.lock').unlink(missing_ok=True)
+
+
+def _clone_venv(template: Path, prefix: Path) -> None:
+    # (venv.create records paths via `os.path.abspath`.)
+    old = os.fsencode(os.path.abspath(template))
+    new = os.fsencode(os.path.abspath(prefix))
+    copier = FileCopier()
+    for dirpath, dirnames, filenames in os.walk(template):
+        source_dir = Path(dirpath)
+        target_dir = prefix / source_dir.relative_to(template)
+        os.makedirs(target_dir, exist_ok=True)
+        for name in list(dirnames) + filenames:
+            src = source_dir / name
+            dst = target_dir / name
+            if src.is_symlink():
+                os.symlink(os.readlink(src), dst)
+                if name in dirnames:
+                    dirnames.remove(name)
+            elif name in dirnames:
+                continue
+            elif target_dir.name == 'bin' or name == 'pyvenv.cfg':
+                dst.write_bytes(src.read_bytes().replace(old, new))
+                shutil.copymode(src, dst)
+            else:
+                copier.copy(src, dst)
@@ -0,0 +1,168 @@
+import os, re
+from pathlib import Path
+from typing import Iterable, Iterator
+
+
+class PathMatcher:
+    """
+    Matches `/`-separated relative paths against name suffixes (e.g.
+    `'__pycache__'`, `'.egg-info'`) and gitignore-style patterns, compiled into
+    one regular expression.
+    Supported pattern syntax: `*`, `?`, `[...]`, `**`, a leading `/` or an
+    inner `/` to anchor at the root, a trailing `/` to match only directories,
+    and a leading `!` to re-include (later patterns win).
+    """
+
+    def __init__(
+        self,
+        suffixes: Iterable[str] = (),
+        patterns: Iterable[str] = ()
+    ):
+        self.suffixes = tuple(suffixes)
+        self.patterns = tuple(p for p in patterns if p.strip() and not p.startswith('#'))
+        rules = []  # (regex, dir_only, negated), in order
+        if self.suffixes:
+            rules.append((
+                r'(?:.*/)?[^/]*(?:' + '|'.join(map(re.escape, self.suffixes)) + ')',
+                False, False
+            ))
+        rules.extend(_compile_pattern(p) for p in self.patterns)
+        if any(negated for _, _, negated in rules):
+            # Re-includes depend on order, so check each rule in turn
+            self._ordered = [
+                (re.compile(rx, re.S), dir_only, negated)
+                for rx, dir_only, negated in rules
+            ]
+            self._any = self._dirs = None
+        else:
+            self._ordered = None
+            self._any = _alternation(rx for rx, dir_only, _ in rules if not dir_only)
+            self._dirs = _alternation(rx for rx, _, _ in rules)
+
+    def __bool__(self) -> bool:
+        return bool(self.suffixes or self.patterns)
+
+    def __call__(self, rel: str, is_dir: bool = False) -> bool:
+        """Checks one entry (but not its parent directories)."""
+        if self._ordered is None:
+            regex = self._dirs if is_dir else self._any
+            return regex is not None and regex.fullmatch(rel) is not None
+        ignored = False
+        for regex, dir_only, negated in self._ordered:
+            if (is_dir or not dir_only) and regex.fullmatch(rel):
+                ignored = not negated
+        return ignored
+
+    def match_path(self, rel: str, is_dir: bool = False) -> bool:
+        """Checks a path, including whether any parent directory matches."""
+        parts = rel.split('/')
+        return any(
+            self('/'.join(parts[:i]), is_dir=True) for i in range(1, len(parts))
+        ) or self(rel, is_dir)
+
+
+def _alternation(regexes: Iterable[str]) -> re.Pattern|None:
+    regexes = list(regexes)
+    if not regexes: return None
+    return re.compile('|'.join(f'(?:{rx})' for rx in regexes), re.S)
+
+
+def _compile_pattern(pattern: str) -> tuple[str, bool, bool]:
+    """Translates a gitignore-style pattern to `(regex, dir_only, negated)`."""
+    pattern = pattern.rstrip('\n')
+    if pattern.endswith(' ') and not pattern.endswith('\\ '):
+        pattern = pattern.rstrip(' ')
+    negated = pattern.startswith('!')
+    if negated or pattern.startswith('\\!') or pattern.startswith('\\#'):
+        pattern = pattern[1:]
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    out = [] if anchored else ['(?:.*/)?']
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i) and (i == 0 or pattern[i - 1] == '/'):
+            out.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('**', i) and i + 2 == len(pattern) and (i == 0 or pattern[i - 1] == '/'):
+            out.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[' and (end := pattern.find(']', i + 2)) != -1:
+            body = pattern[i + 1 : end]
+            if body[0] in '!^':
+                body = '^' + body[1:]
+            out.append('[' + body.replace('\\', '\\\\') + ']')
+            i = end
+        elif c == '\\' and i + 1 < len(pattern):
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out), dir_only, negated
+
+
+def read_ignore_file(path: Path) -> list[str]:
+    """Reads the patterns from a `.gitignore`-style file (none if missing)."""
+    try:
+        return path.read_text().splitlines()
+    except FileNotFoundError:
+        return []
+
+
+def scan_dir(
+    root: Path|str,
+    rel: str = '',
+    ignore: PathMatcher|None = None,
+    follow_symlinks: bool = False
+) -> tuple[list[os.DirEntry], list[os.DirEntry]]:
+    """
+    Lists the directory `rel` under `root` as `(files, subdirectories)`,
+    leaving out ignored entries. "Files" are all entries that are not
+    directories (or, without `follow_symlinks`, are links to them).
+    """
+    files, subdirs = [], []
+    with os.scandir(os.path.join(root, rel)) as it:
+        for entry in it:
+            path = f'{rel}/{entry.name}' if rel else entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+            except OSError:
+                is_dir = False
+            if ignore and ignore(path, is_dir): continue
+            (subdirs if is_dir else files).append(entry)
+    return files, subdirs
+
+
+def walk(
+    root: Path|str,
+    ignore: PathMatcher|None = None,
+    follow_symlinks: bool = False
+) -> Iterator[tuple[str, os.DirEntry]]:
+    """
+    Yields `(relative path, entry)` for every file under `root`. Ignored
+    directories are never entered. Entries keep the type (and, on Windows,
+    stat) data `os.scandir` read with them, so most callers need no further
+    syscalls to filter them.
+    """
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        try:
+            files, subdirs = scan_dir(root, rel, ignore, follow_symlinks)
+        except OSError:
+            continue
+        for entry in files:
+            yield (f'{rel}/{entry.name}' if rel else entry.name), entry
+        stack.extend(
+            f'{rel}/{entry.name}' if rel else entry.name
+            for entry in reversed(subdirs)
+        )